@@ -0,0 +1,67 @@
+import threading
+
+from history import METRICS
+
+
+class ThresholdEngine:
+    """Evaluates readings against each device's limits on the server.
+
+    Limits live in an in-memory index keyed by device id, so evaluating a
+    reading never touches the database. A device raises its alarm when any
+    metric reaches its limit and clears it only once every metric has dropped
+    ``hysteresis`` (a fraction of the limit) below it. A new state must hold
+    for ``debounce`` consecutive readings before it counts, and
+    ``on_transition`` is called exactly once per transition.
+    """
+
+    def __init__(self, on_transition, hysteresis=0.05, debounce=3):
+        self.on_transition = on_transition  # on_transition(device_id, active, metrics)
+        self.hysteresis = hysteresis
+        self.debounce = debounce
+        self._limits = {}  # device_id -> tuple aligned with METRICS
+        self._state = {}  # device_id -> [alarm active, consecutive contrary readings]
+        self._lock = threading.Lock()
+
+    def set_limits(self, device_id, limits):
+        """limits: {'light': .., 'humidity': .., 'temperature': .., 'smoke': ..}"""
+        self._limits[device_id] = tuple(limits.get(m) for m in METRICS)
+
+    def remove(self, device_id):
+        self._limits.pop(device_id, None)
+        self._state.pop(device_id, None)
+
+    def evaluate(self, device_id, reading):
+        limits = self._limits.get(device_id)
+        if limits is None:
+            return None
+        state = self._state.get(device_id)
+        if state is None:
+            state = self._state.setdefault(device_id, [False, 0])
+
+        over = []
+        above_clear = False
+        for metric, limit in zip(METRICS, limits):
+            value = reading.get(metric)
+            if limit is None or value is None:
+                continue
+            if value >= limit:
+                over.append(metric)
+            elif value > limit - abs(limit) * self.hysteresis:
+                above_clear = True
+
+        with self._lock:
+            active = state[0]
+            if active:
+                contrary = not over and not above_clear
+            else:
+                contrary = bool(over)
+            if not contrary:
+                state[1] = 0
+                return None
+            state[1] += 1
+            if state[1] < self.debounce:
+                return None
+            state[0] = not active
+            state[1] = 0
+        self.on_transition(device_id, state[0], over)
+        return state[0]
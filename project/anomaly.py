@@ -0,0 +1,246 @@
+"""Streaming per-device statistics and anomaly detection.
+
+Every device gets one row in a set of NumPy arrays with a column per metric:
+running mean and variance (Welford), an exponentially weighted mean, the
+last value, a reference value and its time (for the rate of change) and a
+small ring of the last ``window`` values (for the rolling min/max). Memory
+per device is fixed, whatever the number of readings.
+
+``observe`` only stages a reading; every ``tick`` seconds ``evaluate``
+updates the statistics of all devices that reported and checks them in a
+handful of array operations. A device that reported several times within
+one tick is processed in that many passes, so no reading is skipped.
+
+Values more than ``z`` standard deviations off are clipped before they
+enter the statistics, so a lone spike does not shift the baseline.
+Three kinds of anomaly are reported, once the metric has ``warmup``
+readings:
+
+* ``spike``: a value more than ``z`` standard deviations from the EWMA;
+* ``drift``: the EWMA further from the long-run mean than ``drift`` times
+  its own standard deviation (an EWMA control chart);
+* ``rate``: a change faster than ``max_rate[metric]`` per second,
+  measured against the last reading at least ``min_dt`` seconds older, so
+  readings that arrive close together do not turn timing jitter into a
+  huge rate.
+
+Each is reported once when it starts, not again until a reading of that
+metric is back to normal.
+"""
+import logging
+import threading
+
+from history import METRICS
+
+logger = logging.getLogger(__name__)
+
+KINDS = ('spike', 'drift', 'rate')
+
+
+class AnomalyDetector:
+    def __init__(self, socketio, on_anomaly, tick=1.0, z=4.0, drift=4.0, alpha=0.1,
+                 warmup=30, window=30, max_rate=None, min_dt=10.0, max_pending=16):
+        self.socketio = socketio
+        self.on_anomaly = on_anomaly  # on_anomaly(list of anomaly dicts), once per tick
+        self.tick = tick
+        self.z = z
+        self.drift = drift
+        self.alpha = alpha
+        self._ewma_spread = (alpha / (2 - alpha)) ** 0.5
+        self.warmup = warmup
+        self.window = window
+        self.max_rate = tuple((max_rate or {}).get(m, float('inf')) for m in METRICS)
+        self.min_dt = min_dt  # shortest interval a rate is measured over
+        self.max_pending = max_pending  # staged readings per device before an early evaluation
+        self._rows = {}  # device id -> row
+        self._ids = []  # row -> device id, None when free
+        self._free = []
+        self._capacity = 0
+        self._started = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def observe(self, device_id, ts, reading):
+        """Stage one reading (a dict with the METRICS keys) taken at ``ts``"""
+        values = [float('nan') if reading.get(m) is None else reading[m] for m in METRICS]
+        found = None
+        with self._lock:
+            row = self._rows.get(device_id)
+            if row is None:
+                row = self._allocate(device_id)
+            if self._depth[row] == self.max_pending:
+                found = self._fold()  # a backlog upload; evaluate now rather than drop readings
+            layer = self._depth[row]
+            self._depth[row] = layer + 1
+            self._pending[layer, row] = values
+            self._pending_ts[layer, row] = ts
+            if not self._started:
+                self._started = True
+                self.socketio.start_background_task(self._run)
+        if found:
+            self.on_anomaly(found)
+
+    def remove(self, device_id):
+        with self._lock:
+            row = self._rows.pop(device_id, None)
+            if row is not None:
+                self._depth[row] = 0
+                self._ids[row] = None
+                self._free.append(row)
+
+    def stats(self, device_id):
+        """Current statistics of one device, per metric, or None"""
+        import numpy as np
+        with self._lock:
+            row = self._rows.get(device_id)
+            if row is None:
+                return None
+            n = self._n[row].copy()
+            mean, ewma, last = self._mean[row].copy(), self._ewma[row].copy(), self._last[row].copy()
+            std = np.sqrt(self._m2[row] / np.maximum(n - 1, 1))
+            low, high = np.fmin.reduce(self._ring[row], axis=0), np.fmax.reduce(self._ring[row], axis=0)
+        return {metric: {'count': int(n[i]), 'mean': _num(mean[i]) if n[i] else None, 'std': _num(std[i]),
+                         'ewma': _num(ewma[i]), 'last': _num(last[i]),
+                         'min': _num(low[i]), 'max': _num(high[i])}
+                for i, metric in enumerate(METRICS)}
+
+    # -------------------- Evaluation --------------------
+
+    def evaluate(self):
+        """Fold every staged reading into the statistics; returns the anomalies found"""
+        with self._lock:
+            found = self._fold() if self._capacity else []
+        if found:
+            self.on_anomaly(found)
+        return found
+
+    def _fold(self):
+        """Process the staged readings, one pass per reading of the busiest device"""
+        import numpy as np
+        found = []
+        depth = self._depth.copy()
+        self._depth[:] = 0
+        for layer in range(int(depth.max())):
+            rows = np.flatnonzero(depth > layer)
+            found.extend(self._step(np, rows, self._pending[layer, rows], self._pending_ts[layer, rows]))
+        return found
+
+    def _step(self, np, rows, x, ts):
+        """One reading for each of ``rows``: x is (rows, metrics), NaN where absent"""
+        valid = ~np.isnan(x)
+        n = self._n[rows]
+        mean, m2, ewma = self._mean[rows], self._m2[rows], self._ewma[rows]
+        std = np.sqrt(m2 / np.maximum(n - 1, 1))
+        warm = valid & (n >= self.warmup) & (std > 0)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            spike = warm & (np.abs(x - ewma) > self.z * std)
+            # The rate is measured from a reference reading that only moves
+            # on once min_dt has passed; NaN means there is none yet
+            ref, ref_ts = self._ref[rows], self._ref_ts[rows]
+            dt = ts[:, None] - ref_ts
+            due = valid & ~(dt < self.min_dt)
+            rate = np.where(due & (dt > 0), (x - ref) / dt, np.nan)
+            fast = warm & due & (np.abs(rate) > np.asarray(self.max_rate))
+
+        # Welford and EWMA updates, only where the metric has a value. Spikes
+        # are clipped to z standard deviations first, so one bad reading
+        # moves neither the baseline nor the EWMA much; a lasting shift
+        # still pulls the EWMA over
+        y = np.where(warm, np.clip(x, ewma - self.z * std, ewma + self.z * std), x)
+        n = n + valid
+        delta = np.where(valid, y - mean, 0.0)
+        mean = mean + delta / np.maximum(n, 1)
+        m2 = m2 + np.where(valid, delta * (y - mean), 0.0)
+        ewma = np.where(valid, np.where(np.isnan(ewma), y, ewma + self.alpha * (y - ewma)), ewma)
+        # The EWMA of a steady series varies by std * sqrt(alpha / (2 - alpha))
+        drift = warm & (np.abs(ewma - mean) > self.drift * self._ewma_spread * std)
+
+        self._n[rows], self._mean[rows], self._m2[rows], self._ewma[rows] = n, mean, m2, ewma
+        self._last[rows] = np.where(valid, x, self._last[rows])
+        self._ref[rows] = np.where(due, x, ref)
+        self._ref_ts[rows] = np.where(due, ts[:, None], ref_ts)
+        slots = self._slot[rows]
+        self._ring[rows, slots] = np.where(valid, x, self._ring[rows, slots])
+        self._slot[rows] = (slots + 1) % self.window
+
+        # Only the first reading of an episode is reported
+        found_now = np.stack([spike, drift, fast], axis=1)  # (row, kind, metric)
+        active = self._active[rows]
+        hits = found_now & ~active
+        judged = np.stack([valid, valid, due], axis=1)
+        self._active[rows] = np.where(judged, found_now, active)
+        if not hits.any():
+            return []
+        found = []
+        for r, k, m in zip(*np.nonzero(hits)):
+            row = rows[r]
+            window = self._ring[row, :, m]
+            found.append({
+                'device_id': self._ids[row], 'metric': METRICS[m], 'kind': KINDS[k],
+                'ts': float(ts[r]), 'value': _num(x[r, m]), 'mean': _num(mean[r, m]),
+                'std': _num(std[r, m]), 'ewma': _num(ewma[r, m]), 'rate': _num(rate[r, m]),
+                'min': _num(np.fmin.reduce(window)), 'max': _num(np.fmax.reduce(window)),
+            })
+        return found
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.tick)
+            try:
+                self.evaluate()
+            except Exception:
+                logger.exception('Anomaly evaluation failed')
+
+    # -------------------- Storage --------------------
+
+    def _allocate(self, device_id):
+        if not self._free:
+            self._grow(max(64, self._capacity * 2))
+        row = self._free.pop()
+        self._rows[device_id] = row
+        self._ids[row] = device_id
+        self._n[row] = 0
+        self._mean[row] = self._m2[row] = 0.0
+        self._ewma[row] = self._last[row] = float('nan')
+        self._ref[row] = self._ref_ts[row] = float('nan')
+        self._ring[row] = float('nan')
+        self._slot[row] = 0
+        self._active[row] = False
+        return row
+
+    def _grow(self, capacity):
+        import numpy as np
+        old, metrics = self._capacity, len(METRICS)
+
+        def resized(name, shape, dtype, fill, axis=0):
+            array = np.full(shape, fill, dtype=dtype)
+            if old:
+                index = (slice(None),) * axis + (slice(0, old),)
+                array[index] = getattr(self, name)
+            setattr(self, name, array)
+
+        resized('_n', (capacity, metrics), np.int64, 0)
+        resized('_mean', (capacity, metrics), np.float64, 0.0)
+        resized('_m2', (capacity, metrics), np.float64, 0.0)
+        resized('_ewma', (capacity, metrics), np.float64, np.nan)
+        resized('_last', (capacity, metrics), np.float64, np.nan)
+        resized('_ref', (capacity, metrics), np.float64, np.nan)
+        resized('_ref_ts', (capacity, metrics), np.float64, np.nan)
+        resized('_ring', (capacity, self.window, metrics), np.float32, np.nan)
+        resized('_slot', capacity, np.int64, 0)
+        resized('_active', (capacity, len(KINDS), metrics), bool, False)
+        resized('_depth', capacity, np.int64, 0)
+        resized('_pending', (self.max_pending, capacity, metrics), np.float64, np.nan, axis=1)
+        resized('_pending_ts', (self.max_pending, capacity), np.float64, np.nan, axis=1)
+        self._ids.extend([None] * (capacity - old))
+        self._free.extend(range(capacity - 1, old - 1, -1))
+        self._capacity = capacity
+
+
+def _num(value):
+    """NumPy scalar -> float rounded for the wire, None for NaN"""
+    value = float(value)
+    return None if value != value else round(value, 4)
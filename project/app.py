@@ -1,34 +1,249 @@
-from flask import Flask, render_template, redirect, url_for, request, session, flash, jsonify
+from runtime import ASYNC_MODE  # first: patches the stdlib in green-thread modes
+from flask import Flask, render_template, redirect, url_for, request, session, flash, jsonify, g, send_from_directory
+from flask import appcontext_pushed
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
-import logging
-from flask_socketio import SocketIO, emit
-import random
+from werkzeug.security import generate_password_hash
+import os
+from flask_socketio import SocketIO, emit, join_room, leave_room
 import time
 import threading
-import requests
 from datetime import datetime
 # from flask_cors import CORS
-from flask_migrate import Migrate
+import click
+from poller import SensorPoller, room_for
+from ingest import ReadingBuffer, parse_readings, parse_timestamp
+import history
+import rollup
+from alarms import ThresholdEngine
+from anomaly import AnomalyDetector
+import export
+from commands import CommandDispatcher
+from transport import DeviceClient
+from passwords import PasswordHasher, Saturated
+from registry import DeviceRegistry, check_host, new_ingest_key
+from broadcast import FrameBatcher, view_room, view_devices, VIEW_PREFIX
+from messaging import ConnectionStats, LocalBrokerManager, bus_for, store_for
+from cache import TTLCache
+from hotwindow import HotWindow
+from database import database_url, engine_options
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from logconfig import configure_logging
+from metrics import Registry
+from profiling import Profiler, ReportStore
+import uuid
+import atexit
+import hashlib
+import mimetypes
+import assets
 
 # -------------------- Initializing --------------------
 
+# Importing this module only declares the app: create_app() (see Application
+# Factory below) sets up logging and binds the extensions, and the database
+# is not touched before `flask --app app.py init-db` or the first request.
+
+DEBUG = os.environ.get('FLASK_DEBUG', '0') == '1'
+
 app = Flask(__name__)
-app.debug = True
+app.debug = DEBUG
 app.secret_key = 'your_secret_key'  
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///users.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url()  # SQLite by default, postgresql://... in production
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = 'secret!'  # For SocketIO
 
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
-
-
-# Set up logging
-logging.basicConfig(filename='error.log', level=logging.DEBUG)
-
-# Initialize SocketIO
-socketio = SocketIO(app, cors_allowed_origins="http://127.0.0.1:5000")
+db = SQLAlchemy()
+
+# Multi-process settings. With several workers behind a load balancer (sticky
+# sessions), emits go through a message queue: redis://... in production or
+# local://host:port for the in-repo broker (see misc/run_workers.py). Only one
+# worker should run the background jobs (device polling, compaction).
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+BACKGROUND_JOBS = os.environ.get('BACKGROUND_JOBS', '1') == '1'
+CORS_ALLOWED_ORIGINS = os.environ.get('CORS_ALLOWED_ORIGINS', 'http://127.0.0.1:5000').split(',')
+
+# Handlers are registered now, the server is set up by create_app()
+socketio = SocketIO()
+
+# One keep-alive HTTP client for all device I/O (polling and commands)
+device_client = DeviceClient(timeout=3)
+
+# Password hashing runs on a few OS threads with a bounded queue; changing
+# the method re-hashes each password at its next login
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')  # e.g. pbkdf2:sha256:600000
+password_hasher = PasswordHasher(method=PASSWORD_HASH_METHOD,
+                                 workers=int(os.environ.get('PASSWORD_HASH_WORKERS', 2)),
+                                 max_pending=int(os.environ.get('PASSWORD_HASH_QUEUE', 16)),
+                                 async_mode=ASYNC_MODE)
+
+# Tells the other workers about device changes made through this one
+event_bus = bus_for(SOCKETIO_MESSAGE_QUEUE)
+WORKER_ID = uuid.uuid4().hex
+bus_handlers = {}  # channel -> handler, subscribed by create_app()
+
+# Connected clients and room sizes, shared by all workers through the queue;
+# with Redis each worker's counts expire when it stops renewing them
+connection_stats = ConnectionStats(store_for(SOCKETIO_MESSAGE_QUEUE, WORKER_ID))
+
+
+
+# -------------------- Profiling --------------------
+
+# Off unless configured here or at runtime through POST /admin/profiling.
+# PROFILE_ROUTES takes endpoint names, paths or Socket.IO events, e.g.
+# "dashboard,/api/thresholds,request_sensor_data"; see profiling.py.
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+
+profiler = Profiler(ReportStore(PROFILE_DIR, keep=int(os.environ.get('PROFILE_KEEP', 50))),
+                    percent=float(os.environ.get('PROFILE_PERCENT', 0)),
+                    routes=[r for r in os.environ.get('PROFILE_ROUTES', '').split(',') if r],
+                    slow_ms=float(os.environ.get('PROFILE_SLOW_MS', 0)),
+                    mode=os.environ.get('PROFILE_MODE', 'sampling'),
+                    interval=float(os.environ.get('PROFILE_INTERVAL_MS', 10)) / 1000,
+                    async_mode=ASYNC_MODE)
+
+@app.before_request
+def start_profile():
+    g.profile = profiler.start(request.endpoint or 'unmatched', request.path, method=request.method)
+
+@app.after_request
+def finish_profile(response):
+    profiler.finish(g.pop('profile', None), status=response.status_code)
+    return response
+
+@app.teardown_request
+def abandon_profile(error=None):
+    profiler.finish(g.pop('profile', None), status=500, error=repr(error))
+
+def is_admin():
+    """Admin rights follow user.is_admin, set by init-db and set-admin, never the (changeable) name"""
+    user = current_user()
+    return user is not None and user['is_admin']
+
+def on_profiling_event(message):
+    if message['origin'] != WORKER_ID:
+        profiler.configure(**message['settings'])
+
+bus_handlers['profiling'] = on_profiling_event
+
+@app.route('/admin/profiling', methods=['GET', 'POST'])
+def profiling_settings():
+    """Current settings and reports; POST {"percent", "routes", "slow_ms", "mode"} changes them on every worker"""
+    if not is_admin():
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        changes = {key: data[key] for key in ('percent', 'routes', 'slow_ms', 'mode') if key in data}
+        try:
+            profiler.configure(**changes)
+        except (ValueError, TypeError) as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        event_bus.publish('profiling', {'origin': WORKER_ID, 'settings': profiler.settings()})
+    return jsonify({'success': True, 'settings': profiler.settings(), 'reports': profiler.store.reports()})
+
+@app.route('/admin/profiles/<path:filename>')
+def download_profile(filename):
+    """A report (.txt) or, in cprofile mode, its pstats dump (.prof)"""
+    if not is_admin():
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    return send_from_directory(PROFILE_DIR, filename, as_attachment=True)
+
+
+# -------------------- Metrics --------------------
+
+# Prometheus text format on /metrics. Every worker keeps its own numbers, so
+# scrape each worker (or each port of misc/run_workers.py) separately.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # when set, scrapes need "Authorization: Bearer <token>"
+
+metrics = Registry(green=ASYNC_MODE != 'threading')
+http_request_seconds = metrics.histogram(
+    'http_request_duration_seconds', 'Flask request latency', ('endpoint', 'method', 'status'))
+socketio_event_seconds = metrics.histogram(
+    'socketio_event_duration_seconds', 'Socket.IO handler latency', ('event',))
+device_request_seconds = metrics.histogram(
+    'device_request_duration_seconds', 'HTTP calls to the boards, per device host', ('host', 'method'))
+device_request_errors = metrics.counter(
+    'device_request_errors_total', 'Failed calls to the boards', ('host', 'reason'))
+db_query_seconds = metrics.histogram(
+    'db_query_duration_seconds', 'SQL statements by kind', ('statement',))
+ingest_flush_seconds = metrics.histogram(
+    'ingest_flush_duration_seconds', 'Time to write one batch of readings')
+ingest_rows = metrics.counter(
+    'ingest_readings_total', 'Readings posted to /api/readings', ('result',))
+export_rows = metrics.counter(
+    'export_rows_total', 'Readings streamed by /api/export and export-readings', ('format',))
+anomalies_found = metrics.counter(
+    'anomalies_total', 'Unusual readings found by the streaming statistics', ('metric', 'kind'))
+metrics.gauge('ingest_buffer_rows', 'Readings waiting for the next flush',
+              collect=lambda: {(): len(ingest_buffer)})
+metrics.gauge('socketio_connected_clients', 'Connected Socket.IO clients, all workers',
+              collect=lambda: {(): connection_stats.connected()})
+metrics.gauge('socketio_room_clients', 'Clients per room, all workers', ('room',),
+              collect=lambda: connection_stats.room_sizes())
+metrics.gauge('hot_window_bytes', 'Memory held by the recent readings of every device',
+              collect=lambda: {(): hot_window.nbytes()})
+metrics.gauge('poller_devices', 'Devices polled by this worker',
+              collect=lambda: {(): poller.active()})
+
+def password_hash_samples():
+    stats = password_hasher.stats()
+    cumulative = 0
+    for bound, count in stats['buckets'].items():
+        cumulative += count
+        yield '_bucket', {'le': '+Inf' if bound == float('inf') else bound}, cumulative
+    yield '_sum', {}, stats['latency_sum']
+    yield '_count', {}, stats['count']
+
+metrics.custom('password_hash_duration_seconds', 'histogram', 'Password hash and verify latency',
+               password_hash_samples)
+metrics.custom('password_hash_in_flight', 'gauge', 'Hashes running or queued',
+               lambda: [('', {}, password_hasher.stats()['in_flight'])])
+metrics.custom('password_hash_rejected_total', 'counter', 'Hashes refused because the queue was full',
+               lambda: [('', {}, password_hasher.stats()['rejected'])])
+
+def observe_device_request(host, method, seconds, error):
+    device_request_seconds.observe(seconds, host, method)
+    if error:
+        device_request_errors.inc(host, error)
+
+device_client.on_request = observe_device_request
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def observe_request(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # Unrouted paths share one label so that scanners cannot grow the series
+        http_request_seconds.observe(time.perf_counter() - started, request.endpoint or 'unmatched',
+                                     request.method, str(response.status_code))
+    return response
+
+def timed_event(event_name):
+    """Decorator for Socket.IO handlers: latency histogram and opt-in profiling"""
+    def decorator(fn):
+        wrapper = socketio_event_seconds.timed(event_name)(profiler.wrap(event_name)(fn))
+        wrapper.__wrapped__ = fn
+        return wrapper
+    return decorator
+
+# Attached to the engine by create_app(). The start time lives on the execution
+# context, so a statement that fails leaves nothing behind on the connection.
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    context.query_started = time.perf_counter()
+
+def observe_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context.query_started
+    db_query_seconds.observe(elapsed, statement.lstrip().split(None, 1)[0].lower())
+    profiler.on_query(statement, elapsed)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
 
 
 # -------------------- Databases --------------------
@@ -38,38 +253,156 @@ class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password = db.Column(db.String(120), nullable=False)
+    password = db.Column(db.String(255), nullable=False)
     theme = db.Column(db.String(20), default='dark')
-
-with app.app_context():
-    db.create_all()
-    admin_user = User.query.filter_by(username='admin').first()
-    if not admin_user:
-        admin_user = User(
-            username='admin',
-            email='admin@example.com',
-            password=generate_password_hash('12345'),
-            theme = 'dark'
-
-        )
-        db.session.add(admin_user)
-        db.session.commit()
-        app.logger.info('Default admin user created.')
+    is_admin = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
 
 # Device db
 class Device(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_email = db.Column(db.String(120), db.ForeignKey('user.email'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     device_name = db.Column(db.String(80), nullable=False)
     device_type = db.Column(db.String(80), nullable=False)
     light_level = db.Column(db.Integer)
     humidity_level = db.Column(db.Integer)
     temperature = db.Column(db.Integer)
     smoke_level = db.Column(db.Integer)
+    host = db.Column(db.String(255))  # address of the board, e.g. 192.168.15.124
+    ingest_key_hash = db.Column(db.String(64))  # SHA-256 of the key the board sends with its readings
+
+    def limits(self):
+        return {
+            'light': self.light_level,
+            'humidity': self.humidity_level,
+            'temperature': self.temperature,
+            'smoke': self.smoke_level
+        }
+
+# Reading db (time series, one row per device sample)
+class Reading(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    device_id = db.Column(db.Integer, nullable=False)
+    ts = db.Column(db.Float, nullable=False)  # epoch seconds
+    temperature = db.Column(db.Float)
+    humidity = db.Column(db.Float)
+    light = db.Column(db.Float)
+    smoke = db.Column(db.Float)
 
-# Update the database
-with app.app_context():
+    __table_args__ = (db.Index('ix_reading_device_ts', 'device_id', 'ts'),)
+
+# Rollup db (min/max/sum/count per device, metric and 1m / 1h / 1d bucket)
+class Rollup(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    device_id = db.Column(db.Integer, nullable=False)
+    metric = db.Column(db.String(16), nullable=False)
+    resolution = db.Column(db.Integer, nullable=False)  # bucket width in seconds
+    bucket = db.Column(db.Integer, nullable=False)  # bucket start, epoch seconds
+    min = db.Column(db.Float, nullable=False)
+    max = db.Column(db.Float, nullable=False)
+    sum = db.Column(db.Float, nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (db.UniqueConstraint('device_id', 'metric', 'resolution', 'bucket',
+                                          name='uq_rollup_bucket'),)
+
+def init_db():
+    """Create missing tables and the default admin user"""
     db.create_all()
+    try:
+        admin_user = User.query.filter_by(username='admin').first()
+        if not admin_user:
+            admin_user = User(
+                username='admin',
+                email='admin@example.com',
+                password=generate_password_hash('12345', PASSWORD_HASH_METHOD),
+                theme = 'dark',
+                is_admin=True
+
+            )
+            db.session.add(admin_user)
+            db.session.commit()
+            app.logger.info('Default admin user created.')
+    except OperationalError as e:
+        # Database created by an older version; `flask db upgrade` brings it up to date
+        db.session.rollback()
+        app.logger.error(f'Database schema is out of date, run `flask db upgrade`: {e}')
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create missing tables and the default admin user."""
+    init_db()
+    click.echo('Database initialized.')
+
+@app.cli.command('set-admin')
+@click.argument('username')
+@click.option('--revoke', is_flag=True, help='Take admin rights away instead.')
+def set_admin_command(username, revoke):
+    """Grant (or revoke) admin rights: profiling and exports of every user."""
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.ClickException(f'No user named {username}.')
+    user.is_admin = not revoke
+    db.session.commit()
+    invalidate_user(user.id)
+    click.echo(f'{username} is {"no longer" if revoke else "now"} an admin.')
+
+
+# -------------------- Identity Cache --------------------
+
+# Snapshots of the logged-in user and of their device list, so steady-state
+# page loads skip the two lookups. Writers drop the affected keys after
+# committing and tell the other workers over the event bus.
+IDENTITY_CACHE_SIZE = 10000
+IDENTITY_CACHE_TTL = 300  # seconds, bounds staleness if an invalidation is lost
+
+user_cache = TTLCache(IDENTITY_CACHE_SIZE, IDENTITY_CACHE_TTL)  # user id -> user dict
+device_list_cache = TTLCache(IDENTITY_CACHE_SIZE, IDENTITY_CACHE_TTL)  # user id -> [device dict]
+
+def cache_user(user):
+    return user_cache.set(user.id, {'id': user.id, 'username': user.username,
+                                    'email': user.email, 'theme': user.theme,
+                                    'is_admin': bool(user.is_admin)})
+
+def current_user():
+    """The logged-in user as a dict, or None"""
+    user_id = session.get('user_id')
+    if user_id is None:
+        if 'username' not in session:
+            return None
+        # Session created before the id was stored in it
+        user = User.query.filter_by(username=session['username']).first()
+        if user is None:
+            return None
+        session['user_id'] = user.id
+        return cache_user(user)
+    info = user_cache.get(user_id)
+    if info is None:
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        info = cache_user(user)
+    return info
+
+def user_devices(user_id):
+    """id, name and type of every device of a user"""
+    devices = device_list_cache.get(user_id)
+    if devices is None:
+        devices = [{'id': d.id, 'device_name': d.device_name, 'device_type': d.device_type}
+                   for d in Device.query.filter_by(user_id=user_id).all()]
+        device_list_cache.set(user_id, devices)
+    return devices
+
+def invalidate_user(user_id, broadcast=True):
+    user_cache.pop(user_id)
+    if broadcast:
+        event_bus.publish('users', {'origin': WORKER_ID, 'id': user_id})
+
+def on_user_event(message):
+    """Drop what another worker changed"""
+    if message['origin'] != WORKER_ID:
+        invalidate_user(message['id'], broadcast=False)
+
+bus_handlers['users'] = on_user_event
 
 
 # -------------------- Routing --------------------
@@ -79,6 +412,12 @@ with app.app_context():
 def index():
     return render_template('index.html')
 
+def too_busy(error, template, **context):
+    """503 with Retry-After when password hashing is saturated"""
+    app.logger.warning(f'Rejected a {request.endpoint} request: {error}')
+    flash(f'The server is busy, please try again in {error.retry_after} seconds.')
+    return render_template(template, **context), 503, {'Retry-After': str(error.retry_after)}
+
 # Login Page
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -93,8 +432,22 @@ def login():
         else:
             user = User.query.filter_by(username=login_id).first()
 
-        if user and check_password_hash(user.password, password):
+        try:
+            ok, needs_rehash = password_hasher.verify(user.password, password) if user else (False, False)
+        except Saturated as e:
+            return too_busy(e, 'login.html')
+
+        if ok:
+            if needs_rehash:
+                # Hash parameters changed; a busy pool leaves it for the next login
+                try:
+                    user.password = password_hasher.hash(password)
+                    db.session.commit()
+                except Saturated:
+                    pass
             session['username'] = user.username
+            session['user_id'] = user.id
+            cache_user(user)
             flash('You were successfully logged in')
             app.logger.info(f'User {user.username} logged in successfully.')
             return redirect(url_for('dashboard'))
@@ -123,7 +476,7 @@ def signup():
                 flash('Email already exists. Please choose a different one.')
                 return redirect(url_for('signup'))
 
-            hashed_password = generate_password_hash(password)
+            hashed_password = password_hasher.hash(password)
             new_user = User(username=username, email=email,
                             password=hashed_password)
             db.session.add(new_user)
@@ -131,6 +484,8 @@ def signup():
 
             flash('Account created successfully. Please log in.')
             return redirect(url_for('login'))
+        except Saturated as e:
+            return too_busy(e, 'signup.html')
         except Exception as e:
             app.logger.error(f'Error during signup: {e}')
             flash('An error occurred while creating your account. Please try again.')
@@ -142,6 +497,7 @@ def signup():
 @app.route('/logout')
 def logout():
     session.pop('username', None)
+    session.pop('user_id', None)
     flash('You were successfully logged out')
     return redirect(url_for('index'))
 
@@ -174,10 +530,10 @@ def support():
 # Dashboard Page
 @app.route('/dashboard')
 def dashboard():
-    if 'username' in session:
-        user = User.query.filter_by(username=session.get('username')).first()
-        devices = Device.query.filter_by(user_email=user.email).all()
-        return render_template('dashboard.html', user=user, devices=devices)
+    user = current_user()
+    if user:
+        return render_template('dashboard.html', user=user, devices=user_devices(user['id']),
+                               frame_encoding=FRAME_ENCODING)
     else:
         flash('Please log in to access the dashboard.')
         return redirect(url_for('login'))
@@ -189,19 +545,29 @@ def add_device():
         return jsonify({'success': False, 'message': 'Please log in first.'})
 
     try:
-        user = User.query.filter_by(username=session['username']).first()
+        user = current_user()
         device_name = request.form['device_name']
         device_type = request.form['device_type']
+        try:
+            device_host = check_host(request.form.get('device_host'))
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)})
 
+        ingest_key, ingest_key_hash = new_ingest_key()
         new_device = Device(
-            user_email=user.email,
+            user_id=user['id'],
             device_name=device_name,
-            device_type=device_type
+            device_type=device_type,
+            host=device_host,
+            ingest_key_hash=ingest_key_hash
         )
         db.session.add(new_device)
         db.session.commit()
+        sync_device(new_device)
 
-        return jsonify({'success': True, 'message': 'Device added successfully!'})
+        # Only the hash is stored, so this is the one time the key is shown
+        return jsonify({'success': True, 'message': 'Device added successfully!',
+                        'device_id': new_device.id, 'ingest_key': ingest_key})
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': str(e)})
@@ -214,7 +580,7 @@ def modify_device():
 
     try:
         device_id = request.form['device_id']
-        device = Device.query.get(device_id)
+        device = Device.query.filter_by(id=device_id, user_id=current_user()['id']).first()
         
         if not device:
             return jsonify({'success': False, 'message': 'Device not found.'})
@@ -227,8 +593,14 @@ def modify_device():
             device.temperature = int(request.form['temperature_limit'])
         if request.form.get('smoke_limit'):
             device.smoke_level = int(request.form['smoke_limit'])
+        if request.form.get('device_host'):
+            try:
+                device.host = check_host(request.form['device_host'])
+            except ValueError as e:
+                return jsonify({'success': False, 'message': str(e)})
 
         db.session.commit()
+        sync_device(device)
         return jsonify({'success': True, 'message': 'Device modified successfully!'})
     except Exception as e:
         db.session.rollback()
@@ -237,7 +609,7 @@ def modify_device():
 @app.route('/get_thresholds', methods=['GET'])
 def get_thresholds():
     user_email = request.args.get('email')
-    device = Device.query.filter_by(user_email=user_email).first()
+    device = Device.query.join(User).filter(User.email == user_email).first()
     if device:
         return jsonify({
             'light': device.light_level,
@@ -247,6 +619,36 @@ def get_thresholds():
         })
     return jsonify({'error': 'Device not found'}), 404
 
+# Thresholds of every device of the user, or of ?ids=1,2,3, in one response
+@app.route('/api/thresholds', methods=['GET'])
+def get_all_thresholds():
+    user = current_user()
+    if not user:
+        return jsonify({'success': False, 'message': 'Please log in first.'}), 401
+
+    query = db.session.query(Device.id, Device.light_level, Device.humidity_level,
+                             Device.temperature, Device.smoke_level).filter(Device.user_id == user['id'])
+    if request.args.get('ids'):
+        try:
+            ids = [int(i) for i in request.args['ids'].split(',')]
+        except ValueError:
+            return jsonify({'success': False, 'message': 'ids must be a comma-separated list of integers.'}), 400
+        query = query.filter(Device.id.in_(ids))
+    rows = [tuple(row) for row in query.order_by(Device.id).all()]
+
+    # The tag is computed from the rows, so an unchanged set is answered
+    # before anything is serialized, and every worker agrees on it
+    etag = hashlib.sha1(repr(rows).encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify({'success': True, 'thresholds': {
+            str(device_id): {'light': light, 'humidity': humidity, 'temperature': temperature, 'smoke': smoke}
+            for device_id, light, humidity, temperature, smoke in rows}})
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
 # Remove device
 @app.route('/remove_device', methods=['POST'])
 def remove_device():
@@ -255,13 +657,14 @@ def remove_device():
 
     try:
         device_id = request.form['device_id']
-        device = Device.query.get(device_id)
+        device = Device.query.filter_by(id=device_id, user_id=current_user()['id']).first()
         
         if not device:
             return jsonify({'success': False, 'message': 'Device not found.'})
 
         db.session.delete(device)
         db.session.commit()
+        forget_device(device.id)
         return jsonify({'success': True, 'message': 'Device removed successfully!'})
     except Exception as e:
         db.session.rollback()
@@ -274,65 +677,587 @@ def get_devices():
         return jsonify({'success': False, 'message': 'Please log in first.'})
 
     try:
-        user = User.query.filter_by(username=session['username']).first()
-        devices = Device.query.filter_by(user_email=user.email).all()
-        devices_list = [{'id': d.id, 'name': d.device_name, 'type': d.device_type} for d in devices]
+        devices = user_devices(current_user()['id'])
+        devices_list = [{'id': d['id'], 'name': d['device_name'], 'type': d['device_type']} for d in devices]
         return jsonify({'success': True, 'devices': devices_list})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
 
-@socketio.on('request_sensor_data')
-def handle_sensor_request():
-    """Handle initial sensor data request when analytics is opened"""
-    # Get the latest sensor data
+SENSOR_POLL_INTERVAL = 5  # seconds between two reads of the same device
+POLL_IDLE_TIMEOUT = 30    # seconds without subscribers before a device stops being polled
+
+def read_esp32(url):
+    """Read one sample from an ESP32 and normalise it for the dashboard, None on failure"""
     try:
-        response = requests.get('http://192.168.15.124/data') # URL on which ESP32 is hosting
-        if response.status_code == 200:
-            data = response.json()
-            emit('sensor_data', {
+        data = device_client.get_json(url)
+        if data is not None:
+            return {
                 'temperature': data['temperature'],
                 'humidity': data['humidity'],
                 'light': data['lightLevel'],
                 'smoke': data['coLevel'],
                 'timestamp': datetime.now().isoformat()
-            })
+            }
     except Exception as e:
-        # Fallback to random data if ESP32 is not accessible
-        emit('sensor_data', {
-            'temperature': random.uniform(20, 30),
-            'humidity': random.uniform(30, 70),
-            'light': random.uniform(0, 100),
-            'smoke': random.uniform(0, 50),
-            'timestamp': datetime.now().isoformat()
-        })
+        app.logger.debug(f'ESP32 at {url} not accessible: {e}')
+    # No reading this round; use misc/simulator.py when there is no hardware
+    return None
+
+def has_subscribers(device_id):
+    return connection_stats.room_sizes().get(room_for(device_id), 0) > 0
+
+# One poller task per device, shared by every subscribed dashboard
+poller = SensorPoller(socketio, read_esp32, lambda device_id, reading: record_poll(device_id, reading),
+                      interval=SENSOR_POLL_INTERVAL, has_subscribers=has_subscribers,
+                      idle_timeout=POLL_IDLE_TIMEOUT)
+
+# 'frames' sends the sockets watching the same devices (a view room, usually
+# the tabs of one user) one delta-encoded sensor_frame per tick covering all
+# of those devices; 'events' sends one full sensor_data event per reading
+BROADCAST_MODE = 'frames'
+FRAME_TICK = 1.0          # seconds between two frames to the same room
+FRAME_ENCODING = 'json'   # or 'msgpack' for binary frames
+
+def watched_views():
+    """View rooms with subscribers on any worker -> their device ids"""
+    return {room: view_devices(room) for room, size in connection_stats.room_sizes().items()
+            if size > 0 and room.startswith(VIEW_PREFIX)}
+
+frame_batcher = FrameBatcher(socketio, tick=FRAME_TICK, encoding=FRAME_ENCODING, rooms=watched_views)
+
+latest_readings = {}  # device id -> last reading polled or ingested through this worker
+
+# The last HOT_WINDOW_SECONDS of readings of every device, in fixed-size
+# arrays (about 3 kB per device), sent as one sensor_history frame when a
+# dashboard subscribes so that it paints without waiting or querying the DB
+HOT_WINDOW_SECONDS = 600
+HOT_WINDOW_POINTS = 120
+
+hot_window = HotWindow(HOT_WINDOW_SECONDS, HOT_WINDOW_POINTS)
+
+def observe_reading(device_id, ts, reading, now=None):
+    """Server-side checks and in-memory history for every reading, polled or ingested.
+
+    Only readings at most ALARM_MAX_AGE old reach the alarms, so a backlog
+    upload is stored but never drives the buzzer.
+    """
+    if (now or time.time()) - ts <= ALARM_MAX_AGE:
+        alarm_engine.evaluate(device_id, reading)
+    hot_window.add(device_id, ts, reading)
+    anomaly_detector.observe(device_id, ts, reading)
+
+def record_poll(device_id, reading):
+    observe_reading(device_id, time.time(), reading)
+    publish_reading(device_id, reading)
+
+def publish_reading(device_id, reading):
+    """Fan one reading out to the dashboards watching its device"""
+    latest_readings[device_id] = reading
+    if BROADCAST_MODE == 'frames':
+        # Sent with the next frame of every view room that includes the device
+        frame_batcher.publish(device_id, reading)
+    else:
+        socketio.emit('sensor_data', reading, to=room_for(device_id))
+
+# -------------------- Device Registry --------------------
+
+device_registry = DeviceRegistry()
+
+def sync_device(device, broadcast=True):
+    """Push a created or modified device to the in-process indexes"""
+    entry = device_registry.put(device)
+    device_list_cache.pop(device.user_id)
+    alarm_engine.set_limits(device.id, device.limits())
+    if entry.data_url:
+        poller.retarget(device.id, entry.data_url)
+    if broadcast:
+        event_bus.publish('devices', {'origin': WORKER_ID, 'id': device.id, 'removed': False})
+
+def forget_device(device_id, broadcast=True):
+    entry = device_registry.remove(device_id)
+    if entry:
+        device_list_cache.pop(entry.user_id)
+    alarm_engine.remove(device_id)
+    poller.unwatch(device_id)
+    hot_window.drop(device_id)
+    anomaly_detector.remove(device_id)
+    frame_batcher.forget(device_id)
+    if broadcast:
+        event_bus.publish('devices', {'origin': WORKER_ID, 'id': device_id, 'removed': True})
+
+def on_device_event(message):
+    """Apply a device change made through another worker"""
+    if message['origin'] == WORKER_ID:
+        return
+    with app.app_context():
+        device = None if message['removed'] else db.session.get(Device, message['id'])
+        if device is None:
+            forget_device(message['id'], broadcast=False)
+        else:
+            sync_device(device, broadcast=False)
+
+bus_handlers['devices'] = on_device_event
+
+
+# -------------------- Telemetry Ingestion --------------------
+
+INGEST_BATCH_SIZE = 500   # flush once this many readings are pending
+INGEST_MAX_DELAY = 1.0    # or once the oldest one waited this long (seconds)
 
+# Retention in seconds; the 1-day rollups are kept forever
+RAW_RETENTION = 7 * 86400
+ROLLUP_RETENTION = {rollup.MINUTE: 30 * 86400, rollup.HOUR: 365 * 86400}
+COMPACTION_INTERVAL = 3600
 
-ESP32_URL_A = 'http://192.168.15.124/buzzer'
-ESP32_URL_D = 'http://192.168.15.124/buzzer/deactivate'
+@ingest_flush_seconds.timed()
+def write_readings(rows):
+    """Bulk insert one batch of readings and fold it into the rollups"""
+    with app.app_context():
+        db.session.execute(db.insert(Reading), rows)
+        rollup.merge(db.session, Rollup, rollup.aggregate(rows))
+        db.session.commit()
+
+def compact_readings(now):
+    """Drop raw readings and rollups that are past their retention"""
+    with app.app_context():
+        deleted = rollup.delete_before(db.session, Reading, Reading.ts, now - RAW_RETENTION)
+        for resolution, keep in ROLLUP_RETENTION.items():
+            deleted += rollup.delete_before(db.session, Rollup, Rollup.bucket, now - keep,
+                                            extra=(Rollup.resolution == resolution,))
+        return deleted
+
+compactor = rollup.Compactor(socketio, compact_readings, interval=COMPACTION_INTERVAL)
+
+ingest_buffer = ReadingBuffer(socketio, write_readings,
+                              max_rows=INGEST_BATCH_SIZE, max_age=INGEST_MAX_DELAY)
+atexit.register(ingest_buffer.flush)
+
+INGEST_KEY_HEADER = 'X-Device-Key'  # boards send their device's ingest key in this header
+
+def may_ingest(entry, key, user):
+    """Whether the caller proved it owns a device: by its ingest key or as its logged-in owner"""
+    return entry is not None and (entry.accepts_key(key) or (user is not None and entry.user_id == user['id']))
+
+@app.route('/devices/<int:device_id>/ingest_key', methods=['POST'])
+def rotate_ingest_key(device_id):
+    """Issue a new ingest key for a device; the old one stops working"""
+    if 'username' not in session:
+        return jsonify({'success': False, 'message': 'Please log in first.'}), 401
+    device = Device.query.filter_by(id=device_id, user_id=current_user()['id']).first()
+    if not device:
+        return jsonify({'success': False, 'message': 'Device not found.'}), 404
+    ingest_key, device.ingest_key_hash = new_ingest_key()
+    db.session.commit()
+    sync_device(device)
+    return jsonify({'success': True, 'device_id': device.id, 'ingest_key': ingest_key})
+
+@app.route('/api/readings', methods=['POST'])
+def ingest_readings():
+    key = request.headers.get(INGEST_KEY_HEADER)
+    user = current_user()
+    if not key and user is None:
+        return jsonify({'success': False,
+                        'message': f'Send the ingest key of the device in {INGEST_KEY_HEADER}.'}), 401
+    payload = request.get_json(silent=True)
+    if payload is None:
+        return jsonify({'success': False, 'message': 'Expected a JSON body.'}), 400
+    try:
+        rows = parse_readings(payload, request.args.get('device_id'))
+    except (ValueError, TypeError, OverflowError) as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    # Readings feed the alarms that drive the buzzer, so only rows of devices
+    # the caller proved it owns are accepted
+    known = [row for row in rows if may_ingest(device_registry.get(row['device_id']), key, user)]
+    rejected = len(rows) - len(known)
+    if rejected:
+        ingest_rows.inc('rejected', amount=rejected)
+    if not known:
+        return jsonify({'success': False, 'message': 'Unknown device or wrong ingest key.'}), 403
+    rows = known
+    ingest_rows.inc('accepted', amount=len(rows))
+
+    ingest_buffer.add(rows)
+    if BACKGROUND_JOBS:
+        compactor.start()
+    now = time.time()
+    newest = {}
+    for row in sorted(rows, key=lambda row: row['ts']):  # each device's readings in time order
+        observe_reading(row['device_id'], row['ts'], row, now)
+        newest[row['device_id']] = row
+    # Push the newest reading of each device to its subscribers right away,
+    # unless it is backlog
+    for device_id, row in newest.items():
+        if now - row['ts'] > ALARM_MAX_AGE:
+            continue
+        publish_reading(device_id, {
+            'temperature': row['temperature'], 'humidity': row['humidity'],
+            'light': row['light'], 'smoke': row['smoke'],
+            'timestamp': datetime.fromtimestamp(row['ts']).isoformat()})
+    app.logger.debug('Readings accepted', extra={'sample': 'reading', 'accepted': len(rows),
+                                                 'rejected': rejected})
+    return jsonify({'success': True, 'accepted': len(rows), 'rejected': rejected}), 202
+
+
+# -------------------- Alarms --------------------
+
+ALARM_HYSTERESIS = 0.05  # fraction of the limit a reading must drop below it to clear
+ALARM_DEBOUNCE = 3       # consecutive readings needed before the alarm state flips
+ALARM_MAX_AGE = 120      # seconds; older readings are stored but drive no alarm or buzzer
+
+def send_buzzer_command(device_id, active):
+    entry = device_registry.get(device_id)
+    if entry is not None and entry.base_url is not None:
+        dispatcher.submit(device_id, entry.buzzer_url if active else entry.buzzer_off_url,
+                          user_id=entry.user_id)
+
+def on_alarm_transition(device_id, active, metrics):
+    """Called once per alarm raise/clear, whatever the number of open tabs"""
+    app.logger.warning(f'Device {device_id} alarm {"raised" if active else "cleared"}: {metrics}')
+    socketio.emit('alarm', {'device_id': device_id, 'active': active, 'metrics': metrics},
+                  to=room_for(device_id))
+    send_buzzer_command(device_id, active)
+
+alarm_engine = ThresholdEngine(on_alarm_transition, hysteresis=ALARM_HYSTERESIS,
+                               debounce=ALARM_DEBOUNCE)
+
+
+# -------------------- Anomaly Detection --------------------
+
+# Besides the fixed limits, every reading feeds running statistics per device
+# and metric (see anomaly.py); all devices are checked together once per tick
+ANOMALY_TICK = 1.0        # seconds between two evaluations
+ANOMALY_Z = 4.0           # a reading this many standard deviations off is a spike
+ANOMALY_DRIFT = 4.0       # control limit of the EWMA against the long-run mean
+ANOMALY_WARMUP = 30       # readings of a metric before it is judged
+ANOMALY_MAX_RATE = {'temperature': 0.5, 'humidity': 2.0}  # fastest plausible change per second
+ANOMALY_MIN_DT = 10.0     # shortest interval, in seconds, a rate of change is measured over
+
+def on_anomalies(found):
+    """Called once per tick with everything the detector flagged"""
+    for anomaly in found:
+        anomalies_found.inc(anomaly['metric'], anomaly['kind'])
+        app.logger.info(f"Device {anomaly['device_id']} {anomaly['metric']} {anomaly['kind']}: "
+                        f"{anomaly['value']}", extra={'sample': 'anomaly'})
+        socketio.emit('anomaly', anomaly, to=room_for(anomaly['device_id']))
+
+anomaly_detector = AnomalyDetector(socketio, on_anomalies, tick=ANOMALY_TICK, z=ANOMALY_Z,
+                                   drift=ANOMALY_DRIFT, warmup=ANOMALY_WARMUP,
+                                   max_rate=ANOMALY_MAX_RATE, min_dt=ANOMALY_MIN_DT)
+
+@app.route('/api/stats', methods=['GET'])
+def device_stats():
+    """Running statistics of one device, from the readings this worker saw"""
+    if 'username' not in session:
+        return jsonify({'success': False, 'message': 'Please log in first.'}), 401
+    try:
+        device_id = int(request.args['device_id'])
+    except (KeyError, ValueError) as e:
+        return jsonify({'success': False, 'message': f'Invalid query: {e}'}), 400
+    entry = device_registry.get(device_id)
+    if entry is None or entry.user_id != current_user()['id']:
+        return jsonify({'success': False, 'message': 'Device not found.'}), 404
+    return jsonify({'success': True, 'device_id': device_id,
+                    'stats': anomaly_detector.stats(device_id) or {}})
+
+
+# Historical readings, aggregated or downsampled on the server
+@app.route('/api/history', methods=['GET'])
+def get_history():
+    if 'username' not in session:
+        return jsonify({'success': False, 'message': 'Please log in first.'}), 401
+
+    try:
+        device_id = int(request.args['device_id'])
+        metric = request.args.get('metric', 'temperature')
+        end = parse_timestamp(request.args.get('end'))
+        start = parse_timestamp(request.args['start']) if 'start' in request.args else end - 86400
+        points = min(int(request.args.get('points', 200)), history.MAX_BUCKETS)
+        mode = request.args.get('mode', 'buckets')
+    except (KeyError, ValueError) as e:
+        return jsonify({'success': False, 'message': f'Invalid query: {e}'}), 400
+    if metric not in history.METRICS or mode not in ('buckets', 'lttb') or start >= end or points < 1:
+        return jsonify({'success': False, 'message': 'Invalid metric, mode or time range.'}), 400
+
+    entry = device_registry.get(device_id)
+    if entry is None or entry.user_id != current_user()['id']:
+        return jsonify({'success': False, 'message': 'Device not found.'}), 404
+
+    # Wide buckets are served from the rollups instead of scanning raw rows
+    resolution = rollup.pick_resolution((end - start) / points)
+    if mode == 'lttb':
+        series = history.downsampled(db.session, Reading, device_id, metric, start, end, points)
+    elif resolution:
+        # Bucket edges snap to the rollup grid, so the series matches the raw query
+        start, end, points = rollup.align(start, end, points, resolution)
+        series = rollup.bucketed(db.session, Rollup, device_id, metric, resolution, start, end, points)
+    else:
+        series = history.bucketed(db.session, Reading, device_id, metric, start, end, points)
+    return jsonify({'success': True, 'device_id': device_id, 'metric': metric,
+                    'mode': mode, 'start': start, 'end': end, 'series': series})
+
+
+# -------------------- Export --------------------
+
+# Raw readings are streamed out page by page (see export.py). The throttle
+# and the concurrency cap keep a large export from competing with ingestion
+# for the database.
+EXPORT_PAGE_SIZE = 5000          # rows per query
+EXPORT_ROWS_PER_SECOND = 50000   # per export; 0 disables the throttle
+EXPORT_MAX_CONCURRENT = 2        # exports per worker, one per user
+
+export_limiter = export.ExportLimiter(EXPORT_MAX_CONCURRENT)
+
+def export_device_ids(user_id=None, device_ids=None):
+    query = db.session.query(Device.id)
+    if user_id is not None:
+        query = query.filter(Device.user_id == user_id)
+    if device_ids:
+        query = query.filter(Device.id.in_(device_ids))
+    return [device_id for device_id, in query.order_by(Device.id).all()]
+
+def export_stream(fmt, device_ids, fields, start, end, rows_per_second, sleep):
+    """Encoded chunks of the readings of ``device_ids``, read one page at a time"""
+    def counted(source):
+        for page in source:
+            export_rows.inc(fmt, amount=len(page))
+            yield page
+
+    source = export.pages(db.engine, Reading.__table__, device_ids, fields, start, end, EXPORT_PAGE_SIZE)
+    return export.ENCODERS[fmt](counted(export.throttled(source, rows_per_second, sleep)), fields)
+
+@app.route('/api/export', methods=['GET'])
+def export_readings():
+    """Stream raw readings; admins may export another user's devices with ``user``"""
+    user = current_user()
+    if not user:
+        return jsonify({'success': False, 'message': 'Please log in first.'}), 401
+    try:
+        fmt = request.args.get('format', 'csv')
+        fields = export.parse_metrics(request.args.get('metrics'))
+        ids = [int(i) for i in request.args['ids'].split(',')] if request.args.get('ids') else None
+        start = parse_timestamp(request.args['start']) if 'start' in request.args else 0.0
+        end = parse_timestamp(request.args.get('end'))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Invalid query: {e}'}), 400
+    if fmt not in export.FORMATS or start >= end:
+        return jsonify({'success': False, 'message': 'Invalid format or time range.'}), 400
+    if fmt == 'parquet' and not export.parquet_available():
+        return jsonify({'success': False, 'message': 'Parquet export needs pyarrow on the server.'}), 501
+
+    owner = user['id']
+    if request.args.get('user'):
+        if not is_admin():
+            return jsonify({'success': False, 'message': 'Admins only.'}), 403
+        target = User.query.filter_by(username=request.args['user']).first()
+        if target is None:
+            return jsonify({'success': False, 'message': 'User not found.'}), 404
+        owner = target.id
+    elif ids and is_admin():
+        owner = None
+    device_ids = export_device_ids(owner, ids)
+    if not device_ids:
+        return jsonify({'success': False, 'message': 'Device not found.'}), 404
+
+    try:
+        export_limiter.acquire(user['id'])
+    except export.Busy as e:
+        return jsonify({'success': False, 'message': str(e)}), 429, {'Retry-After': str(e.retry_after)}
+    body = export_stream(fmt, device_ids, fields, start, end, EXPORT_ROWS_PER_SECOND, socketio.sleep)
+    response = app.response_class(body, content_type=export.FORMATS[fmt])
+    # Runs when the stream ends or the client goes away
+    response.call_on_close(lambda: export_limiter.release(user['id']))
+    response.headers['Content-Disposition'] = \
+        f'attachment; filename="readings-{datetime.now():%Y%m%dT%H%M%S}.{fmt}"'
+    response.headers['X-Accel-Buffering'] = 'no'  # nginx: pass chunks through as they come
+    return response
+
+@app.cli.command('export-readings')
+@click.option('--device', 'device_ids', type=int, multiple=True, help='Device id, repeat for several. Default: all.')
+@click.option('--user', 'username', help='Only the devices of this user.')
+@click.option('--metrics', 'metric_names', default='', help='Comma-separated metrics. Default: all.')
+@click.option('--start', help='Epoch seconds or ISO 8601. Default: the oldest reading.')
+@click.option('--end', help='Epoch seconds or ISO 8601. Default: now.')
+@click.option('--format', 'fmt', type=click.Choice(list(export.FORMATS)), default='csv', show_default=True)
+@click.option('--output', '-o', default='-', help='File to write. Default: stdout.')
+@click.option('--rows-per-second', type=int, default=EXPORT_ROWS_PER_SECOND, show_default=True,
+              help='Throttle, 0 for none.')
+def export_readings_command(device_ids, username, metric_names, start, end, fmt, output, rows_per_second):
+    """Stream stored readings as CSV, NDJSON or Parquet."""
+    try:
+        fields = export.parse_metrics(metric_names)
+        start = parse_timestamp(start) if start else 0.0
+        end = parse_timestamp(end)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    if fmt == 'parquet' and not export.parquet_available():
+        raise click.ClickException('Parquet export needs pyarrow (pip install pyarrow).')
+    owner = None
+    if username:
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            raise click.ClickException(f'No user named {username}.')
+        owner = user.id
+    ids = export_device_ids(owner, list(device_ids))
+    if not ids:
+        raise click.ClickException('No matching devices.')
+    with click.open_file(output, 'wb') as out:
+        for chunk in export_stream(fmt, ids, fields, start, end, rows_per_second, time.sleep):
+            out.write(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+
+
+# -------------------- Subscriptions --------------------
+
+# Dashboards subscribe to the devices they show and get readings pushed as
+# they are polled or ingested. The poller only runs for devices that have at
+# least one subscriber on some worker (room sizes are shared), and a worker
+# without background jobs asks the one that has them to resume polling.
+
+def resume_polling(device_id):
+    entry = device_registry.get(device_id)
+    if entry is None or entry.data_url is None:
+        return
+    if BACKGROUND_JOBS:
+        poller.watch(device_id, entry.data_url)
+    elif not poller.polling(device_id):
+        event_bus.publish('subscriptions', {'origin': WORKER_ID, 'id': device_id})
+
+def on_subscription_event(message):
+    if message['origin'] != WORKER_ID:
+        load_devices()
+        resume_polling(message['id'])
+
+if BACKGROUND_JOBS:
+    bus_handlers['subscriptions'] = on_subscription_event
+
+def requested_devices(data):
+    """Device ids of a subscribe/unsubscribe payload that belong to the user"""
+    data = data or {}
+    ids = data.get('device_ids')
+    if ids is None:
+        ids = [data.get('device_id')]
+    user = current_user()
+    owned = []
+    for device_id in ids if isinstance(ids, list) else []:
+        try:
+            entry = device_registry.get(int(device_id))
+        except (TypeError, ValueError):
+            continue
+        if entry is not None and user and entry.user_id == user['id']:
+            owned.append(entry.id)
+    return owned
+
+def current_view(sid):
+    """View room of the devices a socket of this worker is subscribed to, or None"""
+    prefix = room_for('')
+    device_ids = [room[len(prefix):] for room in connection_stats.rooms(sid) if room.startswith(prefix)]
+    return view_room(device_ids) if device_ids else None
+
+def move_view(previous):
+    """Put the socket in the view room of its subscriptions after they changed"""
+    current = current_view(request.sid)
+    if current == previous:
+        return
+    if previous:
+        leave_room(previous)
+        connection_stats.leave(request.sid, previous)
+    if current:
+        join_room(current)
+        connection_stats.join(request.sid, current)
+
+@socketio.on('subscribe')
+@timed_event('subscribe')
+def handle_subscribe(data=None):
+    """Start pushing readings of {'device_ids': [...]} to this client"""
+    device_ids = requested_devices(data)
+    history = {}
+    now = time.time()
+    view = current_view(request.sid)
+    for device_id in device_ids:
+        room = room_for(device_id)
+        join_room(room)
+        connection_stats.join(request.sid, room)
+        resume_polling(device_id)
+        columns = hot_window.snapshot(device_id, now)
+        if columns:
+            history[str(device_id)] = columns
+    move_view(view)
+    if BROADCAST_MODE == 'frames' and device_ids:
+        emit('sensor_frame', frame_batcher.snapshot(device_ids))
+    if history:
+        emit('sensor_history', {'window': HOT_WINDOW_SECONDS, 'devices': history})
+    for device_id in device_ids:
+        reading = latest_readings.get(device_id)
+        if reading:
+            emit('sensor_data', dict(reading, device_id=device_id))
+    return {'subscribed': device_ids}
+
+@socketio.on('unsubscribe')
+@timed_event('unsubscribe')
+def handle_unsubscribe(data=None):
+    device_ids = requested_devices(data)
+    view = current_view(request.sid)
+    for device_id in device_ids:
+        room = room_for(device_id)
+        leave_room(room)
+        connection_stats.leave(request.sid, room)
+    move_view(view)
+    return {'unsubscribed': device_ids}
+
+# Older clients asked every few seconds; each request is now a subscription
+socketio.on_event('request_sensor_data', timed_event('request_sensor_data')(handle_subscribe.__wrapped__))
+
+
+# -------------------- Device Commands --------------------
+
+COMMAND_WORKERS = 4     # threads sending commands to devices
+COMMAND_TIMEOUT = 3     # seconds per HTTP call to a device
+COMMAND_RETRIES = 3
+
+def on_command_update(command):
+    socketio.emit('command_status', command.to_dict(), to=room_for(command.device_id))
+
+dispatcher = CommandDispatcher(workers=COMMAND_WORKERS, timeout=COMMAND_TIMEOUT,
+                               retries=COMMAND_RETRIES, on_update=on_command_update,
+                               client=device_client)
+
+def queue_buzzer_command(active, status):
+    if 'username' not in session:
+        return jsonify({'success': False, 'message': 'Please log in first.'}), 401
+    user = current_user()
+    payload = request.get_json(silent=True) or request.form
+    try:
+        entry = device_registry.get(int(payload.get('device_id')))
+    except (TypeError, ValueError):
+        entry = None
+    if entry is None or user is None or entry.user_id != user['id'] or entry.base_url is None:
+        return jsonify({"status": "Unknown device or device has no address"}), 404
+
+    command = dispatcher.submit(entry.id, entry.buzzer_url if active else entry.buzzer_off_url,
+                                user_id=user['id'])
+    return jsonify({"status": status, "command_id": command.id,
+                    "status_url": url_for('command_status', command_id=command.id)}), 202
 
 @app.route('/activate_buzzer', methods=['POST'])
 def activate_buzzer():
-    try:
-        response = requests.post(ESP32_URL_A)
-        if response.status_code == 200:
-            return jsonify({"status": "Buzzer activated"})
-        else:
-            return jsonify({"status": "Failed to activate buzzer"}), 500
-    except Exception as e:
-        return jsonify({"status": f"Error: {str(e)}"}), 500
+    return queue_buzzer_command(True, "Buzzer activation queued")
 
 
 @app.route('/deactivate_buzzer', methods=['POST'])
 def deactivate_buzzer():
-    try:
-        response = requests.post(ESP32_URL_D)
-        if response.status_code == 200:
-            return jsonify({"status": "Buzzer deactivated"})
-        else:
-            return jsonify({"status": "Failed to deactivate buzzer"}), 500
-    except Exception as e:
-        return jsonify({"status": f"Error: {str(e)}"}), 500
+    return queue_buzzer_command(False, "Buzzer deactivation queued")
+
+
+@app.route('/commands/<int:command_id>', methods=['GET'])
+def command_status(command_id):
+    if 'username' not in session:
+        return jsonify({'success': False, 'message': 'Please log in first.'}), 401
+    command = dispatcher.get(command_id)
+    user = current_user()
+    if not command or user is None or command.user_id != user['id']:
+        return jsonify({'error': 'Command not found'}), 404
+    return jsonify(command.to_dict())
 
 
 # -------------------- Sensor Data Generation (WebSocket) --------------------
@@ -347,19 +1272,18 @@ def deactivate_buzzer():
 # Track active connections
 
 # WebSocket route for client connections
-active_connections = 0
-
 @socketio.on('connect')
-def handle_connect():
-    global active_connections
-    active_connections += 1
-    print(f"Client connected. Active connections: {active_connections}")
+@timed_event('connect')
+def handle_connect(auth=None):
+    load_devices()
+    active_connections = connection_stats.connect(request.sid)
+    app.logger.info('Client connected', extra={'sample': 'connect', 'active_connections': active_connections})
 
 @socketio.on('disconnect')
-def handle_disconnect():
-    global active_connections
-    active_connections = max(0, active_connections - 1)
-    print(f"Client disconnected. Active connections: {active_connections}")
+@timed_event('disconnect')
+def handle_disconnect(reason=None):
+    active_connections = connection_stats.disconnect(request.sid)
+    app.logger.info('Client disconnected', extra={'sample': 'connect', 'active_connections': active_connections})
     
 
 # Settings Page
@@ -369,9 +1293,8 @@ def settings():
         flash('Please log in to access the settings.')
         return redirect(url_for('login'))
 
-    user = User.query.filter_by(username=session.get('username')).first()
-
     if request.method == 'POST':
+        user = db.session.get(User, current_user()['id'])
         new_username = request.form['username']
         new_email = request.form['email']
         new_password = request.form['password']
@@ -390,15 +1313,22 @@ def settings():
         user.username = new_username
         user.email = new_email
         if new_password:
-            user.password = generate_password_hash(new_password)
+            try:
+                user.password = password_hasher.hash(new_password)
+            except Saturated as e:
+                db.session.rollback()
+                return too_busy(e, 'settings.html', user=current_user())
             
         user.theme = user_theme
         db.session.commit()
+        session['username'] = user.username
+        invalidate_user(user.id)
+        cache_user(user)
 
         flash('Settings updated successfully.')
         return redirect(url_for('settings'))
 
-    return render_template('settings.html', user=user)
+    return render_template('settings.html', user=current_user())
 
 @app.route('/update_theme', methods=['POST'])
 def update_theme():
@@ -406,16 +1336,153 @@ def update_theme():
         return jsonify({'error': 'Not logged in'}), 401
     
     user_theme = request.json.get('theme', 'dark')
-    user = User.query.filter_by(username=session['username']).first()
+    user = current_user()
     if user:
+        user = db.session.get(User, user['id'])
         user.theme = user_theme
         db.session.commit()
+        invalidate_user(user.id)
+        cache_user(user)
     
     return jsonify({'status': 'success'})
 
 
+# -------------------- Static Assets --------------------
+
+# Source path -> hashed path under static/dist/, loaded by create_app once
+# `flask --app app.py build-assets` has run (see assets.py). Left empty in
+# debug mode so edits to static/ show up without a rebuild.
+asset_manifest = {}
+
+@app.cli.command('build-assets')
+@click.option('--no-minify', is_flag=True, help='Copy CSS and JS unchanged.')
+def build_assets_command(no_minify):
+    """Fingerprint, minify and precompress static/ into static/dist/."""
+    manifest = assets.build(app.static_folder, minify=not no_minify)
+    click.echo(f'Built {len(manifest)} assets into {os.path.join(app.static_folder, assets.DIST)}')
+
+@app.url_defaults
+def hashed_static_url(endpoint, values):
+    """url_for('static', filename='js/socket.js') -> /static/dist/js/socket.<hash>.js"""
+    if endpoint == 'static' and asset_manifest:
+        hashed = asset_manifest.get(values.get('filename'))
+        if hashed:
+            values['filename'] = f'{assets.DIST}/{hashed}'
+
+def serve_static(filename):
+    """Hashed assets are served precompressed when accepted and cached for a year"""
+    prefix = assets.DIST + '/'
+    if not filename.startswith(prefix) or filename == prefix + assets.MANIFEST:
+        return app.send_static_file(filename)
+    path = filename[len(prefix):]
+    served, encoding = assets.precompressed(os.path.join(app.static_folder, assets.DIST), path,
+                                            request.headers.get('Accept-Encoding'))
+    response = send_from_directory(os.path.join(app.static_folder, assets.DIST), served,
+                                   mimetype=mimetypes.guess_type(path)[0] or 'application/octet-stream')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if os.path.splitext(path)[1].lower() in assets.TEXT_TYPES:
+        response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = assets.IMMUTABLE
+    return response
+
+app.view_functions['static'] = serve_static
+
+
+# -------------------- Application Factory --------------------
+
+_setup_lock = threading.RLock()
+_configured = False
+
+def create_app(config=None):
+    """Set up logging and bind the extensions; later calls return the app as is.
+
+    ``config`` overrides app.config, e.g. {'SQLALCHEMY_DATABASE_URI': 'sqlite://'}.
+    It only applies to the first call; passing one afterwards raises RuntimeError.
+    Servers start from here (``gunicorn 'app:create_app()'``); the first app
+    context calls it with no overrides when nobody did, so the flask CLI and
+    test clients work on the bare ``app`` too.
+    """
+    global _configured
+    with _setup_lock:
+        if _configured:
+            if config:
+                raise RuntimeError('create_app() was already called; config can only be given the first time')
+            return app
+        _configured = True
+
+        # Logging goes through a queue to a background writer (see logconfig.py);
+        # set up before the first use of app.logger so Flask does not add its own handler
+        configure_logging()
+        app.config.update(config or {})
+        app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS',
+                              engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
+        db.init_app(app)
+        if click.get_current_context(silent=True) is not None:
+            # Only the `flask db` commands need Flask-Migrate, and it pulls in alembic
+            from flask_migrate import Migrate
+            Migrate(app, db, render_as_batch=True)  # batch mode lets SQLite alter tables
+
+        if SOCKETIO_MESSAGE_QUEUE and SOCKETIO_MESSAGE_QUEUE.startswith('local://'):
+            socketio.init_app(app, async_mode=ASYNC_MODE, cors_allowed_origins=CORS_ALLOWED_ORIGINS,
+                              client_manager=LocalBrokerManager(SOCKETIO_MESSAGE_QUEUE))
+        else:
+            socketio.init_app(app, async_mode=ASYNC_MODE, cors_allowed_origins=CORS_ALLOWED_ORIGINS,
+                              message_queue=SOCKETIO_MESSAGE_QUEUE)
+
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', start_query_timer)
+            event.listen(db.engine, 'after_cursor_execute', observe_query)
+        for channel, handler in bus_handlers.items():
+            event_bus.subscribe(channel, handler)
+        if not app.debug:
+            asset_manifest.update(assets.load_manifest(app.static_folder))
+        return app
+
+def create_on_first_use(sender, **extra):
+    create_app()
+
+appcontext_pushed.connect(create_on_first_use, app)
+
+
+# -------------------- Startup --------------------
+
+_devices_loaded = False
+_devices_retry_at = 0.0
+DEVICE_LOAD_RETRY = 5  # seconds between two attempts while the schema is missing
+
+@app.before_request
+def load_devices():
+    """Fill the in-process indexes from the database, once per worker.
+
+    Until the database is ready (before `init-db` or a migration finished)
+    the load is retried every DEVICE_LOAD_RETRY seconds.
+    """
+    global _devices_loaded, _devices_retry_at
+    if _devices_loaded or time.monotonic() < _devices_retry_at:
+        return
+    with _setup_lock:
+        if _devices_loaded or time.monotonic() < _devices_retry_at:
+            return
+        with app.app_context():
+            try:
+                devices = Device.query.all()
+            except OperationalError as e:
+                app.logger.error(f'Cannot load devices, run `flask --app app.py init-db` '
+                                 f'or `flask --app app.py db upgrade`: {e}')
+                _devices_retry_at = time.monotonic() + DEVICE_LOAD_RETRY
+                return
+        device_registry.load(devices)
+        for device in devices:
+            alarm_engine.set_limits(device.id, device.limits())
+        _devices_loaded = True
+
+
 # -------------------- Running the App --------------------
 if __name__ == '__main__':
-    # Start the background thread for sensor data generation
-    threading.Thread(target=handle_sensor_request, daemon=True).start()
-    socketio.run(app, host='0.0.0.0', port=5000, debug=True)
+    create_app()
+    # Start the retention job in the background; devices are polled once subscribed to
+    if BACKGROUND_JOBS:
+        compactor.start()
+    socketio.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)),
+                 debug=DEBUG, allow_unsafe_werkzeug=True)
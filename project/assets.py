@@ -0,0 +1,176 @@
+"""Fingerprinted, precompressed static assets.
+
+``flask --app app.py build-assets`` copies every file of static/ to
+static/dist/ under a content-hashed name (css/dashboard.css ->
+css/dashboard.3f2a9c1d7b.css), minifies CSS and JS on the way, writes .gz
+and, when the ``brotli`` package is installed, .br variants of text assets,
+and records the mapping in static/dist/manifest.json.
+
+At runtime ``url_for('static', filename=...)`` resolves to the hashed name
+when a manifest exists, and hashed files are served with a one-year
+immutable Cache-Control, picking the precompressed variant the client
+accepts. A new release changes the names, so clients never revalidate.
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+TEXT_TYPES = ('.css', '.js', '.svg', '.json', '.txt', '.html')
+SKIP = ('.DS_Store',)
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))  # preferred first
+
+
+# -------------------- Minification --------------------
+
+def _split_literals(source, quotes, regex=False):
+    """Yield (is_literal, text) chunks; comments are dropped from the code chunks.
+
+    Strings (and, for JS, template and regex literals) are kept verbatim so
+    the whitespace squeezing below never touches them.
+    """
+    code = []
+    i, n = 0, len(source)
+    while i < n:
+        c = source[i]
+        if c in quotes:
+            end = i + 1
+            while end < n and source[end] != c:
+                end += 2 if source[end] == '\\' else 1
+            if code:
+                yield False, ''.join(code)
+                code = []
+            yield True, source[i:end + 1]
+            i = end + 1
+        elif source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            i = n if end < 0 else end + 2
+            code.append(' ')
+        elif regex and source.startswith('//', i):
+            end = source.find('\n', i)
+            i = n if end < 0 else end
+        elif regex and c == '/' and _regex_allowed(code):
+            end, in_class = i + 1, False
+            while end < n and (in_class or source[end] != '/') and source[end] != '\n':
+                if source[end] == '\\':
+                    end += 1
+                elif source[end] == '[':
+                    in_class = True
+                elif source[end] == ']':
+                    in_class = False
+                end += 1
+            while end + 1 < n and source[end + 1].isalpha():  # flags
+                end += 1
+            if code:
+                yield False, ''.join(code)
+                code = []
+            yield True, source[i:end + 1]
+            i = end + 1
+        else:
+            code.append(c)
+            i += 1
+    if code:
+        yield False, ''.join(code)
+
+
+def _regex_allowed(code):
+    """Whether a '/' here starts a regex literal rather than a division"""
+    text = ''.join(code[-32:]).rstrip()
+    return not text or text[-1] in '(,=:[!&|?{};+-*%<>~^' or text.endswith('return')
+
+
+def minify_css(source):
+    out = []
+    for literal, text in _split_literals(source, '"\''):
+        if not literal:
+            text = re.sub(r'\s+', ' ', text)
+            text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+            text = text.replace(';}', '}')
+        out.append(text)
+    return ''.join(out).strip()
+
+
+def minify_js(source):
+    """Drop comments, indentation and blank lines; line breaks stay for ASI"""
+    out = []
+    for literal, text in _split_literals(source, '"\'`', regex=True):
+        if not literal:
+            text = re.sub(r'[ \t]+', ' ', text)
+            text = re.sub(r' ?\n[\s]*', '\n', text)
+        out.append(text)
+    return ''.join(out).strip() + '\n'
+
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+
+# -------------------- Build --------------------
+
+def hashed_name(path, content):
+    stem, ext = os.path.splitext(path)
+    return f'{stem}.{hashlib.sha256(content).hexdigest()[:10]}{ext}'
+
+
+def build(static_dir, minify=True):
+    """Rebuild static/dist; returns the manifest (source path -> hashed path)"""
+    dist = os.path.join(static_dir, DIST)
+    shutil.rmtree(dist, ignore_errors=True)
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+
+    manifest = {}
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != dist)
+        for filename in sorted(files):
+            if filename in SKIP:
+                continue
+            source = os.path.join(root, filename)
+            path = os.path.relpath(source, static_dir).replace(os.sep, '/')
+            ext = os.path.splitext(filename)[1].lower()
+            with open(source, 'rb') as f:
+                content = f.read()
+            if minify and ext in MINIFIERS:
+                content = MINIFIERS[ext](content.decode('utf-8')).encode('utf-8')
+
+            target = hashed_name(path, content)
+            manifest[path] = target
+            output = os.path.join(dist, target)
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+            with open(output, 'wb') as f:
+                f.write(content)
+            if ext in TEXT_TYPES:
+                with open(output + '.gz', 'wb') as f:
+                    # mtime=0 keeps the archive identical across builds
+                    f.write(gzip.compress(content, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    with open(output + '.br', 'wb') as f:
+                        f.write(brotli.compress(content, quality=11))
+
+    with open(os.path.join(dist, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(static_dir):
+    """The manifest of the last build, or {} when assets were never built"""
+    try:
+        with open(os.path.join(static_dir, DIST, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def precompressed(dist_dir, path, accept_encoding):
+    """(file to send, Content-Encoding or None) for a hashed asset"""
+    accepted = {part.split(';')[0].strip() for part in (accept_encoding or '').lower().split(',')}
+    for encoding, suffix in ENCODINGS:
+        if encoding in accepted and os.path.isfile(os.path.join(dist_dir, path + suffix)):
+            return path + suffix, encoding
+    return path, None
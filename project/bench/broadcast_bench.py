@@ -0,0 +1,134 @@
+"""Bytes and events per second of per-reading vs. batched delta broadcasts.
+
+Simulates ``--clients`` dashboard tabs, ``--tabs`` per user, each watching
+the ``--devices`` devices of its user, with every device producing one
+reading per second. Sensor fields change between two readings with
+probability ``--change``. Frames go through FrameBatcher.publish/flush with
+one view room per user, the grouping the server uses.
+
+    python bench/broadcast_bench.py --clients 1000 --devices 5 --seconds 60
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from broadcast import FrameBatcher, view_devices, view_room  # noqa: E402
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def packet_size(event, data):
+    """Size of the Socket.IO text packet for one emit"""
+    return len('42' + json.dumps([event, data], separators=(',', ':')))
+
+
+def binary_packet_size(event, data):
+    header = '451-' + json.dumps([event, {'_placeholder': True, 'num': 0}], separators=(',', ':'))
+    return len(header) + len(msgpack.packb(data))
+
+
+class Recorder:
+    """Socket.IO stand-in that keeps the emits of one flush"""
+
+    def __init__(self):
+        self.emits = []
+
+    def emit(self, event, data, to=None):
+        self.emits.append((event, data, to))
+
+    def start_background_task(self, target):
+        pass
+
+
+def readings(devices, seconds, change, seed=1):
+    rng = random.Random(seed)
+    state = {d: {'light': 40, 'humidity': 55, 'temperature': 24, 'smoke': 3} for d in range(devices)}
+    for _ in range(seconds):
+        tick = []
+        for device_id, values in state.items():
+            for field in values:
+                if rng.random() < change:
+                    values[field] += rng.choice((-1, 1))
+            tick.append((device_id, dict(values)))
+        yield tick
+
+
+def run(clients, devices, seconds, change, tabs=1):
+    users = max(clients // tabs, 1)
+    # Every user has its own devices and one view room shared by its tabs
+    views = {view_room(range(u * devices, (u + 1) * devices)): tabs for u in range(users)}
+    socketio = Recorder()
+    batcher = FrameBatcher(socketio, keyframe_every=30,
+                           rooms=lambda: {room: view_devices(room) for room in views})
+    legacy_events = legacy_bytes = 0
+    frame_events = frame_bytes = binary_bytes = 0
+
+    started = time.perf_counter()
+    for tick in readings(users * devices, seconds, change):
+        for device_id, values in tick:
+            # The old broadcast: one sensor_data event per reading to every tab of the owner
+            reading = dict(values, timestamp=datetime.now().isoformat())
+            legacy_events += tabs
+            legacy_bytes += packet_size('sensor_data', reading) * tabs
+            batcher.publish(device_id, values)
+
+        socketio.emits.clear()
+        batcher.flush()
+        for event, frame, room in socketio.emits:
+            frame_events += views[room]
+            frame_bytes += packet_size(event, frame) * views[room]
+            if msgpack is not None:
+                binary_bytes += binary_packet_size(event, frame) * views[room]
+    elapsed = time.perf_counter() - started
+
+    result = {
+        'clients': users * tabs,
+        'tabs_per_user': tabs,
+        'devices_per_client': devices,
+        'seconds': seconds,
+        'change_probability': change,
+        'events_per_s': {'legacy': legacy_events / seconds,
+                         'frames': frame_events / seconds},
+        'bytes_per_s': {'legacy': legacy_bytes / seconds,
+                        'frames_json': frame_bytes / seconds},
+        'encode_seconds': elapsed,
+    }
+    if msgpack is not None:
+        result['bytes_per_s']['frames_msgpack'] = binary_bytes / seconds
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--tabs', type=int, default=1, help='dashboard tabs per user')
+    parser.add_argument('--devices', type=int, default=5)
+    parser.add_argument('--seconds', type=int, default=60)
+    parser.add_argument('--change', type=float, default=0.3)
+    parser.add_argument('--json', action='store_true', help='print the raw result as JSON')
+    args = parser.parse_args()
+
+    result = run(args.clients, args.devices, args.seconds, args.change, args.tabs)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+
+    events, sizes = result['events_per_s'], result['bytes_per_s']
+    print(f"{args.clients} clients x {args.devices} devices, {args.seconds}s simulated")
+    print(f"  events/s  legacy {events['legacy']:>12,.0f}   frames {events['frames']:>12,.0f}"
+          f"   ({1 - events['frames'] / events['legacy']:.0%} fewer)")
+    for name, value in sizes.items():
+        saved = '' if name == 'legacy' else f"   ({1 - value / sizes['legacy']:.0%} fewer bytes)"
+        print(f"  bytes/s   {name:<15} {value:>14,.0f}{saved}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,359 @@
+"""Load-testing harness for the HTTP routes and the Socket.IO fan-out.
+
+Starts a fake ESP32 (misc/websocket_server.py) and the dashboard against a
+throwaway SQLite database, then drives each scenario at the configured
+concurrency and reports p50/p95/p99 latency, throughput and server memory.
+Results are written to bench/results/<time>-<commit>.json; pass --compare
+with an earlier file to see the change per scenario.
+
+    python bench/run.py --concurrency 16 --requests 2000 --sio-clients 500
+    python bench/run.py --scenarios dashboard,ingest --compare bench/results/old.json
+"""
+import argparse
+import json
+import os
+import queue
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(PROJECT_DIR, 'bench', 'results')
+
+ADMIN = {'login_id': 'admin', 'password': '12345'}
+ADMIN_EMAIL = 'admin@example.com'
+HTTP_SCENARIOS = ('login', 'dashboard', 'get_devices', 'get_thresholds', 'thresholds', 'ingest')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f'{url} did not come up within {timeout}s')
+
+
+def init_db(env, cwd):
+    """Create the schema and the admin user of the database in ``env``"""
+    subprocess.run([sys.executable, '-m', 'flask', '--app', os.path.join(PROJECT_DIR, 'app.py'), 'init-db'],
+                   cwd=cwd, env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def rss_kb(pid):
+    """Resident memory of a process in KiB (Linux), None elsewhere"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(name, latencies, errors, elapsed, memory):
+    latencies = sorted(latencies)
+    ms = lambda v: round(v * 1000, 3) if v is not None else None  # noqa: E731
+    return {
+        'scenario': name,
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'latency_ms': {
+            'p50': ms(percentile(latencies, 50)),
+            'p95': ms(percentile(latencies, 95)),
+            'p99': ms(percentile(latencies, 99)),
+            'mean': ms(statistics.fmean(latencies)) if latencies else None,
+        },
+        'server_rss_kb': memory,
+    }
+
+
+class Servers:
+    """Fake ESP32 plus the dashboard, each in its own process"""
+
+    def __init__(self, esp_latency=0.0, async_mode='threading'):
+        self.esp_port = free_port()
+        self.app_port = free_port()
+        self.db_dir = tempfile.mkdtemp(prefix='iot-bench-')
+        self.esp_latency = esp_latency
+        self.async_mode = async_mode
+        self.processes = []
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.app_port}'
+
+    def __enter__(self):
+        quiet = dict(stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.esp = subprocess.Popen(
+            [sys.executable, 'misc/websocket_server.py', '--port', str(self.esp_port),
+             '--latency', str(self.esp_latency), '--no-debug'],
+            cwd=PROJECT_DIR, **quiet)
+        env = dict(os.environ, PORT=str(self.app_port), FLASK_DEBUG='0',
+                   CORS_ALLOWED_ORIGINS='*', ASYNC_MODE=self.async_mode,
+                   DATABASE_URL=f'sqlite:///{os.path.join(self.db_dir, "bench.db")}')
+        env.pop('SOCKETIO_MESSAGE_QUEUE', None)
+        init_db(env, cwd=self.db_dir)
+        # Run from the scratch directory so logs stay out of the source tree
+        self.app = subprocess.Popen([sys.executable, os.path.join(PROJECT_DIR, 'app.py')],
+                                    cwd=self.db_dir, env=env, **quiet)
+        self.processes = [self.esp, self.app]
+        wait_for(f'http://127.0.0.1:{self.esp_port}/')
+        wait_for(self.base_url + '/')
+        return self
+
+    def __exit__(self, *exc):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.wait(timeout=10)
+
+    def login(self):
+        session = requests.Session()
+        session.post(self.base_url + '/login', data=ADMIN, allow_redirects=False)
+        return session
+
+    def add_device(self):
+        session = self.login()
+        session.post(self.base_url + '/add_device', data={
+            'device_name': 'bench', 'device_type': 'sensor',
+            'device_host': f'127.0.0.1:{self.esp_port}'})
+        devices = session.get(self.base_url + '/get_devices').json()['devices']
+        return devices[-1]['id']
+
+
+def http_scenario(servers, name, device_id, batch):
+    """Return a callable doing one request of the scenario with a given session"""
+    url = servers.base_url
+
+    if name == 'login':
+        return lambda session: session.post(url + '/login', data=ADMIN, allow_redirects=False)
+    if name == 'dashboard':
+        return lambda session: session.get(url + '/dashboard')
+    if name == 'get_devices':
+        return lambda session: session.get(url + '/get_devices')
+    if name == 'get_thresholds':
+        return lambda session: session.get(url + '/get_thresholds', params={'email': ADMIN_EMAIL})
+    if name == 'thresholds':
+        return lambda session: session.get(url + '/api/thresholds')
+    if name == 'ingest':
+        def ingest(session):
+            now = time.time()
+            return session.post(url + '/api/readings', json={
+                'device_id': device_id,
+                'readings': [{'temperature': 22.5, 'humidity': 40, 'lightLevel': 12,
+                              'coLevel': 3, 'timestamp': now - i} for i in range(batch)]})
+        return ingest
+    raise ValueError(f'Unknown scenario: {name}')
+
+
+def run_http(servers, name, device_id, concurrency, total, batch):
+    call = http_scenario(servers, name, device_id, batch)
+    # One session per concurrent caller, logged in before the clock starts
+    sessions = queue.Queue()
+    for _ in range(concurrency):
+        sessions.put(requests.Session() if name == 'login' else servers.login())
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    peak = [rss_kb(servers.app.pid)]
+
+    def one(_):
+        nonlocal errors
+        session = sessions.get()
+        started = time.perf_counter()
+        try:
+            ok = call(session).status_code < 400
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - started
+        sessions.put(session)
+        with lock:
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors += 1
+
+    def sample_memory(stop):
+        while not stop.wait(0.2):
+            peak.append(rss_kb(servers.app.pid))
+
+    stop = threading.Event()
+    threading.Thread(target=sample_memory, args=(stop,), daemon=True).start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    return summarize(name, latencies, errors, elapsed, max(filter(None, peak), default=None))
+
+
+def run_socketio(servers, device_id, clients, rounds):
+    """Many Socket.IO clients asking for sensor data of the same device.
+
+    Latency is measured from the emit to the first sensor_data or
+    sensor_frame received by that client.
+    """
+    import socketio
+
+    session = servers.login()
+    connected, latencies, errors = [], [], 0
+    lock = threading.Lock()
+    baseline = rss_kb(servers.app.pid)
+
+    def connect(_):
+        client = socketio.Client(http_session=session, reconnection=False)
+        received = threading.Event()
+        client.on('sensor_data', lambda data: received.set())
+        client.on('sensor_frame', lambda data: received.set())
+        client.connect(servers.base_url)
+        return client, received
+
+    with ThreadPoolExecutor(max_workers=64) as pool:
+        for result in pool.map(lambda i: _safe(connect, i), range(clients)):
+            if result is None:
+                errors += 1
+            else:
+                connected.append(result)
+    memory_connected = rss_kb(servers.app.pid)
+
+    def ask(pair):
+        nonlocal errors
+        client, received = pair
+        received.clear()
+        started = time.perf_counter()
+        client.emit('request_sensor_data', {'device_id': device_id})
+        ok = received.wait(10)
+        with lock:
+            if ok:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    # The first request starts the device poller; keep it out of the numbers
+    if connected:
+        ask(connected[0])
+        time.sleep(1)
+        latencies.clear()
+        errors = clients - len(connected)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=64) as pool:
+        for _ in range(rounds):
+            list(pool.map(ask, connected))
+    elapsed = time.perf_counter() - started
+    peak = rss_kb(servers.app.pid)
+
+    with ThreadPoolExecutor(max_workers=64) as pool:
+        list(pool.map(lambda pair: _safe(pair[0].disconnect), connected))
+
+    result = summarize('socketio_request_sensor_data', latencies, errors, elapsed, peak)
+    result['clients'] = len(connected)
+    if baseline and memory_connected:
+        result['rss_per_connection_kb'] = round((memory_connected - baseline) / max(1, len(connected)), 2)
+    return result
+
+
+def _safe(fn, *args):
+    try:
+        return fn(*args)
+    except Exception:
+        return None
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=PROJECT_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(current, previous_path):
+    with open(previous_path) as f:
+        previous = {r['scenario']: r for r in json.load(f)['results']}
+    print(f'\nCompared with {previous_path}:')
+    for result in current['results']:
+        old = previous.get(result['scenario'])
+        if not old or not old['latency_ms']['p95'] or not result['latency_ms']['p95']:
+            continue
+        p95 = result['latency_ms']['p95'] / old['latency_ms']['p95'] - 1
+        rps = (result['throughput_rps'] or 0) / (old['throughput_rps'] or 1) - 1
+        print(f"  {result['scenario']:<32} p95 {p95:+.0%}   throughput {rps:+.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the dashboard HTTP routes and Socket.IO fan-out')
+    parser.add_argument('--scenarios', default=','.join(HTTP_SCENARIOS + ('socketio',)))
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=500, help='requests per HTTP scenario')
+    parser.add_argument('--batch', type=int, default=10, help='readings per ingestion request')
+    parser.add_argument('--sio-clients', type=int, default=200)
+    parser.add_argument('--sio-rounds', type=int, default=3)
+    parser.add_argument('--esp-latency', type=float, default=0.0)
+    parser.add_argument('--async-mode', default='threading', choices=('threading', 'eventlet', 'gevent'),
+                        help='ASYNC_MODE of the server under test')
+    parser.add_argument('--output', help='result file, defaults to bench/results/<time>-<commit>.json')
+    parser.add_argument('--compare', help='earlier result file to compare with')
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    report = {
+        'commit': git_commit(),
+        'started': datetime.now().isoformat(timespec='seconds'),
+        'settings': vars(args),
+        'results': [],
+    }
+
+    with Servers(esp_latency=args.esp_latency, async_mode=args.async_mode) as servers:
+        device_id = servers.add_device()
+        for name in scenarios:
+            if name == 'socketio':
+                result = run_socketio(servers, device_id, args.sio_clients, args.sio_rounds)
+            else:
+                result = run_http(servers, name, device_id, args.concurrency, args.requests, args.batch)
+            report['results'].append(result)
+            latency = result['latency_ms']
+            print(f"{result['scenario']:<32} {result['throughput_rps'] or 0:>9.1f} req/s   "
+                  f"p50 {latency['p50']} ms   p95 {latency['p95']} ms   p99 {latency['p99']} ms   "
+                  f"errors {result['errors']}   rss {result['server_rss_kb']} KiB")
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        output = os.path.join(RESULTS_DIR, f"{stamp}-{report['commit']}.json")
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'\nResults written to {output}')
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
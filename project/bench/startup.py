@@ -0,0 +1,152 @@
+"""Startup benchmark: import time, create_app() and time to first request.
+
+Each run uses a fresh interpreter against a throwaway SQLite database that
+``flask init-db`` prepared beforehand:
+
+* ``in_process`` imports app.py, calls create_app() and serves one request
+  through the test client, timing each step.
+* ``server`` starts ``python app.py`` and polls until the first response,
+  which is what a process manager spawning workers waits for.
+
+``python -c pass`` is measured too, so the interpreter's own start can be
+told apart. Results are written to bench/results/startup-<time>-<commit>.json;
+pass --compare with an earlier file to see the change.
+
+    python bench/startup.py --runs 5
+    python bench/startup.py --async-mode eventlet --compare bench/results/startup-old.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import requests
+
+from run import PROJECT_DIR, RESULTS_DIR, free_port, git_commit, init_db
+
+IN_PROCESS = '''
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.create_app()
+created = time.perf_counter()
+status = app.app.test_client().get('/login').status_code
+served = time.perf_counter()
+print(json.dumps({'import_s': imported - started, 'create_app_s': created - imported,
+                  'first_request_s': served - created, 'status': status,
+                  'modules': len(sys.modules)}))
+'''
+
+
+def interpreter_start(env):
+    started = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'], env=env, check=True)
+    return time.perf_counter() - started
+
+
+def in_process(env, cwd):
+    output = subprocess.check_output([sys.executable, '-c', IN_PROCESS], cwd=cwd, env=env,
+                                     stderr=subprocess.DEVNULL, text=True)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def server_first_response(env, cwd, timeout=60):
+    """Seconds from spawning app.py to its first HTTP response"""
+    port = free_port()
+    url = f'http://127.0.0.1:{port}/login'
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(PROJECT_DIR, 'app.py')], cwd=cwd,
+                               env=dict(env, PORT=str(port)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                requests.get(url, timeout=1)
+                return time.perf_counter() - started
+            except requests.RequestException:
+                if process.poll() is not None:
+                    raise RuntimeError('app.py exited before serving a request')
+                time.sleep(0.01)
+        raise RuntimeError(f'app.py did not answer within {timeout}s')
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def summarize(values):
+    return {'median_ms': round(statistics.median(values) * 1000, 1),
+            'min_ms': round(min(values) * 1000, 1),
+            'max_ms': round(max(values) * 1000, 1)}
+
+
+def compare(current, previous_path):
+    with open(previous_path) as f:
+        previous = json.load(f)['results']
+    print(f'\nCompared with {previous_path}:')
+    for name, result in current['results'].items():
+        old = previous.get(name)
+        if old and old['median_ms']:
+            print(f"  {name:<24} median {result['median_ms'] / old['median_ms'] - 1:+.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the startup of the dashboard')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--async-mode', default='threading', choices=('threading', 'eventlet', 'gevent'))
+    parser.add_argument('--output', help='result file, defaults to bench/results/startup-<time>-<commit>.json')
+    parser.add_argument('--compare', help='earlier result file to compare with')
+    args = parser.parse_args()
+
+    db_dir = tempfile.mkdtemp(prefix='iot-startup-')
+    env = dict(os.environ, FLASK_DEBUG='0', ASYNC_MODE=args.async_mode, PYTHONPATH=PROJECT_DIR,
+               DATABASE_URL=f'sqlite:///{os.path.join(db_dir, "startup.db")}')
+    env.pop('SOCKETIO_MESSAGE_QUEUE', None)
+    init_db(env, cwd=db_dir)
+
+    samples = {name: [] for name in ('interpreter', 'import', 'create_app', 'first_request',
+                                     'in_process_total', 'server_first_response')}
+    modules = None
+    for _ in range(args.runs):
+        samples['interpreter'].append(interpreter_start(env))
+        run = in_process(env, db_dir)
+        if run['status'] != 200:
+            raise RuntimeError(f"/login answered {run['status']}")
+        samples['import'].append(run['import_s'])
+        samples['create_app'].append(run['create_app_s'])
+        samples['first_request'].append(run['first_request_s'])
+        samples['in_process_total'].append(run['import_s'] + run['create_app_s'] + run['first_request_s'])
+        samples['server_first_response'].append(server_first_response(env, db_dir))
+        modules = run['modules']
+
+    report = {
+        'commit': git_commit(),
+        'started': datetime.now().isoformat(timespec='seconds'),
+        'settings': vars(args),
+        'modules_loaded': modules,
+        'results': {name: summarize(values) for name, values in samples.items()},
+    }
+    for name, result in report['results'].items():
+        print(f"{name:<24} median {result['median_ms']:>8.1f} ms   "
+              f"min {result['min_ms']:>8.1f} ms   max {result['max_ms']:>8.1f} ms")
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        output = os.path.join(RESULTS_DIR, f"startup-{stamp}-{report['commit']}.json")
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'\nResults written to {output}')
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Short keys used on the wire
+FIELDS = (('light', 'l'), ('humidity', 'h'), ('temperature', 't'), ('smoke', 's'))
+
+
+def compact(reading, precision=2):
+    """Reading dict -> {'l': .., 'h': .., 't': .., 's': ..} rounded for display"""
+    out = {}
+    for name, key in FIELDS:
+        value = reading.get(name)
+        if value is not None:
+            out[key] = round(value, precision)
+    return out
+
+
+def expand(fields):
+    """Inverse of compact(), for consumers that want the long field names"""
+    return {name: fields[key] for name, key in FIELDS if key in fields}
+
+
+VIEW_PREFIX = 'view:'
+
+
+def view_room(device_ids):
+    """Room of the sockets watching exactly ``device_ids``, e.g. 'view:3,7'"""
+    return VIEW_PREFIX + ','.join(str(d) for d in sorted(set(device_ids)))
+
+
+def view_devices(room):
+    """Device ids (as strings, the frame keys) of a view room"""
+    ids = room[len(VIEW_PREFIX):]
+    return ids.split(',') if ids else []
+
+
+class FrameBatcher:
+    """Batches readings into one delta-encoded frame per subscriber group and tick.
+
+    Sockets watching the same set of devices (usually every tab of one user)
+    share a view room, and every view room gets at most one ``sensor_frame``
+    event per tick carrying all of its devices that changed. ``rooms()``
+    returns the view rooms that have subscribers, as {room: device ids};
+    without it every reading goes to one room, ``None``, i.e. to everybody.
+
+    Fields equal to what the room already received are left out; every
+    ``keyframe_every`` ticks a full frame is sent so clients that missed a
+    frame resynchronise. Frames are
+    ``{'ts': epoch ms, 'full': bool, 'd': {device_id: {short key: value}}}``
+    and are MessagePack-encoded when ``encoding`` is ``'msgpack'``.
+    """
+
+    def __init__(self, socketio, tick=1.0, keyframe_every=30, encoding='json',
+                 event='sensor_frame', rooms=None):
+        self.socketio = socketio
+        self.tick = tick
+        self.keyframe_every = keyframe_every
+        self.event = event
+        self.encode = _encoder(encoding)
+        self.rooms = rooms or (lambda: {None: None})
+        self._pending = {}  # device_id -> compact fields published since the last tick
+        self._latest = {}  # device_id -> last compact fields, for snapshots
+        self._sent = {}  # room -> {device_id: fields as last sent}
+        self._ticks = 0
+        self._started = False
+        self._lock = threading.Lock()
+
+    def publish(self, device_id, reading):
+        fields = compact(reading)
+        with self._lock:
+            self._pending[str(device_id)] = fields
+            self._latest.setdefault(str(device_id), {}).update(fields)
+            if not self._started:
+                self._started = True
+                self.socketio.start_background_task(self._run)
+
+    def forget(self, device_id):
+        with self._lock:
+            self._pending.pop(str(device_id), None)
+            self._latest.pop(str(device_id), None)
+            for sent in self._sent.values():
+                sent.pop(str(device_id), None)
+
+    def snapshot(self, device_ids=None):
+        """Full frame with the latest state of ``device_ids`` (all when None), for new joiners"""
+        with self._lock:
+            keys = self._latest if device_ids is None else [str(d) for d in device_ids]
+            state = {d: dict(self._latest[d]) for d in keys if d in self._latest}
+        return self.encode({'ts': int(time.time() * 1000), 'full': True, 'd': state})
+
+    def build(self, room, readings, full=False):
+        """Delta frame for ``room`` or None when nothing changed"""
+        sent = self._sent.setdefault(room, {})
+        delta = {}
+        for device_id, fields in readings.items():
+            last = sent.get(device_id)
+            if last is None or full:
+                changed = fields
+            else:
+                changed = {k: v for k, v in fields.items() if last.get(k) != v}
+            if changed:
+                delta[device_id] = changed
+                if last is None:
+                    sent[device_id] = dict(fields)
+                else:
+                    last.update(fields)
+        if full:
+            delta = {d: dict(f) for d, f in sent.items()}
+        if not delta:
+            return None
+        return {'ts': int(time.time() * 1000), 'full': full, 'd': delta}
+
+    def flush(self):
+        """Build and send this tick's frames; returns the number sent"""
+        rooms = self.rooms()
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._ticks += 1
+            full = bool(self.keyframe_every) and self._ticks % self.keyframe_every == 0
+            for room in set(self._sent) - set(rooms):
+                del self._sent[room]  # nobody watches this set of devices any more
+            frames = []
+            for room, devices in rooms.items():
+                readings = pending if devices is None else {d: pending[d] for d in devices if d in pending}
+                if readings or full:
+                    frames.append((room, self.build(room, readings, full)))
+        sent = 0
+        for room, frame in frames:
+            if frame is not None:
+                self.socketio.emit(self.event, self.encode(frame), to=room)
+                sent += 1
+        return sent
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.tick)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Sending sensor frames failed')
+
+
+def _encoder(encoding):
+    if encoding == 'msgpack':
+        import msgpack
+        return msgpack.packb
+    if encoding != 'json':
+        raise ValueError(f'Unknown frame encoding: {encoding}')
+    return lambda frame: frame
@@ -0,0 +1,142 @@
+import itertools
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from transport import DeviceClient
+
+logger = logging.getLogger(__name__)
+
+
+class Command:
+    __slots__ = ('id', 'device_id', 'user_id', 'url', 'state', 'attempts', 'error',
+                 'superseded_by', 'created', 'finished')
+
+    def __init__(self, command_id, device_id, url, user_id=None):
+        self.id = command_id
+        self.device_id = device_id
+        self.user_id = user_id  # who sent it; only they may look it up
+        self.url = url
+        self.state = 'queued'  # queued, running, done, failed or superseded
+        self.attempts = 0
+        self.error = None
+        self.superseded_by = None
+        self.created = time.time()
+        self.finished = None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'device_id': self.device_id,
+            'state': self.state,
+            'attempts': self.attempts,
+            'error': self.error,
+            'superseded_by': self.superseded_by,
+            'created': self.created,
+            'finished': self.finished,
+        }
+
+
+class CommandDispatcher:
+    """Sends device commands from a bounded worker pool.
+
+    Commands to one device run one at a time. A command that is still queued
+    when a newer one for the same device arrives is superseded, so an
+    activate followed by a deactivate only sends the deactivate. Each device
+    host gets its own keep-alive session (see DeviceClient), and failed calls are retried with
+    exponential backoff and jitter.
+    """
+
+    def __init__(self, workers=4, timeout=3, retries=3, backoff=0.5,
+                 history=1000, on_update=None, client=None):
+        self.timeout = timeout
+        self.client = client or DeviceClient(timeout=timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.history = history
+        self.on_update = on_update  # on_update(command) after every state change
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix='device-command')
+        self._pending = {}  # device_id -> queued Command
+        self._busy = set()  # devices with a worker draining their queue
+        self._commands = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, device_id, url, user_id=None):
+        with self._lock:
+            command = Command(next(self._ids), device_id, url, user_id)
+            previous = self._pending.get(device_id)
+            if previous is not None:
+                previous.state = 'superseded'
+                previous.superseded_by = command.id
+            self._pending[device_id] = command
+            self._commands[command.id] = command
+            while len(self._commands) > self.history:
+                self._commands.popitem(last=False)
+            start = device_id not in self._busy
+            self._busy.add(device_id)
+        if previous is not None:
+            self._notify(previous)
+        if start:
+            self._executor.submit(self._drain, device_id)
+        return command
+
+    def get(self, command_id):
+        return self._commands.get(command_id)
+
+    def _notify(self, command):
+        if self.on_update is not None:
+            try:
+                self.on_update(command)
+            except Exception as e:
+                logger.error(f'Command update callback failed: {e}')
+
+    def _drain(self, device_id):
+        drained = False
+        try:
+            while True:
+                with self._lock:
+                    command = self._pending.pop(device_id, None)
+                    if command is None:
+                        # Under the same lock as submit(), so no command is stranded
+                        self._busy.discard(device_id)
+                        drained = True
+                        return
+                    command.state = 'running'
+                self._notify(command)
+                self._send(command)
+                command.finished = time.time()
+                self._notify(command)
+        finally:
+            if not drained:
+                # Let the next submit start a new worker for this device
+                with self._lock:
+                    self._busy.discard(device_id)
+
+    def _send(self, command):
+        for attempt in range(self.retries + 1):
+            command.attempts = attempt + 1
+            try:
+                response = self.client.post(command.url, timeout=self.timeout)
+                if response.status_code == 200:
+                    command.state = 'done'
+                    command.error = None
+                    return
+                command.error = f'HTTP {response.status_code}'
+            except requests.RequestException as e:
+                command.error = str(e)
+            except Exception as e:
+                command.state = 'failed'
+                command.error = str(e) or type(e).__name__
+                logger.exception(f'Command {command.id} to device {command.device_id} failed')
+                return
+            if attempt < self.retries:
+                time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+        command.state = 'failed'
+        logger.warning(f'Command {command.id} to device {command.device_id} failed: {command.error}')
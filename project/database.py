@@ -0,0 +1,69 @@
+import math
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+DEFAULT_DATABASE_URL = 'sqlite:///users.db'
+
+
+def database_url():
+    """DATABASE_URL from the environment, accepting Heroku-style postgres:// URLs"""
+    url = os.environ.get('DATABASE_URL', DEFAULT_DATABASE_URL)
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def engine_options(url):
+    """SQLALCHEMY_ENGINE_OPTIONS for the given database URL.
+
+    Every setting can be tuned through the environment:
+
+    * DB_POOL_SIZE / DB_MAX_OVERFLOW / DB_POOL_TIMEOUT / DB_POOL_RECYCLE
+      size the connection pool (requests, the ingest flusher, the compactor
+      and Socket.IO handlers all draw from it).
+    * SQLITE_BUSY_TIMEOUT is how long, in milliseconds, a SQLite writer waits
+      for the lock before failing with ``database is locked``.
+    """
+    options = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        'pool_pre_ping': True,
+    }
+    if url.startswith('sqlite'):
+        if ':memory:' in url or url in ('sqlite://', 'sqlite:///'):
+            return {}  # Flask-SQLAlchemy shares one in-memory connection
+        # SQLAlchemy 1.4 opens a new file connection per checkout; keep them
+        # pooled so the pragmas below run once per connection, not per query
+        busy_timeout = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+        options.update(poolclass=QueuePool,
+                       connect_args={'check_same_thread': False, 'timeout': busy_timeout / 1000})
+    else:
+        options['pool_recycle'] = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    return options
+
+
+@event.listens_for(Engine, 'connect')
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL lets readers run while one writer commits; NORMAL syncs at checkpoints only"""
+    if type(dbapi_connection).__module__.split('.')[0] not in ('sqlite3', 'pysqlite2'):
+        return
+    busy_timeout = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute(f'PRAGMA busy_timeout={busy_timeout}')
+    cursor.close()
+    try:
+        dbapi_connection.execute('SELECT floor(0)')
+    except Exception:
+        # floor() is only built in when SQLite has its math functions;
+        # time bucketing relies on it
+        dbapi_connection.create_function('floor', 1, _floor, deterministic=True)
+
+
+def _floor(value):
+    return None if value is None else math.floor(value)
@@ -7,7 +7,9 @@
 // Wi-Fi Credentials
 const char* ssid = "Network Name";
 const char* password = "Password";
-const char* FLASK_SERVER = "IP of Flask Server";
+const char* FLASK_SERVER = "http://IP of Flask Server:5000/api/readings";
+const int DEVICE_ID = 1;  // id of this board on the dashboard
+const char* DEVICE_KEY = "Ingest key shown when the device was added";
 
 // Sensor Pin Configuration
 #define DHT_PIN 4       // GPIO pin for DHT sensor
@@ -186,8 +188,10 @@ void sendDataToFlask() {
     HTTPClient http;
     http.begin(FLASK_SERVER);
     http.addHeader("Content-Type", "application/json");
+    http.addHeader("X-Device-Key", DEVICE_KEY);
 
     StaticJsonDocument<200> doc;
+    doc["device_id"] = DEVICE_ID;
     doc["temperature"] = currentData.temperature;
     doc["humidity"] = currentData.humidity;
     doc["lightLevel"] = currentData.lightLevel;
@@ -0,0 +1,191 @@
+"""Streaming export of raw readings as CSV, NDJSON or Parquet.
+
+Rows are read in pages of ``page_size`` with keyset pagination on
+(device, ts, id): every page is one short indexed query on its own pooled
+connection, so memory stays flat however long the export is, and a slow
+client holds neither a connection nor a read snapshot between pages.
+Pages are encoded as they arrive; Parquet output is written one row group at
+a time and needs ``pyarrow``.
+
+``ExportLimiter`` caps concurrent exports per worker (one per user) and
+``throttled`` caps their rows per second, so a large export leaves the
+database to live ingestion.
+"""
+import csv
+import io
+import json
+import threading
+import time
+
+from sqlalchemy import select, tuple_
+
+from history import METRICS
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+class Busy(Exception):
+    """Too many exports running; retry after ``retry_after`` seconds"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ExportLimiter:
+    """At most ``max_concurrent`` exports at once in this worker, one per key (user)"""
+
+    def __init__(self, max_concurrent=2, retry_after=30):
+        self.max_concurrent = max_concurrent
+        self.retry_after = retry_after
+        self._running = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._running)
+
+    def acquire(self, key):
+        with self._lock:
+            if key in self._running:
+                raise Busy('An export of yours is still running.', self.retry_after)
+            if len(self._running) >= self.max_concurrent:
+                raise Busy('Too many exports are running.', self.retry_after)
+            self._running.add(key)
+
+    def release(self, key):
+        with self._lock:
+            self._running.discard(key)
+
+
+# -------------------- Reading --------------------
+
+def pages(engine, table, device_ids, metrics, start, end, page_size=5000):
+    """Yield lists of (device_id, ts, *metrics) rows, ordered by device and time"""
+    columns = [table.c.device_id, table.c.ts] + [table.c[m] for m in metrics]
+    for device_id in sorted(device_ids):
+        last = None
+        while True:
+            query = (select(table.c.id, *columns)
+                     .where(table.c.device_id == device_id, table.c.ts >= start, table.c.ts < end)
+                     .order_by(table.c.ts, table.c.id)
+                     .limit(page_size))
+            if last is not None:
+                query = query.where(tuple_(table.c.ts, table.c.id) > last)
+            with engine.connect() as conn:
+                rows = conn.execute(query).all()
+            if not rows:
+                break
+            last = (rows[-1].ts, rows[-1].id)
+            yield [tuple(row[1:]) for row in rows]
+            if len(rows) < page_size:
+                break
+
+
+def throttled(source, rows_per_second, sleep=time.sleep):
+    """Pass pages through, sleeping so they average at most ``rows_per_second``"""
+    started = time.monotonic()
+    sent = 0
+    for page in source:
+        yield page
+        sent += len(page)
+        if rows_per_second:
+            ahead = sent / rows_per_second - (time.monotonic() - started)
+            sleep(max(ahead, 0))  # sleep(0) still lets green threads run
+
+
+# -------------------- Encoding --------------------
+
+def to_csv(source, metrics):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(('device_id', 'ts') + tuple(metrics))
+    for page in source:
+        writer.writerows(page)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def to_ndjson(source, metrics):
+    names = ('device_id', 'ts') + tuple(metrics)
+    for page in source:
+        yield ''.join(json.dumps(dict(zip(names, row))) + '\n' for row in page)
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file that hands out what was written since the last take()"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self):
+        data, self._chunks = b''.join(self._chunks), []
+        return data
+
+
+def to_parquet(source, metrics, row_group_rows=100_000):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([('device_id', pa.int64()), ('ts', pa.float64())] +
+                       [(m, pa.float64()) for m in metrics])
+    sink = _Sink()
+    writer = pq.ParquetWriter(sink, schema)
+    group = []
+    try:
+        for page in source:
+            group.extend(page)
+            if len(group) >= row_group_rows:
+                writer.write_table(_table(pa, schema, group))
+                group = []
+                yield sink.take()
+        if group:
+            writer.write_table(_table(pa, schema, group))
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+def _table(pa, schema, rows):
+    columns = zip(*rows)
+    return pa.Table.from_arrays([pa.array(c, type=t) for c, t in zip(columns, schema.types)], schema=schema)
+
+
+ENCODERS = {'csv': to_csv, 'ndjson': to_ndjson, 'parquet': to_parquet}
+
+
+def parquet_available():
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def parse_metrics(value):
+    """'temperature,smoke' -> ('temperature', 'smoke'); all metrics when empty"""
+    if not value:
+        return METRICS
+    metrics = tuple(m.strip() for m in value.split(',') if m.strip())
+    unknown = [m for m in metrics if m not in METRICS]
+    if unknown:
+        raise ValueError(f'Unknown metric: {", ".join(unknown)}')
+    return metrics
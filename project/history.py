@@ -0,0 +1,95 @@
+from sqlalchemy import func, cast, or_, Integer
+
+# Metric names match the keys served by /get_thresholds
+METRICS = ('light', 'humidity', 'temperature', 'smoke')
+
+MAX_BUCKETS = 2000
+PRESELECT = 2  # LTTB input: min and max of PRESELECT * points buckets
+
+
+def bucketed(session, model, device_id, metric, start, end, buckets):
+    """Aggregate a metric into ``buckets`` equal time slices in SQL.
+
+    Only one row per non-empty bucket leaves the database, so the cost of
+    the response depends on the bucket count, not on the raw row count.
+    """
+    column = getattr(model, metric)
+    width = (end - start) / buckets
+    # floor before the cast: SQLite truncates but PostgreSQL rounds
+    index = cast(func.floor((model.ts - start) / width), Integer).label('bucket')
+    rows = (session.query(index, func.min(column), func.max(column),
+                          func.avg(column), func.count(column))
+            .filter(model.device_id == device_id,
+                    model.ts >= start, model.ts < end,
+                    column.isnot(None))
+            .group_by(index)
+            .order_by(index)
+            .all())
+    return [{
+        'timestamp': start + i * width,
+        'min': lo,
+        'max': hi,
+        'mean': mean,
+        'count': count,
+    } for i, lo, hi, mean, count in rows]
+
+
+def lttb(ts, values, threshold):
+    """Largest-Triangle-Three-Buckets downsampling of one series.
+
+    Keeps the first and last points and, for every bucket in between, the
+    point forming the largest triangle with the previously kept point and
+    the average of the next bucket. Area computation is vectorized per
+    bucket, so Python only loops ``threshold`` times.
+    """
+    import numpy as np
+
+    ts = np.asarray(ts, dtype=float)
+    values = np.asarray(values, dtype=float)
+    n = len(ts)
+    if threshold >= n or threshold < 3:
+        return ts, values
+
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    keep = np.empty(threshold, dtype=int)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nxt_lo, nxt_hi = hi, edges[i + 2] if i + 2 < len(edges) else n
+        avg_t = ts[nxt_lo:nxt_hi].mean()
+        avg_v = values[nxt_lo:nxt_hi].mean()
+        area = np.abs((ts[a] - avg_t) * (values[lo:hi] - values[a])
+                      - (ts[a] - ts[lo:hi]) * (avg_v - values[a]))
+        a = lo + int(area.argmax())
+        keep[i + 1] = a
+    return ts[keep], values[keep]
+
+
+def downsampled(session, model, device_id, metric, start, end, points):
+    """Raw series of one metric reduced to at most ``points`` with LTTB.
+
+    The database first narrows the range to the lowest and highest reading
+    of each of ``PRESELECT * points`` time buckets, so LTTB runs on at most
+    ``2 * PRESELECT * points`` rows however many raw readings there are.
+    """
+    column = getattr(model, metric)
+    width = (end - start) / (PRESELECT * points)
+    bucket = cast(func.floor((model.ts - start) / width), Integer)
+    ranked = (session.query(
+                model.ts.label('ts'), column.label('value'),
+                func.row_number().over(partition_by=bucket, order_by=(column, model.ts)).label('low'),
+                func.row_number().over(partition_by=bucket, order_by=(column.desc(), model.ts)).label('high'))
+              .filter(model.device_id == device_id,
+                      model.ts >= start, model.ts < end,
+                      column.isnot(None))
+              .subquery())
+    rows = (session.query(ranked.c.ts, ranked.c.value)
+            .filter(or_(ranked.c.low == 1, ranked.c.high == 1))
+            .order_by(ranked.c.ts)
+            .all())
+    if not rows:
+        return []
+    ts, values = zip(*rows)
+    ts, values = lttb(ts, values, points)
+    return [{'timestamp': t, 'value': v} for t, v in zip(ts.tolist(), values.tolist())]
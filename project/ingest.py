@@ -0,0 +1,179 @@
+import logging
+import math
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy.exc import DataError, IntegrityError, OperationalError
+
+logger = logging.getLogger(__name__)
+
+# The ESP32 firmware and the dashboard use different names for two metrics
+FIELD_ALIASES = {
+    'temperature': ('temperature',),
+    'humidity': ('humidity',),
+    'light': ('light', 'lightLevel'),
+    'smoke': ('smoke', 'coLevel'),
+}
+
+MAX_VALUE = 1e9              # larger readings are garbage, whatever the sensor
+MAX_CLOCK_SKEW = 86400       # readings may be at most this far in the future (seconds)
+MAX_DEVICE_ID = 2 ** 63 - 1  # largest id the database column can hold
+
+
+def parse_timestamp(value):
+    """Accept epoch seconds, epoch milliseconds or an ISO 8601 string"""
+    if value is None:
+        return time.time()
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return datetime.fromisoformat(str(value)).timestamp()
+    if not math.isfinite(value):
+        raise ValueError(f'Invalid timestamp: {value}')
+    return value / 1000.0 if value > 1e11 else value
+
+
+def _reading_time(value):
+    """parse_timestamp() limited to times a reading can have been taken at"""
+    ts = parse_timestamp(value)
+    if not 0 <= ts <= time.time() + MAX_CLOCK_SKEW:
+        raise ValueError(f'Timestamp out of range: {value}')
+    return ts
+
+
+def _metric_value(field, value):
+    value = float(value)
+    if not math.isfinite(value) or abs(value) > MAX_VALUE:
+        raise ValueError(f'Invalid {field} value: {value}')
+    return value
+
+
+def parse_readings(payload, device_id=None):
+    """Turn an ingestion payload into rows for the Reading table.
+
+    The payload can be a single reading, a list of readings, or an object
+    with a ``readings`` list, which is how an offline device uploads its
+    backlog in one request. Raises ValueError on malformed input.
+    """
+    if isinstance(payload, dict) and 'readings' in payload:
+        device_id = payload.get('device_id', device_id)
+        items = payload['readings']
+    elif isinstance(payload, list):
+        items = payload
+    elif isinstance(payload, dict):
+        items = [payload]
+    else:
+        raise ValueError('Expected a reading, a list of readings or {"readings": [...]}')
+
+    rows = []
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError('Each reading must be an object')
+        if item.get('device_id', device_id) is None:
+            raise ValueError('Missing device_id')
+        try:
+            row_device = int(item.get('device_id', device_id))
+        except OverflowError:
+            raise ValueError('Invalid device_id')
+        if not 0 < row_device <= MAX_DEVICE_ID:
+            raise ValueError('Invalid device_id')
+        row = {
+            'device_id': row_device,
+            'ts': _reading_time(item.get('timestamp')),
+        }
+        for field, names in FIELD_ALIASES.items():
+            value = next((item[n] for n in names if item.get(n) is not None), None)
+            row[field] = _metric_value(field, value) if value is not None else None
+        rows.append(row)
+    return rows
+
+
+class ReadingBuffer:
+    """Collects incoming readings in memory and writes them in bulk.
+
+    A flush happens when ``max_rows`` readings are pending or the oldest one
+    has waited ``max_age`` seconds. Writes always run on the background
+    flusher, so an ingestion request never waits for the database. When the
+    database is unavailable a batch is retried ``retries`` times, backing off
+    from ``backoff`` seconds, and then kept for the next flush.
+    """
+
+    def __init__(self, socketio, flush, max_rows=500, max_age=1.0, retries=3, backoff=0.5):
+        self.socketio = socketio
+        self.flush_fn = flush  # flush(rows) writes one batch
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.retries = retries
+        self.backoff = backoff
+        self._rows = []
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._started = False
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add(self, rows):
+        with self._lock:
+            if not self._rows:
+                self._oldest = time.monotonic()
+            self._rows.extend(rows)
+            full = len(self._rows) >= self.max_rows
+            if not self._started:
+                self._started = True
+                self.socketio.start_background_task(self._run)
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+                self._oldest = None
+            if not rows:
+                return 0
+            return self._write(rows)
+
+    def _write(self, rows):
+        """Write a batch; when its rows are rejected, retry its halves so only the bad rows are lost"""
+        for attempt in range(self.retries + 1):
+            try:
+                self.flush_fn(rows)
+                return len(rows)
+            except OperationalError as e:
+                # Database down, locked or timing out: nothing wrong with the rows
+                if attempt == self.retries:
+                    logger.error(f'Writing {len(rows)} readings failed {attempt + 1} times, keeping them: {e}')
+                    self._requeue(rows)
+                    return 0
+                logger.warning(f'Writing {len(rows)} readings failed, retrying: {e}')
+                self.socketio.sleep(self.backoff * 2 ** attempt)
+            except (IntegrityError, DataError) as e:
+                if len(rows) == 1:
+                    logger.error(f'Dropping a reading of device {rows[0].get("device_id")}, write failed: {e}')
+                    return 0
+                logger.warning(f'Writing {len(rows)} readings failed, retrying in halves: {e}')
+                break
+        middle = len(rows) // 2
+        return self._write(rows[:middle]) + self._write(rows[middle:])
+
+    def _requeue(self, rows):
+        """Put rows that could not be written back in front of the pending ones"""
+        with self._lock:
+            self._rows[:0] = rows
+            self._oldest = time.monotonic()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.max_age / 2)
+            self._wakeup.clear()
+            oldest = self._oldest
+            if len(self._rows) >= self.max_rows or (
+                    oldest is not None and time.monotonic() - oldest >= self.max_age):
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception('Flushing readings failed')
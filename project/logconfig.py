@@ -0,0 +1,133 @@
+"""Logging setup: JSON records written by a background thread.
+
+Callers only format the record and put it on a queue; a QueueListener
+thread writes it to stderr or to a rotating file. High-frequency events are
+sampled before they are queued: log them with ``extra={'sample': 'connect'}``
+and only one record in N (per sample key) is kept, carrying ``sampled=N``.
+
+Configuration comes from the environment:
+
+* LOG_LEVEL            root level (INFO)
+* LOG_LEVELS           per logger on top of DEFAULT_LEVELS, e.g. ``poller=DEBUG``
+* LOG_FORMAT           ``json`` (default) or ``text``
+* LOG_FILE             file to write to instead of stderr
+* LOG_MAX_BYTES        rotate the file at this size (10 MB)
+* LOG_BACKUPS          rotated files to keep (5)
+* LOG_ROTATE_WHEN      rotate by time instead, e.g. ``midnight`` or ``H``
+* LOG_SAMPLE           one in N per sample key on top of DEFAULT_SAMPLE, e.g. ``connect=1``
+"""
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+DEFAULT_LEVELS = 'werkzeug=WARNING,engineio=WARNING,socketio=WARNING'
+DEFAULT_SAMPLE = 'connect=100,reading=1000'
+
+# Attributes every LogRecord has; anything else came in through ``extra``
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps one record in N for each ``sample`` key"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+        self._counters = {key: itertools.count() for key in rates}
+
+    def filter(self, record):
+        key = getattr(record, 'sample', None)
+        rate = self.rates.get(key)
+        if not rate or rate <= 1:
+            return True
+        if next(self._counters[key]) % rate:
+            return False
+        record.sampled = rate
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Queues the record without pre-formatting it into a string.
+
+    The stock handler formats in the caller's thread; here only the message
+    is merged so that the listener thread does the JSON encoding.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def parse_pairs(text):
+    pairs = {}
+    for item in (text or '').split(','):
+        name, _, value = item.partition('=')
+        if name.strip() and value.strip():
+            pairs[name.strip()] = value.strip()
+    return pairs
+
+
+def configure_logging(environ=os.environ):
+    """Route every logger through one queue; returns the listener"""
+    log_format = environ.get('LOG_FORMAT', 'json')
+    formatter = JsonFormatter() if log_format == 'json' else \
+        logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    filename = environ.get('LOG_FILE')
+    if not filename:
+        target = logging.StreamHandler(sys.stderr)
+    elif environ.get('LOG_ROTATE_WHEN'):
+        target = logging.handlers.TimedRotatingFileHandler(
+            filename, when=environ['LOG_ROTATE_WHEN'], backupCount=int(environ.get('LOG_BACKUPS', 5)))
+    else:
+        target = logging.handlers.RotatingFileHandler(
+            filename, maxBytes=int(environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024)),
+            backupCount=int(environ.get('LOG_BACKUPS', 5)))
+    target.setFormatter(formatter)
+
+    # queue.Queue rather than SimpleQueue: it cooperates once eventlet patches threading
+    handler = _QueueHandler(queue.Queue())
+    rates = dict(parse_pairs(DEFAULT_SAMPLE), **parse_pairs(environ.get('LOG_SAMPLE')))
+    rates = {key: int(value) for key, value in rates.items()}
+    handler.addFilter(SamplingFilter(rates))
+
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(environ.get('LOG_LEVEL', 'INFO').upper())
+    levels = dict(parse_pairs(DEFAULT_LEVELS), **parse_pairs(environ.get('LOG_LEVELS')))
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level.upper())
+
+    listener = logging.handlers.QueueListener(handler.queue, target, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,416 @@
+import json
+import logging
+import socket
+import socketserver
+import threading
+import time
+import uuid
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+from socketio import PubSubManager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BROKER_ADDRESS = ('127.0.0.1', 6380)
+
+
+def parse_local_url(url):
+    """'local://127.0.0.1:6380' -> ('127.0.0.1', 6380)"""
+    parts = urlsplit(url)
+    return (parts.hostname or DEFAULT_BROKER_ADDRESS[0],
+            parts.port or DEFAULT_BROKER_ADDRESS[1])
+
+
+# -------------------- Local broker --------------------
+
+class LocalBroker(socketserver.ThreadingTCPServer):
+    """Pub/sub and shared counters for several workers on one host.
+
+    A stand-in for Redis when running tests or a small deployment without
+    external services. The protocol is one JSON object per line. Counter
+    increments are remembered per connection and rolled back when that
+    connection closes, so a crashed worker does not leave stale counts.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=DEFAULT_BROKER_ADDRESS):
+        super().__init__(address, _BrokerHandler)
+        self.subscribers = defaultdict(set)  # channel -> handlers
+        self.hashes = defaultdict(lambda: defaultdict(int))
+        self.lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def publish(self, channel, data):
+        line = _encode({'data': data})
+        with self.lock:
+            subscribers = list(self.subscribers[channel])
+        for handler in subscribers:
+            if not handler.send(line):
+                with self.lock:
+                    self.subscribers[channel].discard(handler)
+        return len(subscribers)
+
+    def hincrby(self, key, field, delta):
+        with self.lock:
+            value = self.hashes[key][field] + delta
+            if value:
+                self.hashes[key][field] = value
+            else:
+                self.hashes[key].pop(field, None)
+            return value
+
+
+class _BrokerHandler(socketserver.StreamRequestHandler):
+
+    def setup(self):
+        super().setup()
+        self.send_lock = threading.Lock()
+        self.contributions = defaultdict(int)  # (key, field) -> delta added
+
+    def send(self, line):
+        try:
+            with self.send_lock:
+                self.wfile.write(line)
+                self.wfile.flush()
+            return True
+        except OSError:
+            return False
+
+    def handle(self):
+        broker = self.server
+        for line in self.rfile:
+            message = json.loads(line)
+            op = message['op']
+            if op == 'subscribe':
+                with broker.lock:
+                    broker.subscribers[message['channel']].add(self)
+                continue
+            if op == 'publish':
+                result = broker.publish(message['channel'], message['data'])
+            elif op == 'hincrby':
+                key, field, delta = message['key'], message['field'], message['delta']
+                self.contributions[(key, field)] += delta
+                result = broker.hincrby(key, field, delta)
+            elif op == 'hgetall':
+                with broker.lock:
+                    result = dict(broker.hashes.get(message['key'], {}))
+            else:
+                result = None
+            self.send(_encode({'result': result}))
+
+    def finish(self):
+        broker = self.server
+        with broker.lock:
+            for subscribers in broker.subscribers.values():
+                subscribers.discard(self)
+        for (key, field), delta in self.contributions.items():
+            if delta:
+                broker.hincrby(key, field, -delta)
+        super().finish()
+
+
+def _encode(message):
+    return (json.dumps(message, separators=(',', ':')) + '\n').encode()
+
+
+class BrokerClient:
+    """Request/response connection to a LocalBroker"""
+
+    def __init__(self, address=DEFAULT_BROKER_ADDRESS, timeout=5):
+        self.address = address
+        self.timeout = timeout
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _connect(self, timeout):
+        sock = socket.create_connection(self.address, timeout=self.timeout)
+        sock.settimeout(timeout)
+        return sock.makefile('rwb')
+
+    def call(self, op, **fields):
+        with self._lock:
+            for attempt in (1, 2):
+                try:
+                    if self._file is None:
+                        self._file = self._connect(self.timeout)
+                    self._file.write(_encode(dict(fields, op=op)))
+                    self._file.flush()
+                    line = self._file.readline()
+                    if not line:
+                        raise ConnectionError('broker closed the connection')
+                    return json.loads(line)['result']
+                except OSError:
+                    self._file = None
+                    if attempt == 2:
+                        raise
+
+    def subscribe(self, channel):
+        """Yield every message published on ``channel``, blocking"""
+        stream = self._connect(None)
+        stream.write(_encode({'op': 'subscribe', 'channel': channel}))
+        stream.flush()
+        for line in stream:
+            yield json.loads(line)['data']
+
+
+class LocalBrokerManager(PubSubManager):
+    """Socket.IO client manager that fans emits out through a LocalBroker"""
+
+    name = 'local'
+
+    def __init__(self, url='local://127.0.0.1:6380', channel='socketio',
+                 write_only=False, logger=None, json=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self.client = BrokerClient(parse_local_url(url))
+
+    def _publish(self, data):
+        return self.client.call('publish', channel=self.channel, data=self.json.dumps(data))
+
+    def _listen(self):
+        retry = 1
+        while True:
+            try:
+                yield from self.client.subscribe(self.channel)
+            except OSError as e:
+                self._get_logger().error(f'Cannot receive from local broker, retrying in {retry}s: {e}')
+                time.sleep(retry)
+                retry = min(retry * 2, 60)
+
+
+# -------------------- Application events --------------------
+
+class MemoryBus:
+    """Single process: there is nobody else to tell"""
+
+    def publish(self, channel, message):
+        pass
+
+    def subscribe(self, channel, callback):
+        pass
+
+
+class BrokerBus:
+    """Application events between workers through the local broker"""
+
+    def __init__(self, url):
+        self.url = url
+        self.client = BrokerClient(parse_local_url(url))
+
+    def publish(self, channel, message):
+        self.client.call('publish', channel=channel, data=json.dumps(message))
+
+    def subscribe(self, channel, callback):
+        def listen():
+            while True:
+                try:
+                    for data in BrokerClient(parse_local_url(self.url)).subscribe(channel):
+                        callback(json.loads(data))
+                except OSError as e:
+                    logger.error(f'Lost the local broker, resubscribing: {e}')
+                    time.sleep(1)
+        threading.Thread(target=listen, daemon=True).start()
+
+
+class RedisBus:
+    def __init__(self, url):
+        import redis
+        self.redis = redis.Redis.from_url(url)
+
+    def publish(self, channel, message):
+        self.redis.publish(channel, json.dumps(message))
+
+    def subscribe(self, channel, callback):
+        def listen():
+            while True:
+                try:
+                    pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                    pubsub.subscribe(channel)
+                    for message in pubsub.listen():
+                        callback(json.loads(message['data']))
+                except Exception as e:
+                    logger.error(f'Lost redis, resubscribing: {e}')
+                    time.sleep(1)
+        threading.Thread(target=listen, daemon=True).start()
+
+
+def bus_for(url):
+    """Event bus matching the Socket.IO message queue URL"""
+    if not url:
+        return MemoryBus()
+    if url.startswith('local://'):
+        return BrokerBus(url)
+    return RedisBus(url)
+
+
+# -------------------- Connection tracking --------------------
+
+class MemoryStore:
+    """Counters for a single process"""
+
+    def __init__(self):
+        self._hashes = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def hincrby(self, key, field, delta):
+        with self._lock:
+            value = self._hashes[key][field] + delta
+            if value:
+                self._hashes[key][field] = value
+            else:
+                self._hashes[key].pop(field, None)
+            return value
+
+    def hgetall(self, key):
+        with self._lock:
+            return dict(self._hashes.get(key, {}))
+
+
+class BrokerStore:
+    def __init__(self, url):
+        self.client = BrokerClient(parse_local_url(url))
+
+    def hincrby(self, key, field, delta):
+        return self.client.call('hincrby', key=key, field=field, delta=delta)
+
+    def hgetall(self, key):
+        return self.client.call('hgetall', key=key)
+
+
+class RedisStore:
+    """Counters in Redis, kept per worker so a dead worker's counts expire.
+
+    Each worker increments its own hash, ``<key>:<worker id>``, whose TTL a
+    heartbeat thread renews every ``ttl / 3`` seconds; reads sum the hashes
+    of the workers still alive and forget the expired ones. This is what
+    LocalBroker does by rolling back a closed connection's increments.
+    Summing costs a round trip per worker, so ``hincrby`` returns this
+    worker's own count and only ``hgetall`` computes totals.
+    """
+
+    def __init__(self, url, worker_id, ttl=30):
+        import redis
+        self.redis = redis.Redis.from_url(url)
+        self.worker_id = worker_id
+        self.ttl = ttl
+        self._keys = set()  # hashes of this worker to keep alive
+        self._lock = threading.Lock()
+
+    def _worker_key(self, key):
+        return f'{key}:{self.worker_id}'
+
+    def hincrby(self, key, field, delta):
+        own = self._worker_key(key)
+        with self._lock:
+            if not self._keys:
+                threading.Thread(target=self._heartbeat, daemon=True).start()
+            self._keys.add(key)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.sadd(f'{key}:workers', self.worker_id)
+        pipe.hincrby(own, field, delta)
+        pipe.pexpire(own, int(self.ttl * 1000))
+        _, value, _ = pipe.execute()
+        if value <= 0:
+            self.redis.hdel(own, field)
+        return max(value, 0)
+
+    def hgetall(self, key):
+        workers = [w.decode() for w in self.redis.smembers(f'{key}:workers')]
+        pipe = self.redis.pipeline(transaction=False)
+        for worker in workers:
+            pipe.exists(f'{key}:{worker}')
+            pipe.hgetall(f'{key}:{worker}')
+        replies = pipe.execute()
+        totals = defaultdict(int)
+        for worker, alive, counts in zip(workers, replies[::2], replies[1::2]):
+            if not alive:
+                self.redis.srem(f'{key}:workers', worker)  # crashed or idle: nothing to count
+                continue
+            for field, value in counts.items():
+                totals[field.decode()] += int(value)
+        return {field: value for field, value in totals.items() if value > 0}
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(self.ttl / 3)
+            with self._lock:
+                keys = list(self._keys)
+            try:
+                for key in keys:
+                    self.redis.pexpire(self._worker_key(key), int(self.ttl * 1000))
+            except Exception as e:
+                logger.warning(f'Cannot renew the connection counts in redis: {e}')
+
+
+def store_for(url, worker_id=None):
+    """Counter store matching the Socket.IO message queue URL"""
+    if not url:
+        return MemoryStore()
+    if url.startswith('local://'):
+        return BrokerStore(url)
+    if url.startswith(('redis://', 'rediss://')):
+        return RedisStore(url, worker_id or uuid.uuid4().hex)
+    raise ValueError(f'Unsupported message queue: {url}')
+
+
+class ConnectionStats:
+    """Connected clients and room sizes, shared by every worker.
+
+    Each worker remembers which rooms its own clients joined so that a
+    disconnect removes them from every room at once.
+    """
+
+    KEY = 'iot_dashboard:connections'
+    TOTAL = '*'
+
+    def __init__(self, store):
+        self.store = store
+        self._rooms = {}  # sid -> rooms joined through this worker
+        self._lock = threading.Lock()
+
+    def connect(self, sid):
+        """Count a client; returns the store's count after it (this worker's alone with redis)"""
+        with self._lock:
+            self._rooms[sid] = set()
+        return self.store.hincrby(self.KEY, self.TOTAL, 1)
+
+    def disconnect(self, sid):
+        with self._lock:
+            rooms = self._rooms.pop(sid, set())
+        for room in rooms:
+            self.store.hincrby(self.KEY, room, -1)
+        return self.store.hincrby(self.KEY, self.TOTAL, -1)
+
+    def join(self, sid, room):
+        with self._lock:
+            rooms = self._rooms.setdefault(sid, set())
+            if room in rooms:
+                return
+            rooms.add(room)
+        self.store.hincrby(self.KEY, room, 1)
+
+    def leave(self, sid, room):
+        with self._lock:
+            rooms = self._rooms.get(sid)
+            if rooms is None or room not in rooms:
+                return
+            rooms.discard(room)
+        self.store.hincrby(self.KEY, room, -1)
+
+    def rooms(self, sid):
+        """Rooms a client of this worker joined"""
+        with self._lock:
+            return set(self._rooms.get(sid, ()))
+
+    def connected(self):
+        return self.store.hgetall(self.KEY).get(self.TOTAL, 0)
+
+    def room_sizes(self):
+        sizes = self.store.hgetall(self.KEY)
+        sizes.pop(self.TOTAL, None)
+        return sizes
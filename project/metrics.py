@@ -0,0 +1,199 @@
+"""Counters, gauges and histograms rendered in the Prometheus text format.
+
+Updates take no lock. In threading mode every thread writes to its own
+shard (a plain dict reached through a thread-local), and the shard of a
+finished thread is folded into a base total when the thread goes away.
+Green threads are never preempted between two bytecodes, so the green-thread
+modes share a single shard. A scrape sums the shards; gauges and custom
+collectors are computed only then.
+"""
+import functools
+import math
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from collections import defaultdict
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Owner:
+    """Lives in a thread-local; its finalizer folds the thread's shard"""
+
+
+class Registry:
+    def __init__(self, green=False):
+        self._metrics = []
+        self._base = defaultdict(float)  # totals of finished threads
+        self._shards = {}  # id -> shard of a running thread
+        self._lock = threading.RLock()  # scrapes, new threads and thread exits only
+        self._shared = defaultdict(float) if green else None
+        self._local = threading.local()
+
+    # -------------------- Metric factories --------------------
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(self, name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(self, name, help, labels, buckets))
+
+    def gauge(self, name, help, labels=(), collect=None):
+        """``collect()`` returns {label values tuple: value}, called at scrape time"""
+        return self._add(Gauge(name, help, labels, collect))
+
+    def custom(self, name, kind, help, collect):
+        """``collect()`` returns [(sample suffix, {label: value}, value)] at scrape time"""
+        return self._add(Custom(name, kind, help, collect))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    # -------------------- Shards --------------------
+
+    def shard(self):
+        if self._shared is not None:
+            return self._shared
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = defaultdict(float)
+            owner = self._local.owner = _Owner()
+            self._local.shard = shard
+            with self._lock:
+                self._shards[id(owner)] = shard
+            weakref.finalize(owner, self._fold, id(owner))
+            return shard
+
+    def _fold(self, key):
+        with self._lock:
+            shard = self._shards.pop(key, None)
+            for sample, value in (shard or {}).items():
+                self._base[sample] += value
+
+    def totals(self):
+        with self._lock:
+            totals = defaultdict(float, self._base)
+            shards = [self._shared] if self._shared is not None else list(self._shards.values())
+            for shard in shards:
+                for sample, value in shard.copy().items():  # copy() is atomic under the GIL
+                    totals[sample] += value
+        return totals
+
+    # -------------------- Exposition --------------------
+
+    def render(self):
+        totals = self.totals()
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples(totals))
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, registry, name, help, labels):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+
+    def inc(self, *labels, amount=1):
+        self.registry.shard()[(self, labels)] += amount
+
+    def samples(self, totals):
+        series = {key[1]: value for key, value in totals.items() if key[0] is self}
+        for labels in sorted(series, key=str):
+            yield f'{self.name}{_labels(self.labels, labels)} {_number(series[labels])}'
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help, labels, buckets):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, *labels):
+        shard = self.registry.shard()
+        shard[(self, labels, bisect_left(self.buckets, value))] += 1
+        shard[(self, labels, 'sum')] += value
+
+    def timed(self, *labels):
+        """Decorator observing the duration of every call"""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - started, *labels)
+            return wrapper
+        return decorator
+
+    def samples(self, totals):
+        series = defaultdict(lambda: [0.0] * len(self.buckets) + [0.0])  # bucket counts + sum
+        for key, value in totals.items():
+            if key[0] is self:
+                index = len(self.buckets) if key[2] == 'sum' else key[2]
+                series[key[1]][index] += value
+        for labels in sorted(series, key=str):
+            counts = series[labels]
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f'{self.name}_bucket{_labels(self.labels, labels, ("le", _number(bound)))} {int(cumulative)}'
+            yield f'{self.name}_sum{_labels(self.labels, labels)} {_number(counts[-1])}'
+            yield f'{self.name}_count{_labels(self.labels, labels)} {int(cumulative)}'
+
+
+class Gauge:
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels, collect):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.collect = collect
+
+    def samples(self, totals):
+        for labels, value in sorted(self.collect().items(), key=str):
+            labels = labels if isinstance(labels, tuple) else (labels,) if self.labels else ()
+            yield f'{self.name}{_labels(self.labels, labels)} {_number(value)}'
+
+
+class Custom:
+    def __init__(self, name, kind, help, collect):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.collect = collect
+
+    def samples(self, totals):
+        for suffix, labels, value in self.collect():
+            yield f'{self.name}{suffix}{_labels(labels.keys(), labels.values())} {_number(value)}'
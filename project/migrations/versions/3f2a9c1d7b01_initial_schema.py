@@ -0,0 +1,59 @@
+"""initial schema: users and devices
+
+Revision ID: 3f2a9c1d7b01
+Revises: 
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9c1d7b01'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases created by db.create_all() before migrations existed may
+    # already have these tables, possibly without the theme column
+    inspector = sa.inspect(op.get_bind())
+    tables = inspector.get_table_names()
+
+    if 'user' not in tables:
+        op.create_table(
+            'user',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('username', sa.String(length=80), nullable=False),
+            sa.Column('email', sa.String(length=120), nullable=False),
+            sa.Column('password', sa.String(length=120), nullable=False),
+            sa.Column('theme', sa.String(length=20), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('email'),
+            sa.UniqueConstraint('username')
+        )
+    elif 'theme' not in {c['name'] for c in inspector.get_columns('user')}:
+        with op.batch_alter_table('user') as batch_op:
+            batch_op.add_column(sa.Column('theme', sa.String(length=20), nullable=True))
+
+    if 'device' not in tables:
+        op.create_table(
+            'device',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('user_email', sa.String(length=120), nullable=False),
+            sa.Column('device_name', sa.String(length=80), nullable=False),
+            sa.Column('device_type', sa.String(length=80), nullable=False),
+            sa.Column('light_level', sa.Integer(), nullable=True),
+            sa.Column('humidity_level', sa.Integer(), nullable=True),
+            sa.Column('temperature', sa.Integer(), nullable=True),
+            sa.Column('smoke_level', sa.Integer(), nullable=True),
+            sa.ForeignKeyConstraint(['user_email'], ['user.email'], ),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+
+def downgrade():
+    op.drop_table('device')
+    op.drop_table('user')
@@ -0,0 +1,69 @@
+"""telemetry tables, device host and device owner index
+
+Revision ID: 8c4e5a2b9d13
+Revises: 3f2a9c1d7b01
+Create Date: 2026-10-18 10:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4e5a2b9d13'
+down_revision = '3f2a9c1d7b01'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Skip whatever db.create_all() already created
+    inspector = sa.inspect(op.get_bind())
+    tables = inspector.get_table_names()
+
+    columns = {c['name'] for c in inspector.get_columns('device')}
+    with op.batch_alter_table('device') as batch_op:
+        if 'host' not in columns:
+            batch_op.add_column(sa.Column('host', sa.String(length=255), nullable=True))
+        if 'user_email' in columns and \
+                'ix_device_user_email' not in {i['name'] for i in inspector.get_indexes('device')}:
+            batch_op.create_index('ix_device_user_email', ['user_email'], unique=False)
+
+    if 'reading' not in tables:
+        op.create_table(
+            'reading',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('device_id', sa.Integer(), nullable=False),
+            sa.Column('ts', sa.Float(), nullable=False),
+            sa.Column('temperature', sa.Float(), nullable=True),
+            sa.Column('humidity', sa.Float(), nullable=True),
+            sa.Column('light', sa.Float(), nullable=True),
+            sa.Column('smoke', sa.Float(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_reading_device_ts', 'reading', ['device_id', 'ts'], unique=False)
+
+    if 'rollup' not in tables:
+        op.create_table(
+            'rollup',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('device_id', sa.Integer(), nullable=False),
+            sa.Column('metric', sa.String(length=16), nullable=False),
+            sa.Column('resolution', sa.Integer(), nullable=False),
+            sa.Column('bucket', sa.Integer(), nullable=False),
+            sa.Column('min', sa.Float(), nullable=False),
+            sa.Column('max', sa.Float(), nullable=False),
+            sa.Column('sum', sa.Float(), nullable=False),
+            sa.Column('count', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('device_id', 'metric', 'resolution', 'bucket', name='uq_rollup_bucket')
+        )
+
+
+def downgrade():
+    op.drop_table('rollup')
+    op.drop_index('ix_reading_device_ts', table_name='reading')
+    op.drop_table('reading')
+    with op.batch_alter_table('device') as batch_op:
+        batch_op.drop_index('ix_device_user_email')
+        batch_op.drop_column('host')
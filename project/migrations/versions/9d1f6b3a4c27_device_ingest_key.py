@@ -0,0 +1,32 @@
+"""device ingest key, required to push readings
+
+Revision ID: 9d1f6b3a4c27
+Revises: 5b9e3a7c1d24
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d1f6b3a4c27'
+down_revision = '5b9e3a7c1d24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    columns = {c['name'] for c in sa.inspect(op.get_bind()).get_columns('device')}
+    if 'ingest_key_hash' in columns:
+        return  # created by db.create_all() with the new schema
+
+    # Existing devices get no key: their owner issues one from the dashboard
+    # (POST /devices/<id>/ingest_key) and flashes it onto the board
+    with op.batch_alter_table('device') as batch_op:
+        batch_op.add_column(sa.Column('ingest_key_hash', sa.String(length=64), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('device') as batch_op:
+        batch_op.drop_column('ingest_key_hash')
@@ -0,0 +1,60 @@
+"""device owner by integer user id instead of email
+
+Revision ID: c71d0e4f2a58
+Revises: 8c4e5a2b9d13
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c71d0e4f2a58'
+down_revision = '8c4e5a2b9d13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    columns = {c['name'] for c in sa.inspect(op.get_bind()).get_columns('device')}
+    if 'user_email' not in columns:
+        return  # created by db.create_all() with the new schema
+
+    # Devices whose owner changed their email match no user; refuse to
+    # guess, before anything is altered, so the upgrade can be rerun
+    orphans = op.get_bind().execute(sa.text(
+        'SELECT user_email, COUNT(*) FROM device WHERE user_email NOT IN (SELECT email FROM "user") '
+        'GROUP BY user_email ORDER BY user_email')).all()
+    if orphans:
+        raise RuntimeError(
+            f'{sum(count for _, count in orphans)} devices belong to emails no user has: '
+            f'{", ".join(email for email, _ in orphans)}. Point device.user_email at an existing '
+            'user (or delete those devices) and run the upgrade again.')
+
+    with op.batch_alter_table('device') as batch_op:
+        batch_op.add_column(sa.Column('user_id', sa.Integer(), nullable=True))
+    op.execute('UPDATE device SET user_id = '
+               '(SELECT "user".id FROM "user" WHERE "user".email = device.user_email)')
+
+    with op.batch_alter_table('device') as batch_op:
+        batch_op.alter_column('user_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_index('ix_device_user_id', ['user_id'], unique=False)
+        batch_op.create_foreign_key('fk_device_user_id', 'user', ['user_id'], ['id'])
+        batch_op.drop_index('ix_device_user_email')
+        batch_op.drop_column('user_email')
+
+
+def downgrade():
+    with op.batch_alter_table('device') as batch_op:
+        batch_op.add_column(sa.Column('user_email', sa.String(length=120), nullable=True))
+    op.execute('UPDATE device SET user_email = '
+               '(SELECT "user".email FROM "user" WHERE "user".id = device.user_id)')
+
+    with op.batch_alter_table('device') as batch_op:
+        batch_op.alter_column('user_email', existing_type=sa.String(length=120), nullable=False)
+        batch_op.create_index('ix_device_user_email', ['user_email'], unique=False)
+        batch_op.create_foreign_key('fk_device_user_email', 'user', ['user_email'], ['email'])
+        batch_op.drop_constraint('fk_device_user_id', type_='foreignkey')
+        batch_op.drop_index('ix_device_user_id')
+        batch_op.drop_column('user_id')
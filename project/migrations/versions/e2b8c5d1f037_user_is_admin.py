@@ -0,0 +1,41 @@
+"""user.is_admin flag instead of admin usernames
+
+Revision ID: e2b8c5d1f037
+Revises: 9d1f6b3a4c27
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+import os
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b8c5d1f037'
+down_revision = '9d1f6b3a4c27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    columns = {c['name'] for c in sa.inspect(op.get_bind()).get_columns('user')}
+    if 'is_admin' in columns:
+        return  # created by db.create_all() with the new schema
+
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.add_column(sa.Column('is_admin', sa.Boolean(), nullable=False, server_default=sa.false()))
+
+    # Admins used to be whoever held a name in ADMIN_USERS; those accounts
+    # keep their rights, later renames no longer grant any
+    names = [n for n in os.environ.get('ADMIN_USERS', 'admin').split(',') if n]
+    user = sa.table('user', sa.column('username', sa.String), sa.column('is_admin', sa.Boolean))
+    granted = op.get_bind().execute(
+        sa.select(user.c.username).where(user.c.username.in_(names))).scalars().all()
+    op.execute(user.update().where(user.c.username.in_(names)).values(is_admin=True))
+    print(f'Admin rights granted to: {", ".join(granted) or "nobody"}')
+
+
+def downgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('is_admin')
@@ -0,0 +1,64 @@
+"""Run several dashboard workers on one host, sharing state through the local broker.
+
+Starts the in-repo message broker and N copies of app.py on consecutive
+ports. Put a load balancer with sticky sessions in front of them, e.g. nginx:
+
+    upstream dashboard { ip_hash; server 127.0.0.1:5001; server 127.0.0.1:5002; }
+
+Usage: python misc/run_workers.py --workers 4 --base-port 5001
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+from messaging import LocalBroker  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run N dashboard workers behind the local broker')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--base-port', type=int, default=5001)
+    parser.add_argument('--broker-port', type=int, default=6380)
+    parser.add_argument('--origins', default=None,
+                        help='comma separated CORS origins, defaults to the load balancer on :5000')
+    args = parser.parse_args()
+
+    # Stop the workers on SIGTERM too, not only on Ctrl+C
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    broker = LocalBroker(('127.0.0.1', args.broker_port)).start()
+    print(f'Local broker listening on 127.0.0.1:{args.broker_port}')
+
+    # Schema and admin user once, before any worker serves a request
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app.py', 'init-db'], cwd=PROJECT_DIR, check=True)
+
+    workers = []
+    for i in range(args.workers):
+        env = dict(os.environ,
+                   PORT=str(args.base_port + i),
+                   SOCKETIO_MESSAGE_QUEUE=f'local://127.0.0.1:{args.broker_port}',
+                   BACKGROUND_JOBS='1' if i == 0 else '0',
+                   FLASK_DEBUG='0')
+        if args.origins:
+            env['CORS_ALLOWED_ORIGINS'] = args.origins
+        workers.append(subprocess.Popen([sys.executable, 'app.py'], cwd=PROJECT_DIR, env=env))
+        print(f'Worker {i} on port {args.base_port + i}')
+
+    try:
+        while all(w.poll() is None for w in workers):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for w in workers:
+            w.terminate()
+        broker.shutdown()
+
+
+if __name__ == '__main__':
+    main()
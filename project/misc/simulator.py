@@ -0,0 +1,426 @@
+"""Fleet of virtual ESP32 boards for load tests without hardware.
+
+Every virtual device listens on its own port and serves the same HTTP
+contract as esp/combined.ino (GET /data, POST /buzzer, POST
+/buzzer/deactivate). It also pushes readings to the ingestion endpoint, as
+the firmware does. Everything runs on one asyncio loop, so a laptop can
+simulate thousands of boards.
+
+Sensor values follow a mean-reverting random walk with slow drift and
+measurement noise. Light follows a day/night cycle, and CO has occasional
+spikes. Latency, hung requests (client timeouts) and dropouts (the board
+goes offline for a while) can be injected. Before pushing, every board
+gets a fresh ingest key from the dashboard, logged in as ``--user``.
+
+    python misc/simulator.py --devices 2000 --rate 0.2 --register http://127.0.0.1:5000
+    python misc/simulator.py --devices 50 --first-id 1 --push-url http://127.0.0.1:5000/api/readings \\
+        --latency 0.05 --timeout-rate 0.01 --dropout-rate 0.001
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import statistics
+import sys
+import time
+from urllib.parse import urlsplit
+
+# (mean, reversion per second, volatility, noise, low, high) per metric
+MODELS = {
+    'temperature': (24.0, 0.01, 0.15, 0.1, -40.0, 80.0),
+    'humidity': (50.0, 0.01, 0.4, 0.5, 0.0, 100.0),
+    'light': (50.0, 0.05, 1.0, 1.0, 0.0, 100.0),
+    'co': (2.0, 0.05, 0.05, 0.05, 0.0, 1000.0),
+}
+DAY_SECONDS = 86400
+START = time.monotonic()  # drift is measured from here
+
+
+class Offline(Exception):
+    """The board is in a dropout and does not answer"""
+
+
+class VirtualDevice:
+    """Sensor state and fault behaviour of one simulated board"""
+
+    def __init__(self, index, port, options, rng):
+        self.index = index
+        self.port = port
+        self.device_id = None  # id on the dashboard, known once registered
+        self.ingest_key = None  # sent with every push, see issue_keys()
+        self.options = options
+        self.rng = rng
+        self.buzzer = False
+        self.offline_until = 0.0
+        # Every board sits in a slightly different room
+        self.means = {metric: model[0] * rng.uniform(0.85, 1.15) for metric, model in MODELS.items()}
+        self.drift = {metric: rng.gauss(0, options.drift) for metric in MODELS}
+        self.state = dict(self.means)
+        self.phase = rng.uniform(0, DAY_SECONDS)
+        self.updated = time.monotonic()
+
+    @property
+    def offline(self):
+        return time.monotonic() < self.offline_until
+
+    def step(self):
+        """Advance the random walk to now"""
+        now = time.monotonic()
+        dt = now - self.updated
+        self.updated = now
+        if dt <= 0:
+            return
+        if not self.offline and self.rng.random() < 1 - math.exp(-self.options.dropout_rate * dt):
+            self.offline_until = now + self.rng.expovariate(1 / self.options.dropout_seconds)
+        for metric, (_, reversion, volatility, _, low, high) in MODELS.items():
+            target = self.means[metric] + self.drift[metric] * (now - START)
+            if metric == 'light':
+                day = (time.time() * self.options.time_scale + self.phase) % DAY_SECONDS
+                target = 50 + 45 * math.sin(2 * math.pi * day / DAY_SECONDS)
+            elif metric == 'co' and self.rng.random() < self.options.spike_rate * dt:
+                self.state[metric] += self.rng.uniform(10, 60)
+            value = self.state[metric]
+            value += reversion * (target - value) * dt + volatility * math.sqrt(dt) * self.rng.gauss(0, 1)
+            self.state[metric] = min(high, max(low, value))
+
+    def sample(self):
+        """Reading in the firmware's /data format, with measurement noise"""
+        self.step()
+        noisy = {metric: self.state[metric] + self.rng.gauss(0, MODELS[metric][3]) for metric in MODELS}
+        return {
+            'temperature': round(noisy['temperature'], 1),
+            'humidity': round(min(100, max(0, noisy['humidity'])), 1),
+            'lightLevel': int(min(100, max(0, noisy['light']))),
+            'coLevel': round(max(0, noisy['co']), 2),
+            'isValid': True,
+        }
+
+    async def respond(self, method, path):
+        """(status, body) for one request, after the injected faults"""
+        self.step()
+        if self.offline:
+            raise Offline()
+        options = self.options
+        if options.timeout_rate and self.rng.random() < options.timeout_rate:
+            await asyncio.sleep(options.hang)
+            raise Offline()
+        if options.latency:
+            await asyncio.sleep(max(0.0, self.rng.gauss(options.latency, options.latency * options.jitter)))
+
+        if method == 'GET' and path == '/data':
+            return 200, self.sample()
+        if method == 'POST' and path == '/buzzer':
+            self.buzzer = True
+            return 200, {'status': 'Buzzer Activated'}
+        if method == 'POST' and path == '/buzzer/deactivate':
+            self.buzzer = False
+            return 200, {'status': 'Buzzer Deactivated'}
+        if method == 'GET' and path == '/':
+            return 200, {'device': self.index, 'buzzer': self.buzzer}
+        return 404, {'error': 'Not found'}
+
+
+class Stats:
+    def __init__(self):
+        self.served = 0
+        self.dropped = 0
+        self.pushed = 0
+        self.push_errors = 0
+        self.push_latencies = []
+
+    def window(self):
+        """Counters since the previous call"""
+        snapshot = dict(vars(self))
+        self.__init__()
+        return snapshot
+
+
+# -------------------- Device HTTP servers --------------------
+
+async def read_request(reader):
+    """(method, path) of one HTTP/1.1 request, or None at end of stream"""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode('latin-1').split(' ', 2)
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    if length:
+        await reader.readexactly(length)
+    return method, path.split('?', 1)[0]
+
+
+def encode_response(status, body):
+    payload = json.dumps(body).encode()
+    reason = {200: 'OK', 404: 'Not Found'}.get(status, 'OK')
+    head = (f'HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n'
+            f'Content-Length: {len(payload)}\r\nConnection: keep-alive\r\n\r\n')
+    return head.encode() + payload
+
+
+def serve(device, stats):
+    async def handle(reader, writer):
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                try:
+                    status, body = await device.respond(*request)
+                except Offline:
+                    stats.dropped += 1
+                    break
+                writer.write(encode_response(status, body))
+                await writer.drain()
+                stats.served += 1
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+    return handle
+
+
+# -------------------- Pushing to the dashboard --------------------
+
+class PushClient:
+    """Keep-alive HTTP/1.1 connection POSTing JSON to one URL"""
+
+    def __init__(self, url, timeout):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.path = parts.path or '/'
+        self.timeout = timeout
+        self.reader = self.writer = None
+
+    async def post(self, body, headers=None):
+        payload = json.dumps(body).encode()
+        extra = ''.join(f'{name}: {value}\r\n' for name, value in (headers or {}).items())
+        request = (f'POST {self.path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n{extra}'
+                   f'Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n').encode()
+        for attempt in (1, 2):
+            try:
+                if self.writer is None:
+                    self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+                self.writer.write(request + payload)
+                await self.writer.drain()
+                return await asyncio.wait_for(self._read_response(), self.timeout)
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                self.close()
+                if attempt == 2:
+                    raise
+
+    async def _read_response(self):
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionResetError('server closed the connection')
+        version, status = status_line.decode('latin-1').split(' ', 2)[:2]
+        length, keep_alive = 0, version == 'HTTP/1.1'
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            name, value = name.strip().lower(), value.strip().lower()
+            if name == 'content-length':
+                length = int(value)
+            elif name == 'connection':
+                keep_alive = value == 'keep-alive'
+        if length:
+            await self.reader.readexactly(length)
+        if not keep_alive:
+            self.close()
+        return int(status)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def push_worker(queue, client, stats):
+    while True:
+        device, reading = await queue.get()
+        started = time.perf_counter()
+        try:
+            status = await client.post(dict(reading, device_id=device.device_id, timestamp=time.time()),
+                                       {'X-Device-Key': device.ingest_key})
+            ok = status < 400
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            ok = False
+        if ok:
+            stats.pushed += 1
+            stats.push_latencies.append(time.perf_counter() - started)
+        else:
+            stats.push_errors += 1
+        queue.task_done()
+
+
+async def push_loop(device, queue, rate, rng):
+    """Push one reading every 1/rate seconds (with jitter) while online"""
+    await asyncio.sleep(rng.uniform(0, 1 / rate))  # spread the fleet over the period
+    while True:
+        if not device.offline and device.ingest_key is not None:
+            queue.put_nowait((device, device.sample()))
+        await asyncio.sleep(rng.uniform(0.8, 1.2) / rate)
+
+
+# -------------------- Registration --------------------
+
+def register(devices, base_url, username, password, host):
+    """Add each virtual device to the dashboard (or reuse it) and learn its id"""
+    import requests
+
+    session = requests.Session()
+    session.post(f'{base_url}/login', data={'login_id': username, 'password': password}, allow_redirects=False)
+    known = session.get(f'{base_url}/get_devices').json()
+    if not known.get('success'):
+        raise SystemExit(f'Cannot list devices as {username}: {known.get("message")}')
+    by_name = {d['name']: d['id'] for d in known['devices']}
+    for device in devices:
+        name = f'sim-{device.port}'
+        if name not in by_name:
+            session.post(f'{base_url}/add_device', data={
+                'device_name': name, 'device_type': 'simulated', 'device_host': f'{host}:{device.port}'})
+    by_name = {d['name']: d['id'] for d in session.get(f'{base_url}/get_devices').json()['devices']}
+    for device in devices:
+        device.device_id = by_name.get(f'sim-{device.port}')
+
+
+def issue_keys(devices, base_url, username, password):
+    """Get a new ingest key for every board with an id; earlier keys stop working"""
+    import requests
+
+    session = requests.Session()
+    session.post(f'{base_url}/login', data={'login_id': username, 'password': password}, allow_redirects=False)
+    for device in devices:
+        if device.device_id is not None:
+            answer = session.post(f'{base_url}/devices/{device.device_id}/ingest_key').json()
+            if not answer.get('success'):
+                raise SystemExit(f'No ingest key for device {device.device_id}: {answer.get("message")}')
+            device.ingest_key = answer['ingest_key']
+
+
+def raise_file_limit():
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+def report(stats, devices, elapsed, as_json=False):
+    window = stats.window()
+    latencies = sorted(window['push_latencies'])
+    line = {
+        'pushed_per_s': round(window['pushed'] / elapsed, 1),
+        'push_errors': window['push_errors'],
+        'push_p50_ms': round(latencies[len(latencies) // 2] * 1000, 2) if latencies else None,
+        'push_p95_ms': round(latencies[int(len(latencies) * 0.95)] * 1000, 2) if latencies else None,
+        'push_mean_ms': round(statistics.fmean(latencies) * 1000, 2) if latencies else None,
+        'served_per_s': round(window['served'] / elapsed, 1),
+        'dropped': window['dropped'],
+        'offline': sum(device.offline for device in devices),
+    }
+    if as_json:
+        print(json.dumps(line), flush=True)
+    else:
+        print(f"pushed {line['pushed_per_s']:>8}/s  errors {line['push_errors']:>5}  "
+              f"p50 {line['push_p50_ms']} ms  p95 {line['push_p95_ms']} ms  "
+              f"served {line['served_per_s']:>8}/s  dropped {line['dropped']:>4}  "
+              f"offline {line['offline']}/{len(devices)}", flush=True)
+
+
+async def main(options):
+    rng = random.Random(options.seed)
+    stats = Stats()
+    devices = [VirtualDevice(i, options.base_port + i, options, random.Random(rng.random()))
+               for i in range(options.devices)]
+
+    servers = []
+    for device in devices:
+        servers.append(await asyncio.start_server(serve(device, stats), options.host, device.port))
+
+    if options.register:
+        await asyncio.to_thread(register, devices, options.register.rstrip('/'),
+                                options.user, options.password, options.advertise or options.host)
+        push_url = options.push_url or options.register.rstrip('/') + '/api/readings'
+    else:
+        for device in devices:
+            device.device_id = options.first_id + device.index if options.first_id is not None else None
+        push_url = options.push_url
+
+    if push_url and options.rate > 0:
+        parts = urlsplit(push_url)
+        await asyncio.to_thread(issue_keys, devices, f'{parts.scheme}://{parts.netloc}',
+                                options.user, options.password)
+
+    tasks = []
+    if push_url and options.rate > 0:
+        queue = asyncio.Queue()
+        tasks += [asyncio.create_task(push_worker(queue, PushClient(push_url, options.push_timeout), stats))
+                  for _ in range(options.push_connections)]
+        tasks += [asyncio.create_task(push_loop(device, queue, options.rate, device.rng)) for device in devices]
+
+    print(f'{len(devices)} virtual devices on {options.host}:{options.base_port}-{options.base_port + len(devices) - 1}'
+          + (f', pushing {options.rate}/s each to {push_url}' if tasks else ''), flush=True)
+    deadline = time.monotonic() + options.duration if options.duration else None
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            started = time.monotonic()
+            await asyncio.sleep(options.report if deadline is None
+                                else max(0.0, min(options.report, deadline - time.monotonic())))
+            report(stats, devices, time.monotonic() - started, options.json)
+    finally:
+        for task in tasks:
+            task.cancel()
+        for server in servers:
+            server.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--devices', type=int, default=100)
+    parser.add_argument('--host', default='127.0.0.1', help='address the virtual boards listen on')
+    parser.add_argument('--advertise', help='address registered on the dashboard, defaults to --host')
+    parser.add_argument('--base-port', type=int, default=7000, help='port of the first board, one port per board')
+    parser.add_argument('--rate', type=float, default=0.2, help='readings pushed per second per board (0 disables)')
+    parser.add_argument('--push-url', help='ingestion endpoint, e.g. http://127.0.0.1:5000/api/readings')
+    parser.add_argument('--push-connections', type=int, default=32)
+    parser.add_argument('--push-timeout', type=float, default=10)
+    parser.add_argument('--register', metavar='DASHBOARD_URL',
+                        help='add the boards to this dashboard (as --user) and push to it')
+    parser.add_argument('--user', default='admin', help='owner of the boards, issues their ingest keys')
+    parser.add_argument('--password', default='12345')
+    parser.add_argument('--first-id', type=int, help='dashboard id of the first board when not registering')
+    parser.add_argument('--latency', type=float, default=0.0, help='mean seconds added to every request')
+    parser.add_argument('--jitter', type=float, default=0.3, help='latency standard deviation, relative to --latency')
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='share of requests that hang')
+    parser.add_argument('--hang', type=float, default=30.0, help='seconds a hung request stays open')
+    parser.add_argument('--dropout-rate', type=float, default=0.0, help='dropouts per board per second')
+    parser.add_argument('--dropout-seconds', type=float, default=30.0, help='mean length of a dropout')
+    parser.add_argument('--drift', type=float, default=0.0005, help='std dev of the per-board drift per second')
+    parser.add_argument('--spike-rate', type=float, default=0.001, help='CO spikes per board per second')
+    parser.add_argument('--time-scale', type=float, default=1.0, help='speed of the day/night light cycle')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--duration', type=float, default=0, help='seconds to run, 0 runs until interrupted')
+    parser.add_argument('--report', type=float, default=5, help='seconds between two stats lines')
+    parser.add_argument('--json', action='store_true', help='print stats lines as JSON')
+    options = parser.parse_args()
+
+    if sys.platform != 'win32':
+        raise_file_limit()
+    if options.rate > 0 and not (options.register or options.push_url):
+        print('No --register or --push-url given, serving /data only', file=sys.stderr)
+    try:
+        asyncio.run(main(options))
+    except KeyboardInterrupt:
+        pass
@@ -1,13 +1,25 @@
-from flask import Flask
+from flask import Flask, jsonify
 from flask_socketio import SocketIO, emit
+import argparse
+import os
 import random
+import sys
 import time
 import threading
 
+# Reuse the dashboard's frame format (one delta-encoded frame per tick)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from broadcast import FrameBatcher
+
 # Initialize Flask app and SocketIO
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'secret!'
 socketio = SocketIO(app, cors_allowed_origins="http://127.0.0.1:5000")
+frame_batcher = FrameBatcher(socketio, tick=3, keyframe_every=10)
+
+SIMULATED_DEVICE = 'sim'
+ESP32_LATENCY = 0.0  # seconds added to every ESP32 endpoint, see --latency
+buzzer_active = False
 
 # Background thread to simulate sensor data updates
 def generate_sensor_data():
@@ -19,14 +31,15 @@ def generate_sensor_data():
             'temperature': random.randint(-50, 50),
             'smoke': random.randint(0, 100)
         }
-        # Emit data to all connected clients
-        socketio.emit('sensor_data', sensor_data)
+        # Queue for the next frame to all connected clients
+        frame_batcher.publish(SIMULATED_DEVICE, sensor_data)
         time.sleep(3)  # Adjust interval as needed
 
 # WebSocket route for client connections
 @socketio.on('connect')
 def handle_connect():
     print("Client connected")
+    emit('sensor_frame', frame_batcher.snapshot())
 
 @socketio.on('disconnect')
 def handle_disconnect():
@@ -43,8 +56,44 @@ def handle_message(data):
 def index():
     return "WebSocket server is running!"
 
+# Same HTTP contract as esp/combined.ino, so the dashboard can use this
+# server as a fake board (device address 127.0.0.1:5001)
+@app.route('/data')
+def esp32_data():
+    time.sleep(ESP32_LATENCY)
+    return jsonify({
+        'temperature': round(random.uniform(20, 30), 1),
+        'humidity': round(random.uniform(30, 70), 1),
+        'lightLevel': random.randint(0, 100),
+        'coLevel': random.randint(0, 50),
+        'isValid': True
+    })
+
+@app.route('/buzzer', methods=['POST'])
+def esp32_buzzer():
+    global buzzer_active
+    time.sleep(ESP32_LATENCY)
+    buzzer_active = True
+    return jsonify({'status': 'Buzzer Activated'})
+
+@app.route('/buzzer/deactivate', methods=['POST'])
+def esp32_buzzer_deactivate():
+    global buzzer_active
+    time.sleep(ESP32_LATENCY)
+    buzzer_active = False
+    return jsonify({'status': 'Buzzer Deactivated'})
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fake ESP32 and sensor data WebSocket server')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every ESP32 endpoint')
+    parser.add_argument('--no-debug', action='store_true')
+    args = parser.parse_args()
+    ESP32_LATENCY = args.latency
+
     # Start the background thread for sensor data generation
     threading.Thread(target=generate_sensor_data, daemon=True).start()
     # Run the server
-    socketio.run(app, host='0.0.0.0', port=5001, debug=True)
+    socketio.run(app, host='0.0.0.0', port=args.port, debug=not args.no_debug,
+                 allow_unsafe_werkzeug=True)
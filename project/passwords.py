@@ -0,0 +1,107 @@
+import math
+import threading
+import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Upper bounds, in seconds, of the hash latency histogram
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, math.inf)
+
+
+class Saturated(Exception):
+    """Too many hashes queued; retry after ``retry_after`` seconds"""
+
+    def __init__(self, retry_after):
+        super().__init__(f'Password hashing is saturated, retry in {retry_after}s')
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    """Runs password hashing off the request path with admission control.
+
+    At most ``workers`` hashes run at once, on real OS threads even in the
+    green-thread modes (scrypt and PBKDF2 release the GIL), so a login storm
+    cannot stall WebSocket and device I/O. Up to ``max_pending`` more callers
+    wait for a slot; beyond that ``Saturated`` is raised at once.
+
+    ``method`` is any werkzeug method string, e.g. 'scrypt:32768:8:1' or
+    'pbkdf2:sha256:600000'. Stored hashes made with other parameters are
+    reported by ``verify`` so the caller can re-hash them.
+    """
+
+    def __init__(self, method='scrypt', workers=2, max_pending=16, async_mode='threading'):
+        self.method = method
+        self.workers = workers
+        self.max_pending = max_pending
+        self._prefix = None
+        self._offload = _offloader(workers, async_mode)
+        self._slots = threading.BoundedSemaphore(workers)
+        self._admitted = 0
+        self._lock = threading.Lock()
+        self._histogram = [0] * len(LATENCY_BUCKETS)
+        self._latency_sum = 0.0
+        self._rejected = 0
+
+    @property
+    def prefix(self):
+        """Canonical prefix of new hashes, e.g. 'scrypt' -> 'scrypt:32768:8:1'"""
+        if self._prefix is None:
+            # Costs one full hash, so it is computed at the first login, not at startup
+            self._prefix = generate_password_hash('', self.method).split('$', 1)[0]
+        return self._prefix
+
+    def hash(self, password):
+        return self._call(generate_password_hash, password, self.method)
+
+    def verify(self, stored, password):
+        """(matches, needs_rehash)"""
+        ok = self._call(check_password_hash, stored, password)
+        return ok, ok and stored.split('$', 1)[0] != self.prefix
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': self._admitted,
+                'rejected': self._rejected,
+                'count': sum(self._histogram),
+                'latency_sum': self._latency_sum,
+                'buckets': dict(zip(LATENCY_BUCKETS, self._histogram)),
+            }
+
+    def _retry_after(self):
+        count = sum(self._histogram)
+        mean = self._latency_sum / count if count else 0.1
+        return max(1, math.ceil(self._admitted * mean / self.workers))
+
+    def _call(self, fn, *args):
+        with self._lock:
+            if self._admitted >= self.workers + self.max_pending:
+                self._rejected += 1
+                raise Saturated(self._retry_after())
+            self._admitted += 1
+        try:
+            with self._slots:
+                started = time.perf_counter()
+                result = self._offload(fn, *args)
+                elapsed = time.perf_counter() - started
+            with self._lock:
+                self._histogram[bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+                self._latency_sum += elapsed
+            return result
+        finally:
+            with self._lock:
+                self._admitted -= 1
+
+
+def _offloader(workers, async_mode):
+    """call(fn, *args) running fn on an OS thread and waiting for the result"""
+    if async_mode == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute
+    if async_mode == 'gevent':
+        from gevent import get_hub
+        return lambda fn, *args: get_hub().threadpool.apply(fn, args)
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+    return lambda fn, *args: executor.submit(fn, *args).result()
@@ -0,0 +1,113 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def room_for(device_id):
+    """Socket.IO room that receives the readings of one device."""
+    return f'device:{device_id}'
+
+
+class SensorPoller:
+    """Reads each watched device on a fixed schedule and fans the reading out.
+
+    There is exactly one background task per device, so the load on an ESP32
+    does not depend on how many dashboards are open. Clients are answered
+    from the cached reading instead of triggering a request to the board.
+
+    When ``has_subscribers(device_id)`` stays false for ``idle_timeout``
+    seconds the task stops; the next ``watch`` of that device resumes it.
+    """
+
+    def __init__(self, socketio, fetch, publish, interval=5, has_subscribers=None, idle_timeout=30):
+        self.socketio = socketio
+        self.fetch = fetch  # fetch(url) -> reading dict, or None on failure
+        self.publish = publish  # publish(device_id, reading) fans a reading out
+        self.interval = interval
+        self.has_subscribers = has_subscribers
+        self.idle_timeout = idle_timeout
+        self._urls = {}
+        self._latest = {}
+        self._running = set()
+        self._watched_at = {}  # device id -> last watch(), so a late subscriber is not dropped
+        self._lock = threading.Lock()
+
+    def watch(self, device_id, url):
+        with self._lock:
+            self._urls[device_id] = url
+            self._watched_at[device_id] = time.monotonic()
+            if device_id in self._running:
+                return
+            self._running.add(device_id)
+            self.socketio.start_background_task(self._run, device_id)
+
+    def retarget(self, device_id, url):
+        """Change the address of a device only if it is already being polled"""
+        with self._lock:
+            if device_id in self._urls:
+                self._urls[device_id] = url
+
+    def unwatch(self, device_id):
+        with self._lock:
+            self._urls.pop(device_id, None)
+            self._latest.pop(device_id, None)
+            self._watched_at.pop(device_id, None)
+
+    def polling(self, device_id):
+        """Whether a task is currently polling the device"""
+        return device_id in self._running
+
+    def active(self):
+        """Number of devices being polled right now"""
+        return len(self._running)
+
+    def latest(self, device_id):
+        return self._latest.get(device_id)
+
+    def _idle(self, device_id):
+        try:
+            return self.has_subscribers is not None and not self.has_subscribers(device_id)
+        except Exception as e:
+            logger.warning(f'Cannot count the subscribers of device {device_id}: {e}')
+            return False
+
+    def _run(self, device_id):
+        stopped = False
+        try:
+            stopped = self._poll(device_id)
+        finally:
+            if not stopped:
+                # Crashed: let the next watch() start a fresh task
+                logger.exception(f'Polling task of device {device_id} died')
+                with self._lock:
+                    self._running.discard(device_id)
+
+    def _poll(self, device_id):
+        """Poll until unwatched or idle; returns True once it left _running itself"""
+        idle_since = None
+        while True:
+            if not self._idle(device_id):
+                idle_since = None
+            elif idle_since is None:
+                idle_since = time.monotonic()
+            with self._lock:
+                url = self._urls.get(device_id)
+                if url is None:
+                    self._running.discard(device_id)
+                    return True
+                if idle_since is not None and self._watched_at.get(device_id, 0) >= idle_since:
+                    idle_since = time.monotonic()  # watched again meanwhile, start over
+                if idle_since is not None and time.monotonic() - idle_since >= self.idle_timeout:
+                    self._running.discard(device_id)
+                    logger.info(f'Nobody watches device {device_id}, polling suspended')
+                    return True
+            try:
+                reading = self.fetch(url)
+                if reading is not None:
+                    self._latest[device_id] = reading
+                    self.publish(device_id, reading)
+            except Exception as e:
+                logger.warning(f'Polling device {device_id} failed: {e}')
+            self.socketio.sleep(self.interval)
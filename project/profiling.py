@@ -0,0 +1,278 @@
+"""Opt-in request profiling with a bounded on-disk ring of reports.
+
+A request (or Socket.IO event) is *selected* when its endpoint, path or event
+name is in ``routes`` or when it falls in the sampled ``percent``; selected
+requests always produce a report. With ``slow_ms`` set, every other request
+is watched by the stack sampler too, and a report is kept only when it ran
+longer than the threshold. Reports carry the SQL statements the request
+issued and either a cProfile listing or sampled stacks in folded format
+(``a;b;c count``, readable by flamegraph.pl and speedscope).
+
+cProfile traces every call of the thread it runs on, which makes it costly
+and, in the green-thread modes, mixes in whatever other greenlets ran
+meanwhile; the default ``sampling`` mode avoids both.
+"""
+import cProfile
+import functools
+import io
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+
+MODES = ('sampling', 'cprofile')
+MAX_STATEMENTS = 500    # SQL statements kept per report
+MAX_STATEMENT_LENGTH = 2000
+MAX_DEPTH = 128         # frames kept per sampled stack
+
+
+class ReportStore:
+    """Keeps the newest ``keep`` reports in one directory"""
+
+    def __init__(self, directory, keep=50):
+        self.directory = directory
+        self.keep = keep
+
+    def save(self, name, duration_ms, text, profile=None):
+        os.makedirs(self.directory, exist_ok=True)
+        stem = '{}-{}-{}ms-{}'.format(datetime.now().strftime('%Y%m%dT%H%M%S_%f'),
+                                      _safe(name), int(duration_ms), uuid.uuid4().hex[:6])
+        with open(os.path.join(self.directory, stem + '.txt'), 'w') as f:
+            f.write(text)
+        if profile is not None:
+            profile.dump_stats(os.path.join(self.directory, stem + '.prof'))
+        self._evict()
+        return stem
+
+    def reports(self):
+        """Newest first: id, name, duration and files of every report"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        found = []
+        for filename in names:
+            stem, ext = os.path.splitext(filename)
+            if ext != '.txt':
+                continue
+            parts = stem.split('-')
+            if len(parts) < 4:
+                continue
+            found.append({
+                'id': stem,
+                'created': datetime.strptime(parts[0], '%Y%m%dT%H%M%S_%f').isoformat(),
+                'name': '-'.join(parts[1:-2]),
+                'duration_ms': int(parts[-2][:-2]),
+                'files': [f for f in (stem + '.txt', stem + '.prof') if f in names],
+            })
+        return sorted(found, key=lambda r: r['id'], reverse=True)
+
+    def _evict(self):
+        for report in self.reports()[self.keep:]:
+            for filename in report['files']:
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except FileNotFoundError:
+                    pass  # removed by another worker
+
+
+def _safe(name):
+    return ''.join(c if c.isalnum() or c == '_' else '_' for c in name or 'unknown')
+
+
+class Capture:
+    def __init__(self, name, path, meta, selected, mode, task):
+        self.name = name
+        self.path = path
+        self.meta = meta
+        self.selected = selected
+        self.mode = mode
+        self.task = task  # thread ident, or the greenlet in the green-thread modes
+        self.started = time.perf_counter()
+        self.profile = None
+        self.samples = Counter()  # folded stack -> count, written by the sampler thread
+        self.statements = []
+        self.finished = False
+
+
+class Profiler:
+    def __init__(self, store, percent=0.0, routes=(), slow_ms=0, mode='sampling',
+                 interval=0.01, async_mode='threading'):
+        self.store = store
+        self.interval = interval
+        self.green = async_mode != 'threading'
+        self._start_thread, self._sleep, get_ident = _os_threads(async_mode)
+        self._hub_thread = get_ident()  # green modes: the OS thread running the greenlets
+        self._active = {}  # task -> Capture
+        self._sampler_started = False
+        self._sampler_lock = threading.Lock()
+        self.configure(percent=percent, routes=routes, slow_ms=slow_ms, mode=mode)
+
+    def configure(self, percent=None, routes=None, slow_ms=None, mode=None):
+        if mode is not None and mode not in MODES:
+            raise ValueError(f'mode must be one of {", ".join(MODES)}')
+        if percent is not None:
+            percent = float(percent)
+            if not 0 <= percent <= 100:
+                raise ValueError('percent must be between 0 and 100')
+            self.percent = percent
+        if routes is not None:
+            self.routes = frozenset(routes)
+        if slow_ms is not None:
+            self.slow_ms = max(0.0, float(slow_ms))
+        if mode is not None:
+            self.mode = mode
+
+    def settings(self):
+        return {'percent': self.percent, 'routes': sorted(self.routes),
+                'slow_ms': self.slow_ms, 'mode': self.mode}
+
+    # -------------------- Captures --------------------
+
+    def start(self, name, path=None, **meta):
+        """Begin watching the current request; None when it is not watched at all"""
+        selected = name in self.routes or path in self.routes or \
+            (self.percent > 0 and random.random() * 100 < self.percent)
+        if not selected and not self.slow_ms:
+            return None
+        mode = self.mode if selected else 'sampling'
+        capture = Capture(name, path, meta, selected, mode, self._task())
+        if mode == 'cprofile':
+            capture.profile = cProfile.Profile()
+            try:
+                capture.profile.enable()
+            except ValueError:  # another profiler is active on this interpreter
+                capture.profile = None
+                capture.mode = 'sampling'
+        self._active[capture.task] = capture
+        if capture.mode == 'sampling':
+            self._ensure_sampler()
+        return capture
+
+    def finish(self, capture, **meta):
+        """Stop watching; writes a report and returns its id when one is kept"""
+        if capture is None or capture.finished:
+            return None
+        capture.finished = True
+        elapsed_ms = (time.perf_counter() - capture.started) * 1000
+        if capture.profile is not None:
+            capture.profile.disable()
+        if self._active.get(capture.task) is capture:
+            del self._active[capture.task]
+        slow = bool(self.slow_ms) and elapsed_ms >= self.slow_ms
+        if not capture.selected and not slow:
+            return None
+        capture.meta.update(meta)
+        trigger = 'selected' if capture.selected else f'slower than {self.slow_ms:g} ms'
+        return self.store.save(capture.name, elapsed_ms, self._report(capture, elapsed_ms, trigger),
+                               capture.profile)
+
+    def on_query(self, statement, seconds):
+        """Attach a SQL statement to the capture of the current request, if any"""
+        capture = self._active.get(self._task())
+        if capture is not None and len(capture.statements) < MAX_STATEMENTS:
+            capture.statements.append((seconds, statement[:MAX_STATEMENT_LENGTH]))
+
+    def wrap(self, name):
+        """Decorator for Socket.IO handlers"""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                capture = self.start(name)
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.finish(capture)
+            return wrapper
+        return decorator
+
+    def _task(self):
+        if self.green:
+            import greenlet
+            return greenlet.getcurrent()
+        return threading.get_ident()
+
+    # -------------------- Reports --------------------
+
+    def _report(self, capture, elapsed_ms, trigger):
+        out = io.StringIO()
+        out.write(f'name: {capture.name}\n')
+        if capture.path:
+            out.write(f'path: {capture.path}\n')
+        for key, value in capture.meta.items():
+            out.write(f'{key}: {value}\n')
+        out.write(f'duration_ms: {elapsed_ms:.1f}\n')
+        out.write(f'trigger: {trigger}\n')
+        out.write(f'pid: {os.getpid()}\n')
+        out.write(f'captured: {datetime.now().isoformat()}\n')
+
+        sql_ms = sum(seconds for seconds, _ in capture.statements) * 1000
+        out.write(f'\n--- SQL: {len(capture.statements)} statements, {sql_ms:.1f} ms ---\n')
+        for seconds, statement in capture.statements:
+            out.write(f'{seconds * 1000:8.2f} ms  {" ".join(statement.split())}\n')
+
+        if capture.profile is not None:
+            out.write('\n--- cProfile, by cumulative time ---\n')
+            pstats.Stats(capture.profile, stream=out).sort_stats('cumulative').print_stats(60)
+        else:
+            samples = dict(capture.samples)  # copied in one step while the sampler may still write
+            out.write(f'\n--- Sampled stacks: {sum(samples.values())} samples '
+                      f'every {self.interval * 1000:g} ms, folded ---\n')
+            for stack, count in sorted(samples.items(), key=lambda item: -item[1]):
+                out.write(f'{stack} {count}\n')
+        return out.getvalue()
+
+    # -------------------- Sampler --------------------
+
+    def _ensure_sampler(self):
+        with self._sampler_lock:
+            if not self._sampler_started:
+                self._sampler_started = True
+                self._start_thread(self._sample_forever, ())
+
+    def _sample_forever(self):
+        while True:
+            captures = [c for c in list(self._active.values()) if c.mode == 'sampling']
+            if captures:
+                frames = sys._current_frames()
+                for capture in captures:
+                    stack = _fold(self._frame_of(capture, frames))
+                    if stack:
+                        capture.samples[stack] += 1
+            self._sleep(self.interval)
+
+    def _frame_of(self, capture, frames):
+        if not self.green:
+            return frames.get(capture.task)
+        # A suspended greenlet keeps its frame; the running one is the hub thread's
+        frame = capture.task.gr_frame
+        if frame is None and not capture.task.dead:
+            frame = frames.get(self._hub_thread)
+        return frame
+
+
+def _fold(frame):
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def _os_threads(async_mode):
+    """(start_new_thread, sleep, get_ident) of real OS threads, even when monkey-patched"""
+    if async_mode == 'eventlet':
+        from eventlet.patcher import original
+        return original('_thread').start_new_thread, original('time').sleep, original('_thread').get_ident
+    if async_mode == 'gevent':
+        from gevent.monkey import get_original
+        return (get_original('_thread', 'start_new_thread'), get_original('time', 'sleep'),
+                get_original('_thread', 'get_ident'))
+    import _thread
+    return _thread.start_new_thread, time.sleep, _thread.get_ident
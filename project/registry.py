@@ -0,0 +1,108 @@
+import hashlib
+import hmac
+import secrets
+import threading
+from urllib.parse import urlsplit
+
+
+class DeviceEntry:
+    __slots__ = ('id', 'user_id', 'base_url', 'key_hash')
+
+    def __init__(self, device_id, user_id, host, key_hash=None):
+        self.id = device_id
+        self.user_id = user_id
+        self.base_url = normalize_host(host)
+        self.key_hash = key_hash
+
+    def accepts_key(self, key):
+        """Whether ``key`` is this device's ingest key"""
+        return bool(self.key_hash and key) and hmac.compare_digest(self.key_hash, hash_ingest_key(key))
+
+    @property
+    def data_url(self):
+        return f'{self.base_url}/data' if self.base_url else None
+
+    @property
+    def buzzer_url(self):
+        return f'{self.base_url}/buzzer' if self.base_url else None
+
+    @property
+    def buzzer_off_url(self):
+        return f'{self.base_url}/buzzer/deactivate' if self.base_url else None
+
+
+def normalize_host(host):
+    """'192.168.15.124' or 'http://192.168.15.124:80/' -> 'http://192.168.15.124...'"""
+    host = (host or '').strip().rstrip('/')
+    if not host:
+        return None
+    if not host.startswith(('http://', 'https://')):
+        host = f'http://{host}'
+    return host
+
+
+def new_ingest_key():
+    """A fresh ingest key for a board, and the hash stored in its place"""
+    key = secrets.token_urlsafe(24)
+    return key, hash_ingest_key(key)
+
+
+def hash_ingest_key(key):
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def check_host(host):
+    """The device address as entered, or None when empty; ValueError when unusable.
+
+    Only a plain http(s) host with an optional port is accepted: no
+    credentials, path, query or fragment.
+    """
+    url = normalize_host(host)
+    if url is None:
+        return None
+    try:
+        parts = urlsplit(url)
+        parts.port  # raises ValueError when out of range or not a number
+    except ValueError:
+        raise ValueError('Invalid device address.') from None
+    if (not parts.hostname or parts.username is not None or parts.netloc.endswith(':')
+            or parts.path or parts.query or parts.fragment or any(c.isspace() for c in url)):
+        raise ValueError('Invalid device address.')
+    return host.strip()
+
+
+class DeviceRegistry:
+    """In-process index of devices and their network addresses.
+
+    Polling, commands and ingestion resolve devices here instead of querying
+    the database. It is loaded once at startup and updated by the device
+    management routes.
+    """
+
+    def __init__(self):
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._devices)
+
+    def __iter__(self):
+        return iter(list(self._devices.values()))
+
+    def load(self, devices):
+        entries = {d.id: DeviceEntry(d.id, d.user_id, d.host, d.ingest_key_hash) for d in devices}
+        with self._lock:
+            self._devices = entries
+
+    def put(self, device):
+        entry = DeviceEntry(device.id, device.user_id, device.host, device.ingest_key_hash)
+        with self._lock:
+            self._devices[device.id] = entry
+        return entry
+
+    def remove(self, device_id):
+        with self._lock:
+            return self._devices.pop(device_id, None)
+
+    def get(self, device_id):
+        return self._devices.get(device_id)
@@ -0,0 +1,160 @@
+import logging
+import math
+import threading
+import time
+
+from sqlalchemy import func, cast, Integer
+
+from history import METRICS
+
+logger = logging.getLogger(__name__)
+
+MINUTE, HOUR, DAY = 60, 3600, 86400
+RESOLUTIONS = (MINUTE, HOUR, DAY)
+
+
+def aggregate(rows):
+    """Fold a batch of readings into per-bucket min/max/sum/count.
+
+    Returns {(device_id, metric, resolution, bucket): [min, max, sum, count]}
+    for every resolution, ready to be merged into the rollup table.
+    """
+    out = {}
+    for row in rows:
+        for metric in METRICS:
+            value = row.get(metric)
+            if value is None:
+                continue
+            for resolution in RESOLUTIONS:
+                key = (row['device_id'], metric, resolution,
+                       int(row['ts'] // resolution) * resolution)
+                agg = out.get(key)
+                if agg is None:
+                    out[key] = [value, value, value, 1]
+                else:
+                    if value < agg[0]:
+                        agg[0] = value
+                    if value > agg[1]:
+                        agg[1] = value
+                    agg[2] += value
+                    agg[3] += 1
+    return out
+
+
+def merge(session, model, aggregates):
+    """Upsert aggregates into the rollup table, combining with existing rows"""
+    if not aggregates:
+        return
+    if session.get_bind().dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        least, greatest = func.least, func.greatest
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+        least, greatest = func.min, func.max  # scalar forms with two arguments
+    stmt = insert(model)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['device_id', 'metric', 'resolution', 'bucket'],
+        set_={
+            'min': least(model.min, stmt.excluded.min),
+            'max': greatest(model.max, stmt.excluded.max),
+            'sum': model.sum + stmt.excluded.sum,
+            'count': model.count + stmt.excluded.count,
+        })
+    session.execute(stmt, [{
+        'device_id': device_id, 'metric': metric, 'resolution': resolution,
+        'bucket': bucket, 'min': lo, 'max': hi, 'sum': total, 'count': count,
+    } for (device_id, metric, resolution, bucket), (lo, hi, total, count) in aggregates.items()])
+
+
+def pick_resolution(width):
+    """Coarsest rollup that still fits inside a bucket of ``width`` seconds"""
+    best = None
+    for resolution in RESOLUTIONS:
+        if resolution <= width:
+            best = resolution
+    return best
+
+
+def align(start, end, buckets, resolution):
+    """Widen a query grid so every bucket is made of whole rollup buckets.
+
+    ``start`` moves down to a multiple of ``resolution`` and the bucket width
+    up to one, so no rollup bucket straddles an edge; returns the new
+    (start, end, buckets), covering at least the requested range.
+    """
+    width = math.ceil((end - start) / buckets / resolution) * resolution
+    start = math.floor(start / resolution) * resolution
+    buckets = max(math.ceil((end - start) / width), 1)
+    return start, start + buckets * width, buckets
+
+
+def bucketed(session, model, device_id, metric, resolution, start, end, buckets):
+    """Same output as history.bucketed, read from pre-aggregated rows.
+
+    The grid must come from align(), otherwise rollup buckets at the edges
+    and across bucket boundaries would be counted on the wrong side.
+    """
+    width = (end - start) / buckets
+    if start % resolution or width % resolution:
+        raise ValueError('The bucket grid is not aligned to the rollup resolution')
+    index = cast(func.floor((model.bucket - start) / width), Integer).label('bucket_index')
+    rows = (session.query(index, func.min(model.min), func.max(model.max),
+                          func.sum(model.sum), func.sum(model.count))
+            .filter(model.device_id == device_id, model.metric == metric,
+                    model.resolution == resolution,
+                    model.bucket >= start, model.bucket < end)
+            .group_by(index)
+            .order_by(index)
+            .all())
+    return [{
+        'timestamp': start + i * width,
+        'min': lo,
+        'max': hi,
+        'mean': total / count if count else None,
+        'count': count,
+    } for i, lo, hi, total, count in rows]
+
+
+class Compactor:
+    """Background job enforcing the retention policy.
+
+    ``compact`` deletes raw readings and rollups that are past their
+    retention, so the database file stops growing without bound.
+    """
+
+    def __init__(self, socketio, compact, interval=3600):
+        self.socketio = socketio
+        self.compact_fn = compact  # compact(now) -> number of rows deleted
+        self.interval = interval
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            try:
+                deleted = self.compact_fn(time.time())
+                if deleted:
+                    logger.info(f'Compaction removed {deleted} expired rows')
+            except Exception as e:
+                logger.error(f'Compaction failed: {e}')
+            self.socketio.sleep(self.interval)
+
+
+def delete_before(session, model, column, cutoff, extra=(), batch=5000):
+    """Delete rows with ``column < cutoff`` in batches; returns the count"""
+    total = 0
+    while True:
+        ids = [row[0] for row in session.query(model.id)
+               .filter(column < cutoff, *extra).limit(batch).all()]
+        if not ids:
+            return total
+        session.query(model).filter(model.id.in_(ids)).delete(synchronize_session=False)
+        session.commit()
+        total += len(ids)
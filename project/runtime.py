@@ -0,0 +1,23 @@
+"""Concurrency mode of the server, selected with ASYNC_MODE.
+
+threading (the default) gives every WebSocket connection and every blocked
+device call its own OS thread. eventlet and gevent run them on green
+threads instead, which cost a few kilobytes each; the standard library is
+monkey-patched so that sockets, requests, locks and sleeps yield to other
+green threads instead of blocking the process.
+
+This module must be imported before anything else in app.py.
+"""
+import os
+
+ASYNC_MODES = ('threading', 'eventlet', 'gevent')
+ASYNC_MODE = os.environ.get('ASYNC_MODE', 'threading')
+
+if ASYNC_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+elif ASYNC_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+elif ASYNC_MODE not in ASYNC_MODES:
+    raise ValueError(f'ASYNC_MODE must be one of {", ".join(ASYNC_MODES)}, not {ASYNC_MODE!r}')
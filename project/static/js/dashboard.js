@@ -44,10 +44,30 @@ function toggleDeviceSection(sectionId) {
   });
 }
 
+// Readings are pushed for the device we are subscribed to; there is at
+// most one subscription per tab, and none while the tab is hidden
+function subscribeSelected() {
+  const deviceId = selectedDeviceId();
+  if (deviceId === subscribedDeviceId) {
+    return;
+  }
+  unsubscribe();
+  if (deviceId !== null) {
+    socket.emit("subscribe", { device_ids: [deviceId] });
+    subscribedDeviceId = deviceId;
+  }
+}
+
+function unsubscribe() {
+  if (subscribedDeviceId !== null) {
+    socket.emit("unsubscribe", { device_ids: [subscribedDeviceId] });
+    subscribedDeviceId = null;
+  }
+}
+
 // Event: Handle DOM content loaded
 document.addEventListener("DOMContentLoaded", function () {
-  const userEmail = "user@example.com"; // Replace with dynamic user email
-  fetchThresholds(userEmail).then(() => {
+  fetchThresholds().then(() => {
     hideAllSections(); // Ensure all sections are hidden initially
   });
 
@@ -57,13 +77,7 @@ document.addEventListener("DOMContentLoaded", function () {
     .addEventListener("click", function () {
       showAnalyticsSection();
 
-      // Request sensor data and start auto-refresh
-      if (!refreshInterval) {
-        socket.emit("request_sensor_data"); // Initial request
-        refreshInterval = setInterval(() => {
-          socket.emit("request_sensor_data");
-        }, 5000); // Refresh every 5 seconds
-      }
+      subscribeSelected();
     });
 
   // Devices button click
@@ -72,13 +86,27 @@ document.addEventListener("DOMContentLoaded", function () {
     .addEventListener("click", function () {
       showDevicesSection();
 
-      // Stop auto-refresh
-      if (refreshInterval) {
-        clearInterval(refreshInterval);
-        refreshInterval = null;
+      unsubscribe();
+    });
+
+  document
+    .getElementById("analytics_device_id")
+    .addEventListener("change", () => {
+      if (isAnalyticsActive) {
+        updateSensorDisplays("--");
+        subscribeSelected();
       }
     });
 
+  // Hidden tabs let go of their subscription so idle devices stop being polled
+  document.addEventListener("visibilitychange", () => {
+    if (document.hidden) {
+      unsubscribe();
+    } else if (isAnalyticsActive) {
+      subscribeSelected();
+    }
+  });
+
   // Device management buttons
   document
     .getElementById("add-device-button")
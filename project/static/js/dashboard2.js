@@ -1,49 +1,65 @@
 // Initialize Socket.IO connection
 const socket = io();
 let isAnalyticsActive = false;
-let refreshInterval = null; // For automatic data refresh
-let deviceThresholds = {}; // Store thresholds for the device
-
-// Fetch thresholds from the server
-function fetchThresholds(userEmail) {
-  return fetch(`/get_thresholds?email=${userEmail}`)
+let subscribedDeviceId = null; // Device whose readings are pushed to this tab
+let deviceThresholds = {}; // Thresholds per device id
+let deviceState = {}; // Latest readings per device, rebuilt from sensor_frame deltas
+let deviceHistory = {}; // Recent readings per device, as columns {ts, light, humidity, ...}
+const FRAME_FIELDS = { l: "light", h: "humidity", t: "temperature", s: "smoke" };
+
+// Fetch the thresholds of all of the user's devices in one request. The
+// browser revalidates with If-None-Match, so an unchanged set costs a 304.
+function fetchThresholds() {
+  return fetch("/api/thresholds")
     .then((response) => response.json())
     .then((data) => {
-      if (data.error) {
-        console.error(data.error);
+      if (!data.success) {
+        console.error(data.message);
       } else {
-        deviceThresholds = data;
+        deviceThresholds = data.thresholds;
         console.log("Thresholds loaded:", deviceThresholds);
       }
     })
     .catch((error) => console.error("Error fetching thresholds:", error));
 }
 
-// Activate the buzzer
-function activateBuzzer() {
-  fetch("/activate_buzzer", { method: "POST" })
+// Device currently shown in the analytics section
+function selectedDeviceId() {
+  const select = document.getElementById("analytics_device_id");
+  return select && select.value ? Number(select.value) : null;
+}
+
+function sendBuzzerCommand(url) {
+  fetch(url, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ device_id: selectedDeviceId() }),
+  })
     .then((response) => response.json())
     .then((data) => console.log(data.status))
-    .catch((error) => console.error("Error activating buzzer:", error));
+    .catch((error) => console.error("Error:", error));
 }
 
 document.getElementById("buzzerButton").addEventListener("click", () => {
-  fetch("/activate_buzzer", { method: "POST" })
-    .then((response) => response.json())
-    .catch((error) => console.error("Error:", error));
+  sendBuzzerCommand("/activate_buzzer");
 });
 
 document
   .getElementById("buzzerDeactivateButton")
   .addEventListener("click", () => {
-    fetch("/deactivate_buzzer", { method: "POST" })
-      .then((response) => response.json())
-      .catch((error) => console.error("Error:", error));
+    sendBuzzerCommand("/deactivate_buzzer");
   });
 
 // Socket.IO event handlers
 socket.on("connect", () => {
   console.log("Connected to WebSocket server");
+  // Subscriptions do not survive a reconnect, renew ours
+  if (subscribedDeviceId !== null) {
+    subscribedDeviceId = null;
+    if (isAnalyticsActive && !document.hidden) {
+      subscribeSelected();
+    }
+  }
 });
 
 socket.on("disconnect", () => {
@@ -54,36 +70,78 @@ socket.on("disconnect", () => {
 });
 
 socket.on("sensor_data", (data) => {
-  if (isAnalyticsActive) {
+  if (isAnalyticsActive && (data.device_id === undefined || data.device_id === selectedDeviceId())) {
     updateSensorData(data);
+  }
+});
 
-    // Check thresholds and activate buzzer if needed
-    const thresholds = [
-      {
-        type: "temperature",
-        value: data.temperature,
-        threshold: deviceThresholds.temperature,
-      },
-      {
-        type: "humidity",
-        value: data.humidity,
-        threshold: deviceThresholds.humidity,
-      },
-      { type: "light", value: data.light, threshold: deviceThresholds.light },
-      { type: "smoke", value: data.smoke, threshold: deviceThresholds.smoke },
-    ];
-
-    thresholds.forEach((item) => {
-      if (item.value >= item.threshold) {
-        console.warn(
-          `Buzzer triggered: ${item.type} exceeds ${item.threshold}`
-        );
-        activateBuzzer();
+// Sent once on subscribe: the last few minutes of each device, oldest first,
+// so the cards are filled before the next live reading arrives
+socket.on("sensor_history", (payload) => {
+  Object.entries(payload.devices).forEach(([id, columns]) => {
+    deviceHistory[id] = columns;
+  });
+  const columns = deviceHistory[selectedDeviceId()];
+  if (isAnalyticsActive && columns && columns.ts.length) {
+    const latest = { timestamp: columns.ts[columns.ts.length - 1] * 1000 };
+    Object.values(FRAME_FIELDS).forEach((metric) => {
+      // Newest value the device reported for this metric
+      const values = columns[metric];
+      for (let i = values.length - 1; i >= 0; i--) {
+        if (values[i] !== null) {
+          latest[metric] = values[i];
+          break;
+        }
       }
     });
+    updateSensorData(latest);
   }
 });
 
+// One frame per tick carries every changed device; unchanged fields are omitted
+socket.on("sensor_frame", (payload) => {
+  const frame =
+    payload instanceof ArrayBuffer
+      ? MessagePack.decode(new Uint8Array(payload))
+      : payload;
+
+  Object.entries(frame.d).forEach(([id, fields]) => {
+    const state = (deviceState[id] = deviceState[id] || {});
+    Object.entries(fields).forEach(([key, value]) => {
+      state[FRAME_FIELDS[key]] = value;
+    });
+    if (!frame.full || !state.timestamp) {
+      state.timestamp = frame.ts;
+    }
+  });
+
+  const current = deviceState[selectedDeviceId()];
+  if (isAnalyticsActive && current) {
+    updateSensorData(current);
+  }
+});
+
+// Threshold checks run on the server, which drives the buzzer once per alarm
+socket.on("alarm", (alarm) => {
+  if (alarm.active) {
+    console.warn(`Alarm on device ${alarm.device_id}: ${alarm.metrics.join(", ")}`);
+  } else {
+    console.log(`Alarm cleared on device ${alarm.device_id}`);
+  }
+});
+
+// Unusual readings (spikes, drift, fast changes) flagged by the server's streaming statistics
+socket.on("anomaly", (anomaly) => {
+  console.warn(
+    `Anomaly on device ${anomaly.device_id}: ${anomaly.metric} ${anomaly.kind} (${anomaly.value}, usually ${anomaly.mean} ± ${anomaly.std})`
+  );
+});
+
+// Buzzer commands are queued on the server, their progress is pushed here
+socket.on("command_status", (command) => {
+  console.log(`Command ${command.id} on device ${command.device_id}: ${command.state}`);
+});
+
 // Update all sensor data and UI elements
 function updateSensorData(data) {
   const stats = [
@@ -94,6 +152,9 @@ function updateSensorData(data) {
   ];
 
   stats.forEach((stat) => {
+    if (stat.value === undefined || stat.value === null) {
+      return;
+    }
     const display = document.querySelector(`#${stat.id} .value`);
     let unit = "";
 
@@ -100,6 +100,8 @@ document.addEventListener("DOMContentLoaded", () => {
       .then((data) => {
         if (data.success) {
           window.showToast(data.message, "success");
+          // Only shown once: the board sends it with every reading
+          window.prompt("Ingest key for the board (X-Device-Key):", data.ingest_key);
           addDeviceForm.reset();
           fetchDevices(modifyDeviceSelect);
           fetchDevices(removeDeviceSelect);
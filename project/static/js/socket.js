@@ -10,21 +10,30 @@ socket.on("disconnect", () => {
   console.log("Disconnected from the WebSocket server");
 });
 
-// Receive and update sensor data
-socket.on("sensor_data", (data) => {
-  console.log("Received sensor data:", data);
+// Latest readings, rebuilt from the delta frames
+const sensorState = {};
+const FRAME_FIELDS = { l: "light", h: "humidity", t: "temperature", s: "smoke" };
+
+// Receive a frame and apply its deltas
+socket.on("sensor_frame", (frame) => {
+  Object.values(frame.d).forEach((fields) => {
+    Object.entries(fields).forEach(([key, value]) => {
+      sensorState[FRAME_FIELDS[key]] = value;
+    });
+  });
+  console.log("Received sensor frame:", frame);
 
   // Update the dashboard with real-time data
   document.querySelector(
     ".stat-card:nth-child(1) h2"
-  ).textContent = `${data.light}%`;
+  ).textContent = `${sensorState.light}%`;
   document.querySelector(
     ".stat-card:nth-child(2) h2"
-  ).textContent = `${data.humidity}%`;
+  ).textContent = `${sensorState.humidity}%`;
   document.querySelector(
     ".stat-card:nth-child(3) h2"
-  ).textContent = `${data.temperature}°C`;
+  ).textContent = `${sensorState.temperature}°C`;
   document.querySelector(
     ".stat-card:nth-child(4) h2"
-  ).textContent = `${data.smoke} ppm`;
+  ).textContent = `${sensorState.smoke} ppm`;
 });
@@ -0,0 +1,74 @@
+"""Fixtures for the app tests.
+
+The app reads DATABASE_URL when it is imported, so a throwaway SQLite
+database is set up here, before any test module imports it. The suite runs
+in the concurrency mode given by ASYNC_MODE (see runtime.py).
+"""
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db')
+os.environ.setdefault('FLASK_DEBUG', '0')
+
+
+@pytest.fixture(scope='session')
+def server():
+    """The app module, set up with its tables and the default admin user"""
+    import app as server
+    server.create_app()
+    with server.app.app_context():
+        server.init_db()
+    return server
+
+
+@pytest.fixture
+def client(server):
+    """A test client logged in as the default admin"""
+    client = server.app.test_client()
+    response = client.post('/login', data={'login_id': 'admin', 'password': '12345'})
+    assert response.status_code == 302
+    return client
+
+
+@pytest.fixture
+def add_device(client):
+    """add_device(host=None) registers a device of the admin and returns its id"""
+    def add_device(host=None):
+        form = {'device_name': 'test board', 'device_type': 'esp32'}
+        if host:
+            form['device_host'] = host
+        assert client.post('/add_device', data=form).get_json()['success']
+        return max(d['id'] for d in client.get('/get_devices').get_json()['devices'])
+    return add_device
+
+
+class FakeBoard:
+    """Stands in for the device HTTP client and records what was sent"""
+
+    def __init__(self):
+        self.posts = []
+
+    def post(self, url, **kwargs):
+        self.posts.append(url)
+        return SimpleNamespace(status_code=200)
+
+
+@pytest.fixture
+def board(server, monkeypatch):
+    board = FakeBoard()
+    monkeypatch.setattr(server.dispatcher, 'client', board)
+    return board
+
+
+def wait_for(server, condition, timeout=5):
+    """Sleep in small steps, yielding to green threads, until condition() holds"""
+    for _ in range(int(timeout / 0.05)):
+        if condition():
+            return True
+        server.socketio.sleep(0.05)
+    return condition()
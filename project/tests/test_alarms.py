@@ -0,0 +1,45 @@
+from alarms import ThresholdEngine
+
+LIMITS = {'light': None, 'humidity': None, 'temperature': 30, 'smoke': None}
+
+
+def engine(**kwargs):
+    transitions = []
+    engine = ThresholdEngine(lambda *args: transitions.append(args), **kwargs)
+    engine.set_limits(1, LIMITS)
+    return engine, transitions
+
+
+def feed(engine, *temperatures):
+    return [engine.evaluate(1, {'temperature': t}) for t in temperatures]
+
+
+def test_alarm_waits_for_debounce_readings():
+    alarms, transitions = engine(debounce=3)
+    assert feed(alarms, 31, 31) == [None, None]
+    assert feed(alarms, 29, 31, 31) == [None, None, None]  # a normal reading restarts the count
+    assert feed(alarms, 32) == [True]
+    assert transitions == [(1, True, ['temperature'])]
+
+
+def test_alarm_is_reported_once():
+    alarms, transitions = engine(debounce=1)
+    assert feed(alarms, 31, 35, 40) == [True, None, None]
+    assert len(transitions) == 1
+
+
+def test_hysteresis_band_keeps_the_alarm_on():
+    alarms, transitions = engine(hysteresis=0.1, debounce=2)
+    feed(alarms, 31, 31)
+    # 27 < value < 30 is below the limit but inside the band
+    assert feed(alarms, 29, 28, 27.5, 29) == [None] * 4
+    assert feed(alarms, 26, 25) == [None, False]
+    assert transitions[-1] == (1, False, [])
+
+
+def test_devices_without_limits_are_ignored():
+    alarms, transitions = engine(debounce=1)
+    assert alarms.evaluate(2, {'temperature': 99}) is None
+    alarms.remove(1)
+    assert feed(alarms, 99) == [None]
+    assert transitions == []
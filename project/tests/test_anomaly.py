@@ -0,0 +1,77 @@
+import random
+import statistics
+
+import pytest
+
+from anomaly import AnomalyDetector
+
+
+class Loop:
+    def sleep(self, seconds):
+        pass
+
+    def start_background_task(self, target):
+        pass
+
+
+def detector(**kwargs):
+    found = []
+    return AnomalyDetector(Loop(), found.extend, **kwargs), found
+
+
+def feed(detector, values, start=0.0, step=60.0, device_id=1):
+    for i, value in enumerate(values):
+        detector.observe(device_id, start + i * step, {'temperature': value})
+        detector.evaluate()
+
+
+def test_welford_and_ewma_match_the_textbook():
+    anomalies, _ = detector(alpha=0.2, warmup=10 ** 6, window=8)
+    rng = random.Random(7)
+    values = [rng.gauss(20, 2) for _ in range(200)]
+    feed(anomalies, values)
+
+    ewma = values[0]
+    for value in values[1:]:
+        ewma += 0.2 * (value - ewma)
+    stats = anomalies.stats(1)['temperature']
+    assert stats['count'] == 200
+    assert stats['mean'] == pytest.approx(statistics.mean(values), abs=1e-4)
+    assert stats['std'] == pytest.approx(statistics.stdev(values), abs=1e-4)
+    assert stats['ewma'] == pytest.approx(ewma, abs=1e-4)
+    assert stats['last'] == pytest.approx(values[-1], abs=1e-4)
+    assert stats['max'] == pytest.approx(max(values[-8:]), abs=1e-4)
+    assert anomalies.stats(1)['humidity']['count'] == 0
+
+
+def test_staged_readings_are_all_folded_in():
+    anomalies, _ = detector(warmup=10 ** 6)
+    for i in range(40):  # more than max_pending between two evaluations
+        anomalies.observe(1, float(i), {'temperature': float(i)})
+    anomalies.evaluate()
+    assert anomalies.stats(1)['temperature']['count'] == 40
+
+
+def test_spike_is_reported_once_and_clipped():
+    anomalies, found = detector(warmup=30, z=4.0)
+    rng = random.Random(1)
+    feed(anomalies, [rng.gauss(20, 1) for _ in range(50)])
+    mean = anomalies.stats(1)['temperature']['mean']
+    assert found == []
+
+    feed(anomalies, [80, 80], start=50 * 60)
+    spikes = [a for a in found if a['kind'] == 'spike']
+    assert len(spikes) == 1 and spikes[0]['value'] == 80
+    # Clipped to z standard deviations, the spikes barely move the baseline
+    assert anomalies.stats(1)['temperature']['mean'] == pytest.approx(mean, abs=0.5)
+
+
+def test_rate_is_measured_over_min_dt():
+    anomalies, found = detector(warmup=5, z=100, drift=100, max_rate={'temperature': 0.1}, min_dt=10)
+    feed(anomalies, [20 + (i % 2) * 0.5 for i in range(10)], step=20)
+    assert found == []
+    # 3 degrees in 1 s: not yet judged, the reference is too recent
+    feed(anomalies, [23], start=9 * 20 + 1)
+    assert found == []
+    feed(anomalies, [26], start=9 * 20 + 15)
+    assert [a['kind'] for a in found] == ['rate']
@@ -0,0 +1,171 @@
+import time
+
+import pytest
+
+from conftest import wait_for
+
+
+def test_login(server):
+    client = server.app.test_client()
+    assert client.get('/dashboard').status_code == 302
+
+    response = client.post('/login', data={'login_id': 'admin', 'password': 'wrong'})
+    assert response.location == '/login'
+    assert client.get('/dashboard').status_code == 302
+
+    response = client.post('/login', data={'login_id': 'admin', 'password': '12345'})
+    assert response.location == '/dashboard'
+    assert client.get('/dashboard').status_code == 200
+
+
+def test_ingest(server, client, add_device):
+    device_id = add_device()
+    reading = {'device_id': device_id, 'timestamp': time.time(),
+               'temperature': 21.5, 'humidity': 40, 'light': 300, 'smoke': 0}
+
+    response = client.post('/api/readings', json=reading)
+    assert response.status_code == 202
+    assert response.get_json()['accepted'] == 1
+
+    assert client.post('/api/readings', json=dict(reading, device_id=10 ** 9)).status_code == 403
+    assert client.post('/api/readings', data='{"temperature": NaN}',
+                       content_type='application/json').status_code == 400
+
+    server.ingest_buffer.flush()
+    with server.app.app_context():
+        rows = server.Reading.query.filter_by(device_id=device_id).all()
+    assert [row.temperature for row in rows] == [21.5]
+
+
+def test_ingest_needs_the_device_key(server, client, add_device):
+    device_id, other_id = add_device(), add_device()
+    key = client.post(f'/devices/{device_id}/ingest_key').get_json()['ingest_key']
+    board = server.app.test_client()
+    reading = {'device_id': device_id, 'temperature': 21.5}
+
+    assert board.post('/api/readings', json=reading).status_code == 401
+    assert board.post('/api/readings', json=reading, headers={'X-Device-Key': 'wrong'}).status_code == 403
+    assert board.post('/api/readings', json=dict(reading, device_id=other_id),
+                      headers={'X-Device-Key': key}).status_code == 403
+    assert board.post('/api/readings', json=reading, headers={'X-Device-Key': key}).status_code == 202
+
+    # A new key replaces the old one
+    client.post(f'/devices/{device_id}/ingest_key')
+    assert board.post('/api/readings', json=reading, headers={'X-Device-Key': key}).status_code == 403
+
+
+def test_subscribe_and_push(server, client, add_device):
+    first, second = add_device(), add_device()
+    socket = server.socketio.test_client(server.app, flask_test_client=client)
+    assert socket.is_connected()
+    assert socket.emit('subscribe', {'device_ids': [first, second]}, callback=True) == {
+        'subscribed': [first, second]}
+    socket.get_received()
+
+    now = time.time()
+    client.post('/api/readings', json=[{'device_id': first, 'timestamp': now, 'temperature': 30.25},
+                                       {'device_id': second, 'timestamp': now, 'temperature': 18.5}])
+
+    frames = []
+    def pushed():
+        frames.extend(p['args'][0] for p in socket.get_received() if p['name'] == 'sensor_frame')
+        return bool(frames)
+    assert wait_for(server, pushed)
+    # Both devices arrive in one frame
+    assert frames[0]['d'] == {str(first): {'t': 30.25}, str(second): {'t': 18.5}}
+
+    socket.emit('unsubscribe', {'device_ids': [first, second]})
+    socket.get_received()
+    client.post('/api/readings', json={'device_id': first, 'timestamp': time.time(), 'temperature': 31})
+    server.socketio.sleep(server.FRAME_TICK * 2)
+    assert not [p for p in socket.get_received() if p['name'] == 'sensor_frame']
+    socket.disconnect()
+
+
+def test_subscribe_ignores_other_users_devices(server, client, add_device):
+    device_id = add_device()
+    other = server.app.test_client()
+    other.post('/signup', data={'username': 'other', 'email': 'other@example.com', 'password': 'secret123'})
+    other.post('/login', data={'login_id': 'other', 'password': 'secret123'})
+    socket = server.socketio.test_client(server.app, flask_test_client=other)
+    assert socket.emit('subscribe', {'device_ids': [device_id]}, callback=True) == {'subscribed': []}
+    socket.disconnect()
+
+
+def test_buzzer_dispatch(server, client, add_device, board):
+    device_id = add_device(host='192.0.2.10')
+
+    response = client.post('/activate_buzzer', json={'device_id': device_id})
+    assert response.status_code == 202
+    status_url = response.get_json()['status_url']
+    assert wait_for(server, lambda: client.get(status_url).get_json()['state'] == 'done')
+    assert board.posts == ['http://192.0.2.10/buzzer']
+
+    response = client.post('/deactivate_buzzer', json={'device_id': device_id})
+    assert response.status_code == 202
+    assert wait_for(server, lambda: len(board.posts) == 2)
+    assert board.posts[-1] == 'http://192.0.2.10/buzzer/deactivate'
+
+    anonymous = server.app.test_client()
+    assert anonymous.post('/activate_buzzer', json={'device_id': device_id}).status_code == 401
+    assert anonymous.get(status_url).status_code == 401
+
+
+def test_only_fresh_readings_drive_the_buzzer(server, client, add_device, board):
+    device_id = add_device(host='192.0.2.11')
+    client.post('/modify_device', data={'device_id': device_id, 'temperature_limit': 30})
+    now = time.time()
+
+    backlog = [{'timestamp': now - 86400 + i, 'temperature': 50} for i in range(5)]
+    response = client.post('/api/readings', json={'device_id': device_id, 'readings': backlog})
+    assert response.get_json()['accepted'] == 5
+    server.socketio.sleep(0.2)
+    assert board.posts == []
+
+    fresh = [{'timestamp': now - 5 + i, 'temperature': 50} for i in range(5)]
+    client.post('/api/readings', json={'device_id': device_id, 'readings': fresh})
+    assert wait_for(server, lambda: board.posts == ['http://192.0.2.11/buzzer'])
+
+
+def test_admin_rights_follow_the_flag_not_the_name(server, client):
+    assert client.get('/admin/profiling').status_code == 200
+    # A renamed admin stays one; the name 'admin' alone grants nothing
+    with server.app.app_context():
+        email = server.User.query.filter_by(username='admin').one().email
+    form = {'email': email, 'password': '', 'theme': 'light'}
+    client.post('/settings', data=dict(form, username='root'))
+    with server.app.app_context():
+        assert server.User.query.filter_by(username='root').one().is_admin
+    assert client.get('/admin/profiling').status_code == 200
+
+    other = server.app.test_client()
+    other.post('/signup', data={'username': 'admin', 'email': 'impostor@example.com', 'password': 'secret123'})
+    other.post('/login', data={'login_id': 'admin', 'password': 'secret123'})
+    assert other.get('/admin/profiling').status_code == 403
+
+    runner = server.app.test_cli_runner()
+    assert runner.invoke(args=['set-admin', 'admin']).exit_code == 0
+    assert other.get('/admin/profiling').status_code == 200
+    assert runner.invoke(args=['set-admin', 'admin', '--revoke']).exit_code == 0
+    assert other.get('/admin/profiling').status_code == 403
+
+    # Put the names back for the other tests
+    with server.app.app_context():
+        server.db.session.delete(server.User.query.filter_by(username='admin').one())
+        server.db.session.commit()
+    client.post('/settings', data=dict(form, username='admin'))
+
+
+def test_create_app_refuses_late_config(server):
+    assert server.create_app() is server.app
+    with pytest.raises(RuntimeError):
+        server.create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+
+
+def test_failed_queries_leave_no_timer_behind(server):
+    with server.app.app_context(), server.db.engine.connect() as connection:
+        with pytest.raises(Exception):
+            connection.execute(server.db.text('SELECT * FROM no_such_table'))
+        connection.rollback()
+        connection.execute(server.db.text('SELECT 1'))
+        assert not connection.info.get('query_started')
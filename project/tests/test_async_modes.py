@@ -0,0 +1,25 @@
+"""Runs test_app.py once per concurrency mode.
+
+eventlet and gevent monkey-patch the standard library when app is first
+imported (see runtime.py), so every mode gets its own interpreter.
+"""
+import importlib.util
+import os
+import subprocess
+import sys
+
+import pytest
+
+from runtime import ASYNC_MODES
+
+SUITE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_app.py')
+
+
+@pytest.mark.parametrize('mode', ASYNC_MODES)
+def test_app_in_mode(mode):
+    if mode != 'threading' and importlib.util.find_spec(mode) is None:
+        pytest.skip(f'{mode} is not installed')
+    result = subprocess.run([sys.executable, '-m', 'pytest', '-q', '-p', 'no:cacheprovider', SUITE],
+                            env=dict(os.environ, ASYNC_MODE=mode), capture_output=True, text=True,
+                            timeout=300)
+    assert result.returncode == 0, result.stdout + result.stderr
@@ -0,0 +1,86 @@
+from broadcast import FrameBatcher, compact, expand, view_devices, view_room
+
+
+class Recorder:
+    """socketio stand-in that keeps what was emitted"""
+
+    def __init__(self):
+        self.emitted = []
+
+    def emit(self, event, data, to=None):
+        self.emitted.append((to, data))
+
+    def start_background_task(self, target):
+        pass
+
+
+def frames(socketio):
+    """The (room, frame) pairs emitted since the last call"""
+    sent = socketio.emitted
+    socketio.emitted = []
+    return sent
+
+
+def test_compact_round_trip():
+    reading = {'temperature': 21.456, 'humidity': 40, 'light': None, 'smoke': 0}
+    assert compact(reading) == {'t': 21.46, 'h': 40, 's': 0}
+    assert expand(compact(reading)) == {'temperature': 21.46, 'humidity': 40, 'smoke': 0}
+
+
+def test_only_changed_fields_are_sent():
+    socketio = Recorder()
+    batcher = FrameBatcher(socketio, keyframe_every=0)
+    batcher.publish(1, {'temperature': 20, 'humidity': 40})
+    batcher.flush()
+    assert [f['d'] for _, f in frames(socketio)] == [{'1': {'t': 20, 'h': 40}}]
+
+    batcher.publish(1, {'temperature': 21, 'humidity': 40})
+    batcher.flush()
+    assert [f['d'] for _, f in frames(socketio)] == [{'1': {'t': 21}}]
+
+    batcher.publish(1, {'temperature': 21, 'humidity': 40})
+    assert batcher.flush() == 0
+
+
+def test_latest_reading_of_a_tick_wins():
+    socketio = Recorder()
+    batcher = FrameBatcher(socketio, keyframe_every=0)
+    batcher.publish(1, {'temperature': 20})
+    batcher.publish(1, {'temperature': 22})
+    batcher.flush()
+    assert [f['d'] for _, f in frames(socketio)] == [{'1': {'t': 22}}]
+
+
+def test_keyframe_resends_everything():
+    socketio = Recorder()
+    batcher = FrameBatcher(socketio, keyframe_every=2)
+    batcher.publish(1, {'temperature': 20, 'humidity': 40})
+    batcher.flush()
+    frames(socketio)
+    batcher.flush()
+    [(_, frame)] = frames(socketio)
+    assert frame['full'] and frame['d'] == {'1': {'t': 20, 'h': 40}}
+
+
+def test_one_frame_per_view_room():
+    socketio = Recorder()
+    mine, theirs = view_room([2, 1]), view_room([3])
+    assert mine == 'view:1,2' and view_devices(mine) == ['1', '2']
+    batcher = FrameBatcher(socketio, keyframe_every=0,
+                           rooms=lambda: {room: view_devices(room) for room in (mine, theirs)})
+    for device_id in (1, 2, 3):
+        batcher.publish(device_id, {'temperature': 20 + device_id})
+    assert batcher.flush() == 2
+    sent = dict(frames(socketio))
+    assert sent[mine]['d'] == {'1': {'t': 21}, '2': {'t': 22}}
+    assert sent[theirs]['d'] == {'3': {'t': 23}}
+
+
+def test_snapshot_and_forget():
+    batcher = FrameBatcher(Recorder())
+    batcher.publish(1, {'temperature': 20, 'humidity': 40})
+    batcher.publish(1, {'temperature': 21})
+    batcher.publish(2, {'temperature': 30})
+    assert batcher.snapshot([1])['d'] == {'1': {'t': 21, 'h': 40}}
+    batcher.forget(1)
+    assert batcher.snapshot()['d'] == {'2': {'t': 30}}
@@ -0,0 +1,45 @@
+import history
+from test_rollup import START, Reading, session  # noqa: F401  (shared fixture)
+
+
+def test_downsampled_returns_raw_points(session):
+    raw = dict(session.query(Reading.ts, Reading.temperature).all())
+    series = history.downsampled(session, Reading, 1, 'temperature', START, START + 3 * 86400, 100)
+
+    assert len(series) == 100
+    assert [p['timestamp'] for p in series] == sorted(p['timestamp'] for p in series)
+    assert all(raw[p['timestamp']] == p['value'] for p in series)
+
+
+def test_downsampled_keeps_a_spike(session):
+    session.add(Reading(device_id=1, ts=START + 86400.5, temperature=99))
+    session.flush()
+    try:
+        series = history.downsampled(session, Reading, 1, 'temperature', START, START + 3 * 86400, 50)
+        assert {'timestamp': START + 86400.5, 'value': 99} in series
+    finally:
+        session.rollback()
+
+
+def test_lttb_keeps_the_ends_and_the_extremes():
+    ts = list(range(1000))
+    values = [0.0] * 1000
+    values[400], values[700] = 10.0, -10.0
+    kept_ts, kept = history.lttb(ts, values, 20)
+
+    assert len(kept_ts) == 20
+    assert kept_ts[0] == 0 and kept_ts[-1] == 999
+    assert list(kept_ts) == sorted(kept_ts)
+    assert 10.0 in kept and -10.0 in kept
+
+
+def test_lttb_leaves_short_series_alone():
+    ts, values = [1, 2, 3], [5, 6, 7]
+    assert [list(a) for a in history.lttb(ts, values, 3)] == [ts, values]
+    assert [list(a) for a in history.lttb(ts, values, 2)] == [ts, values]
+
+
+def test_lttb_picks_the_largest_triangle():
+    # One bucket between the ends: the point furthest from the line wins
+    kept_ts, kept = history.lttb([0, 1, 2, 3, 4], [0, 1, 5, 1, 0], 3)
+    assert list(kept_ts) == [0, 2, 4] and list(kept) == [0, 5, 0]
@@ -0,0 +1,61 @@
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from ingest import ReadingBuffer
+
+
+class Loop:
+    def sleep(self, seconds):
+        pass
+
+    def start_background_task(self, target):
+        pass
+
+
+class FlakyDatabase:
+    """flush(rows) that fails with the given errors first, then stores the rows"""
+
+    def __init__(self, *errors, bad=()):
+        self.errors = list(errors)
+        self.bad = set(bad)
+        self.calls = []
+        self.stored = []
+
+    def __call__(self, rows):
+        self.calls.append(len(rows))
+        if self.errors:
+            raise self.errors.pop(0)
+        if self.bad & {row['ts'] for row in rows}:
+            raise IntegrityError('INSERT', {}, Exception('bad row'))
+        self.stored.extend(rows)
+
+
+def rows(n):
+    return [{'device_id': 1, 'ts': float(i)} for i in range(n)]
+
+
+def test_unavailable_database_keeps_the_batch_together():
+    locked = OperationalError('INSERT', {}, Exception('database is locked'))
+    database = FlakyDatabase(locked, locked)
+    buffer = ReadingBuffer(Loop(), database, retries=3)
+    buffer.add(rows(8))
+    assert buffer.flush() == 8
+    assert database.calls == [8, 8, 8]
+
+
+def test_batch_is_kept_when_the_database_stays_down():
+    database = FlakyDatabase(*[OperationalError('INSERT', {}, Exception('down'))] * 3)
+    buffer = ReadingBuffer(Loop(), database, retries=2)
+    buffer.add(rows(8))
+    assert buffer.flush() == 0
+    assert database.calls == [8, 8, 8] and len(buffer) == 8
+    buffer.add(rows(2))
+    assert buffer.flush() == 10
+    assert [row['ts'] for row in database.stored[:8]] == [float(i) for i in range(8)]
+
+
+def test_rejected_rows_are_split_out():
+    database = FlakyDatabase(bad={5.0})
+    buffer = ReadingBuffer(Loop(), database)
+    buffer.add(rows(8))
+    assert buffer.flush() == 7
+    assert 5.0 not in {row['ts'] for row in database.stored}
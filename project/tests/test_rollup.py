@@ -0,0 +1,115 @@
+import random
+
+import pytest
+from sqlalchemy import Column, Float, Integer, String, UniqueConstraint, create_engine
+from sqlalchemy.orm import Session, declarative_base
+
+import history
+import rollup
+
+Base = declarative_base()
+
+
+class Reading(Base):
+    __tablename__ = 'reading'
+    id = Column(Integer, primary_key=True)
+    device_id = Column(Integer, nullable=False)
+    ts = Column(Float, nullable=False)
+    temperature = Column(Float)
+    humidity = Column(Float)
+    light = Column(Float)
+    smoke = Column(Float)
+
+
+class Rollup(Base):
+    __tablename__ = 'rollup'
+    id = Column(Integer, primary_key=True)
+    device_id = Column(Integer, nullable=False)
+    metric = Column(String(16), nullable=False)
+    resolution = Column(Integer, nullable=False)
+    bucket = Column(Integer, nullable=False)
+    min = Column(Float, nullable=False)
+    max = Column(Float, nullable=False)
+    sum = Column(Float, nullable=False)
+    count = Column(Integer, nullable=False)
+    __table_args__ = (UniqueConstraint('device_id', 'metric', 'resolution', 'bucket'),)
+
+
+START = 1_700_000_000.0
+
+
+@pytest.fixture(scope='module')
+def session():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    rng = random.Random(3)
+    rows = []
+    ts = START
+    while ts < START + 3 * 86400:
+        rows.append({'device_id': 1, 'ts': ts, 'temperature': round(rng.gauss(22, 4), 2),
+                     'humidity': None, 'light': None, 'smoke': None})
+        ts += rng.uniform(5, 120)
+    with Session(engine) as session:
+        session.execute(Reading.__table__.insert(), rows)
+        # Two batches, so merge() has to combine them
+        rollup.merge(session, Rollup, rollup.aggregate(rows[::2]))
+        rollup.merge(session, Rollup, rollup.aggregate(rows[1::2]))
+        session.commit()
+        yield session
+
+
+@pytest.mark.parametrize('start, end, points', [
+    (START + 1234.5, START + 2 * 86400 - 77, 200),   # unaligned edges, minute rollups
+    (START + 100, START + 3 * 86400, 30),           # hour rollups
+    (START - 5000, START + 3 * 86400 + 5000, 2),    # day rollups, range wider than the data
+    (START + 59, START + 61 + 3600, 7),             # bucket width not a multiple of a minute
+])
+def test_rollups_match_raw_rows(session, start, end, points):
+    resolution = rollup.pick_resolution((end - start) / points)
+    start, end, points = rollup.align(start, end, points, resolution)
+    raw = history.bucketed(session, Reading, 1, 'temperature', start, end, points)
+    rolled = rollup.bucketed(session, Rollup, 1, 'temperature', resolution, start, end, points)
+
+    assert [b['timestamp'] for b in rolled] == [b['timestamp'] for b in raw]
+    for got, want in zip(rolled, raw):
+        assert (got['count'], got['min'], got['max']) == (want['count'], want['min'], want['max'])
+        assert got['mean'] == pytest.approx(want['mean'])
+
+
+def test_align_covers_the_requested_range():
+    start, end, buckets = rollup.align(START + 90, START + 7300, 10, rollup.MINUTE)
+    width = (end - start) / buckets
+    assert start <= START + 90 and end >= START + 7300
+    assert start % rollup.MINUTE == 0 and width % rollup.MINUTE == 0
+    assert buckets <= 11
+
+
+def test_unaligned_grid_is_refused(session):
+    with pytest.raises(ValueError):
+        rollup.bucketed(session, Rollup, 1, 'temperature', rollup.MINUTE, START + 1, START + 3601, 10)
+
+
+def test_aggregate_folds_readings_into_every_resolution():
+    hour = int(START // rollup.HOUR) * rollup.HOUR
+    rows = [{'device_id': 1, 'ts': hour + 10, 'temperature': 20.0, 'smoke': None},
+            {'device_id': 1, 'ts': hour + 50, 'temperature': 24.0, 'smoke': 3.0},
+            {'device_id': 1, 'ts': hour + 70, 'temperature': 18.0},
+            {'device_id': 2, 'ts': hour + 10, 'temperature': 99.0}]
+    out = rollup.aggregate(rows)
+
+    assert out[(1, 'temperature', rollup.MINUTE, hour)] == [20.0, 24.0, 44.0, 2]
+    assert out[(1, 'temperature', rollup.MINUTE, hour + 60)] == [18.0, 18.0, 18.0, 1]
+    assert out[(1, 'temperature', rollup.HOUR, hour)] == [18.0, 24.0, 62.0, 3]
+    assert out[(1, 'smoke', rollup.DAY, int(hour // rollup.DAY) * rollup.DAY)] == [3.0, 3.0, 3.0, 1]
+    assert out[(2, 'temperature', rollup.MINUTE, hour)] == [99.0, 99.0, 99.0, 1]
+    assert not any(key[1] in ('light', 'humidity') for key in out)
+
+
+def test_merge_combines_with_stored_rollups():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        rollup.merge(session, Rollup, {(1, 'temperature', rollup.MINUTE, 60): [20.0, 24.0, 44.0, 2]})
+        rollup.merge(session, Rollup, {(1, 'temperature', rollup.MINUTE, 60): [18.0, 21.0, 39.0, 2]})
+        row = session.query(Rollup).one()
+        assert (row.min, row.max, row.sum, row.count) == (18.0, 24.0, 83.0, 4)
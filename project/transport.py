@@ -0,0 +1,66 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class DeviceClient:
+    """HTTP client shared by everything that talks to the boards.
+
+    Each device host gets one keep-alive session with a small connection
+    pool, so polling and commands reuse connections instead of opening one
+    per call. Under eventlet/gevent the patched sockets make every call
+    yield while waiting on the network; in threading mode callers should
+    run on a bounded pool.
+
+    ``on_request(host, method, seconds, error)`` is called after every
+    request; ``error`` is None or a short reason such as 'timeout' or '503'.
+    """
+
+    def __init__(self, timeout=3, connections_per_host=2, on_request=None):
+        self.timeout = timeout
+        self.connections_per_host = connections_per_host
+        self.on_request = on_request
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def session(self, url):
+        host = urlsplit(url).netloc
+        session = self._sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            session.mount('http://', HTTPAdapter(pool_connections=1,
+                                                 pool_maxsize=self.connections_per_host))
+            with self._lock:
+                session = self._sessions.setdefault(host, session)
+        return session
+
+    def request(self, method, url, timeout=None):
+        started = time.perf_counter()
+        error = None
+        try:
+            response = self.session(url).request(method, url, timeout=timeout or self.timeout)
+            if response.status_code >= 400:
+                error = str(response.status_code)
+            return response
+        except requests.Timeout:
+            error = 'timeout'
+            raise
+        except requests.RequestException:
+            error = 'connection'
+            raise
+        finally:
+            if self.on_request is not None:
+                self.on_request(urlsplit(url).netloc, method, time.perf_counter() - started, error)
+
+    def get_json(self, url, timeout=None):
+        """JSON body of a GET, or None unless the device answered 200"""
+        response = self.request('GET', url, timeout)
+        if response.status_code != 200:
+            return None
+        return response.json()
+
+    def post(self, url, timeout=None):
+        return self.request('POST', url, timeout)